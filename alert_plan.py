@@ -0,0 +1,358 @@
+# alert_plan.py
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta
+from snapshot import STATUS_OFF, STATUS_POSSIBLE, compile_schedule, format_minutes
+
+# Типи сповіщень (ті самі рядки, що database.NOTIFY_*)
+from subscribers import NOTIFY_OUTAGE, NOTIFY_RETURN
+
+# === ТИПИ ЗАПЛАНОВАНИХ ДІЙ ===
+ALERT = "alert"  # Сповіщення черзі (попередження / момент включення)
+DIGEST = "digest"  # Ранкове зведення о 06:00
+MIDNIGHT = "midnight"  # Скидання історії сповіщень о 00:00
+
+# За скільки хвилин попереджати
+PRE_ALERT_MINUTES = (5, 15, 30, 60)
+DIGEST_TIME = timedelta(hours=6)
+# Сповіщення, що запізнилось більше ніж на стільки (сон ноутбука, зависання), не надсилається
+CATCH_UP = timedelta(minutes=5)
+# "Світло повертається!" актуальне в черзі розсилки ще стільки часу
+MOMENT_ALERT_TTL = timedelta(minutes=15)
+# Максимальний сон: перевіряємо план хоча б раз на 5 хв (на випадок переводу годинника)
+MAX_SLEEP = 300
+
+
+class AlertItem:
+    """Одна запланована дія: що, коли і для якої черги."""
+
+    __slots__ = (
+        "fire_at",
+        "action",
+        "key",
+        "day",
+        "alert_id",
+        "notify",
+        "offset",
+        "text",
+        "event_at",
+        "deadline",
+    )
+
+    def __init__(
+        self,
+        fire_at,
+        action,
+        key=None,
+        day=None,
+        alert_id=None,
+        notify=None,
+        offset=None,
+        text=None,
+        event_at=None,
+        deadline=None,
+    ):
+        self.fire_at = fire_at
+        self.action = action
+        self.key = key
+        self.day = day
+        self.alert_id = alert_id
+        self.notify = notify
+        self.offset = offset
+        self.text = text
+        self.event_at = event_at
+        self.deadline = deadline
+
+    def __repr__(self):
+        return f"<AlertItem {self.action} {self.alert_id or ''} @ {self.fire_at:%d.%m %H:%M}>"
+
+
+def find_next_outage(current_time_str, today_intervals, tomorrow_intervals):
+    """Шукає час наступного відключення."""
+    for start, end in today_intervals:
+        if start > current_time_str:
+            return f"сьогодні о {start}"
+
+    if tomorrow_intervals:
+        start, end = tomorrow_intervals[0]
+        return f"завтра о {start}"
+
+    return None
+
+
+def _day_alerts(key, day, schedule, next_schedule, prev_schedule):
+    """Сповіщення черги для однієї дати (абсолютний час, без "HH:MM"-порівнянь)."""
+    items = []
+    base = datetime.strptime(day, "%Y-%m-%d")
+    off = schedule.interval_minutes(STATUS_OFF)
+    next_off = next_schedule.interval_minutes(STATUS_OFF) if next_schedule else ()
+    prev_off = prev_schedule.interval_minutes(STATUS_OFF) if prev_schedule else ()
+    off_str = schedule.intervals(STATUS_OFF)
+    next_off_str = next_schedule.intervals(STATUS_OFF) if next_schedule else ()
+
+    def pre_alerts(event_min, kind, notify, text):
+        event_at = base + timedelta(minutes=event_min)
+        for mins in PRE_ALERT_MINUTES:
+            items.append(
+                AlertItem(
+                    event_at - timedelta(minutes=mins),
+                    ALERT,
+                    key,
+                    day,
+                    f"{key}_{day}_{format_minutes(event_min)}_{kind}_{mins}",
+                    notify,
+                    mins,
+                    text,
+                    event_at=event_at,
+                )
+            )
+
+    for start, end in off:
+        end_str = format_minutes(end)
+
+        # А) ПОПЕРЕДЖЕННЯ ПРО ВІДКЛЮЧЕННЯ
+        if start == 0:
+            # Відключення з 00:00 — продовження вчорашнього не анонсуємо
+            if not (prev_off and prev_off[-1][1] == 24 * 60):
+                pre_alerts(
+                    0,
+                    "out_pre",
+                    NOTIFY_OUTAGE,
+                    f"⏳ **Скоро відключення (через {{mins}} хв, о 00:00).**\nСвітла не буде до **{end_str}**.",
+                )
+        else:
+            actual_end = end_str
+            if end == 24 * 60 and next_off and next_off[0][0] == 0:
+                actual_end = (
+                    "кінця завтрашньої доби (24:00)"
+                    if next_off[0][1] == 24 * 60
+                    else f"завтра до {format_minutes(next_off[0][1])}"
+                )
+            pre_alerts(
+                start,
+                "out_pre",
+                NOTIFY_OUTAGE,
+                f"⏳ **Скоро відключення (через {{mins}} хв).**\nСвітла не буде до **{actual_end}**.",
+            )
+
+        if end == 24 * 60:
+            continue
+
+        # Б) ПОПЕРЕДЖЕННЯ ПРО ВКЛЮЧЕННЯ
+        pre_alerts(
+            end,
+            "ret_pre",
+            NOTIFY_RETURN,
+            f"💡 **Світло з'явиться орієнтовно через {{mins}} хв (о {end_str}).**",
+        )
+
+        # В) МОМЕНТ ВКЛЮЧЕННЯ
+        next_outage = find_next_outage(end_str, off_str, next_off_str)
+        next_info = (
+            f"Наступне відключення: **{next_outage}**."
+            if next_outage
+            else "✅ Далі без відключень."
+        )
+        fire_at = base + timedelta(minutes=end)
+        items.append(
+            AlertItem(
+                fire_at,
+                ALERT,
+                key,
+                day,
+                f"{key}_{day}_{end_str}_on",
+                NOTIFY_RETURN,
+                None,
+                f"⚡️ **Світло повертається!**\n"
+                f"Включення за графіком ({end_str}).\n"
+                f"{next_info}",
+                deadline=fire_at + MOMENT_ALERT_TTL,
+            )
+        )
+
+    # Г) МОЖЛИВІ ВІДКЛЮЧЕННЯ (сіра зона) — прив'язані до налаштувань notify_outage
+    for start, end in schedule.interval_minutes(STATUS_POSSIBLE):
+        if start == 0:
+            continue
+        pre_alerts(
+            start,
+            "poss_pre",
+            NOTIFY_OUTAGE,
+            f"⚠️ **Увага! Через {{mins}} хв можливе відключення.**\nСіра зона графіку (до {format_minutes(end)}).",
+        )
+    return items
+
+
+def build_queue_alerts(key, data):
+    """Усі сповіщення черги з запису schedules_cache ({"date", "today", "tomorrow"})."""
+    day = data.get("date")
+    today_sch = data.get("today")
+    if not day or not today_sch:
+        return []
+    today_sch = compile_schedule(today_sch)
+    tom_sch = compile_schedule(data["tomorrow"]) if data.get("tomorrow") else None
+    tomorrow = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime(
+        "%Y-%m-%d"
+    )
+
+    items = _day_alerts(key, day, today_sch, tom_sch, None)
+    if tom_sch:
+        items.extend(_day_alerts(key, tomorrow, tom_sch, None, today_sch))
+    return items
+
+
+def _signature(data):
+    """Що впливає на план черги: дата і відбитки графіків на сьогодні/завтра."""
+    today_sch = data.get("today")
+    tom_sch = data.get("tomorrow")
+    return (
+        data.get("date"),
+        compile_schedule(today_sch).fingerprint if today_sch else None,
+        compile_schedule(tom_sch).fingerprint if tom_sch else None,
+    )
+
+
+class AlertPlan:
+    """Купа (heap) запланованих сповіщень з абсолютним часом спрацювання.
+
+    План черги перебудовується лише коли змінився її графік (refresh).
+    Старі елементи не видаляються з купи — вони відкидаються при виборці
+    за номером покоління черги (ліниве видалення).
+    wanted(key) — чи планувати чергу взагалі (напр. лише черги з підписниками).
+    """
+
+    def __init__(self, wanted=None):
+        self._wanted = wanted
+        self._heap = []
+        self._seq = itertools.count()
+        self._gen = {}  # { key: покоління плану }
+        self._signatures = {}  # { key: _signature(data) }
+        self._counts = {}  # { key: скільки елементів поточного покоління в купі }
+        self._stale = 0
+        self._changed = asyncio.Event()
+        self._daily_planned = False
+
+    def __len__(self):
+        return len(self._heap) - self._stale
+
+    def _push(self, item, gen=0):
+        heapq.heappush(self._heap, (item.fire_at, next(self._seq), gen, item))
+
+    def _schedule_daily(self, now):
+        """Наступні ранкове зведення (06:00) і північ."""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        digest_at = midnight + DIGEST_TIME
+        if digest_at <= now:
+            digest_at += timedelta(days=1)
+        self._push(AlertItem(digest_at, DIGEST))
+        self._push(AlertItem(midnight + timedelta(days=1), MIDNIGHT))
+
+    def refresh(self, cache, now=None):
+        """Перебудовує план для черг, чий графік змінився. Повертає кількість таких черг."""
+        now = now or datetime.now()
+        if not self._daily_planned:
+            self._schedule_daily(now)
+            self._daily_planned = True
+
+        changed = 0
+        for key in list(self._signatures):
+            if key not in cache:
+                self._drop(key)
+                changed += 1
+
+        for key, data in list(cache.items()):
+            if self._wanted is not None and not self._wanted(key):
+                if key in self._signatures:
+                    self._drop(key)
+                    changed += 1
+                continue
+            signature = _signature(data)
+            if self._signatures.get(key) == signature:
+                continue
+            self._drop(key)
+            try:
+                items = build_queue_alerts(key, data)
+            except Exception as e:
+                # Підпис не зберігаємо: наступний refresh спробує знову
+                print(f"⚠️ Alert plan error ({key}): {e}")
+                changed += 1
+                continue
+            self._signatures[key] = signature
+            gen = self._gen[key] = self._gen.get(key, 0) + 1
+            count = 0
+            for item in items:
+                # Давно минулі сповіщення не плануємо
+                if item.fire_at >= now - CATCH_UP:
+                    self._push(item, gen)
+                    count += 1
+            self._counts[key] = count
+            changed += 1
+
+        if changed:
+            self._compact()
+            self._changed.set()
+        return changed
+
+    def _drop(self, key):
+        self._stale += self._counts.pop(key, 0)
+        self._signatures.pop(key, None)
+        self._gen[key] = self._gen.get(key, 0) + 1
+
+    def _is_stale(self, gen, item):
+        return item.key is not None and gen != self._gen.get(item.key)
+
+    def _compact(self):
+        """Прибирає з купи застарілі покоління, коли їх стає забагато."""
+        if self._stale < 1000 or self._stale * 2 < len(self._heap):
+            return
+        self._heap = [e for e in self._heap if not self._is_stale(e[2], e[3])]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    def _discard_stale_top(self):
+        while self._heap and self._is_stale(self._heap[0][2], self._heap[0][3]):
+            heapq.heappop(self._heap)
+            self._stale = max(0, self._stale - 1)
+
+    def next_fire_at(self):
+        self._discard_stale_top()
+        return self._heap[0][0] if self._heap else None
+
+    async def wait_next(self):
+        """Спить до найближчого сповіщення або до зміни плану."""
+        fire_at = self.next_fire_at()
+        delay = MAX_SLEEP
+        if fire_at is not None:
+            delay = min(MAX_SLEEP, (fire_at - datetime.now()).total_seconds())
+        if delay > 0:
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def pop_due(self, now=None):
+        """Забирає всі елементи, час яких настав (запізнілі більше CATCH_UP — відкидає)."""
+        now = now or datetime.now()
+        due = []
+        while True:
+            self._discard_stale_top()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, _, gen, item = heapq.heappop(self._heap)
+            if item.key is not None:
+                self._counts[item.key] = self._counts.get(item.key, 1) - 1
+            if item.action == ALERT and (
+                now - item.fire_at > CATCH_UP
+                or (item.event_at is not None and item.event_at <= now)
+            ):
+                print(f"⚠️ Пропущено запізніле сповіщення: {item!r}")
+                continue
+            if item.action in (DIGEST, MIDNIGHT):
+                # Щоденні дії плануємо на наступну добу
+                self._push(
+                    AlertItem(item.fire_at + timedelta(days=1), item.action), gen
+                )
+            due.append(item)
+        return due
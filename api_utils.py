@@ -1,8 +1,11 @@
 # api_utils.py
 import aiohttp
 import asyncio
+import os
 import re
 import json
+import hashlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 from config import (
@@ -12,8 +15,17 @@ from config import (
     FAILOVER_TIMEOUT,
     RECOVERY_CHECK_INTERVAL,
     HOE_SITE_URL,
+    RENDER_CACHE_SIZE,
 )
 import database as db
+from snapshot import (
+    MINUTES_PER_DAY,
+    STATUS_OFF,
+    STATUS_ON,
+    ScheduleSnapshot,
+    compile_schedule,
+    parse_hhmm,
+)
 
 # Словник для конвертації місяців
 UA_MONTHS = {
@@ -52,21 +64,107 @@ api_state = {
     "last_emergency_regions": set(),  # регіони з екстреним режимом
 }
 
+# === СПІЛЬНА HTTP-СЕСІЯ (keep-alive для всіх джерел) ===
+# Одна сесія на весь час роботи бота: DNS, TCP і TLS не повторюються на кожне оновлення.
+# Створюється в main.py через init_http_session() і закривається при зупинці.
+_http_session = None
+
+HTTP_POOL_LIMIT = 20  # Загальна кількість з'єднань у пулі
+HTTP_POOL_LIMIT_PER_HOST = 4  # З'єднань на один хост (у нас 3 джерела)
+HTTP_DNS_CACHE_TTL = 300  # Секунд кешу DNS
+HTTP_KEEPALIVE_TIMEOUT = 120  # Скільки тримати вільне з'єднання відкритим
+
+
 # === КЕШ ДАНИХ (Захист від Thundering Herd) ===
-api_cache = {"data": None, "timestamp": None}
+api_cache = {"data": None, "timestamp": None, "snapshot": None}
 CACHE_TTL = 60  # Секунд (1 хвилина)
 
-import os
+# Поточне фонове оновлення (single-flight: всі конкурентні виклики чекають одну задачу)
+_refresh_task = None
+
+# === ЛОКАЛЬНА КОПІЯ КЕШУ НА ДИСКУ ===
+# Пишеться компактно, атомарно (temp + rename) і в окремому потоці, щоб не блокувати event loop
+CACHE_FILE = "api_cache.json"
+_persisted_digest = None  # sha256 останнього записаного вмісту
+
+
+def _read_cache_file():
+    """Читає api_cache.json (виконується в окремому потоці)."""
+    global _persisted_digest
+    if not os.path.exists(CACHE_FILE):
+        return None
+    with open(CACHE_FILE, "rb") as f:
+        raw = f.read()
+    _persisted_digest = hashlib.sha256(raw).hexdigest()
+    return json.loads(raw)
+
 
-if os.path.exists("api_cache.json"):
+async def load_cache_from_disk():
+    """Завантажує локальний кеш при запуску (без блокування event loop)."""
     try:
-        with open("api_cache.json", "r", encoding="utf-8") as f:
-            api_cache["data"] = json.load(f)
+        data = await asyncio.to_thread(_read_cache_file)
+        if data and api_cache["data"] is None:
+            _publish(data)
             print("💾 Локальний кеш api_cache.json успішно завантажено при запуску!")
     except Exception as e:
         print(f"⚠️ Помилка завантаження кешу з файлу: {e}")
 
 
+def _write_cache_file(data):
+    """Серіалізує і атомарно записує кеш. Пропускає запис, якщо вміст не змінився."""
+    global _persisted_digest
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest == _persisted_digest:
+        return False
+
+    tmp_path = f"{CACHE_FILE}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+    os.replace(tmp_path, CACHE_FILE)
+    _persisted_digest = digest
+    return True
+
+
+async def persist_cache(data):
+    """Зберігає знімок даних на диск в окремому потоці."""
+    try:
+        await asyncio.to_thread(_write_cache_file, data)
+    except Exception as e:
+        print(f"⚠️ Помилка запису {CACHE_FILE}: {e}")
+
+
+async def init_http_session():
+    """Створює спільну aiohttp-сесію з налаштованим пулом з'єднань."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        return _http_session
+
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    _http_session = aiohttp.ClientSession(connector=connector)
+    return _http_session
+
+
+async def close_http_session():
+    """Закриває спільну сесію (викликається при зупинці бота)."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+async def get_http_session():
+    """Повертає спільну сесію, створюючи її при першому зверненні."""
+    if _http_session is None or _http_session.closed:
+        return await init_http_session()
+    return _http_session
+
+
 def normalize_region_names(data):
     """Приводить назви регіонів до стандарту бота (для сумісності з базою)."""
     if not data or "regions" not in data:
@@ -87,46 +185,160 @@ def normalize_region_names(data):
     return data
 
 
-async def fetch_primary_api():
-    """Запит до основного DTEK Proxy API (нове)."""
+# === УМОВНІ ЗАПИТИ (ETag / Last-Modified / хеш вмісту) ===
+# Для кожного джерела пам'ятаємо валідатори сервера та хеш останньої відповіді.
+# Якщо сервер повернув 304 або байти ідентичні попереднім — нічого не декодуємо.
+_source_state = {
+    name: {
+        "etag": None,
+        "last_modified": None,
+        "charset": None,
+        "raw": None,  # Останнє тіло відповіді (bytes)
+        "digest": None,  # sha256 останнього тіла
+        "valid": False,  # Чи вдалося декодувати тіло з цим digest
+        # Об'єкт, декодований під час перевірки і ще не відданий у зборку
+        "data": None,
+    }
+    for name in ("primary", "backup", "hoe")
+}
+
+# Ключ останньої зборки: які джерела (і з яким digest) увійшли в опубліковані дані
+_last_build_key = None
+
+
+async def _conditional_get(source, url, timeout):
+    """GET з If-None-Match / If-Modified-Since. Повертає сирі байти або None.
+
+    На 304 повертає збережене тіло попередньої відповіді.
+    """
+    state = _source_state[source]
+    headers = {}
+    if state["raw"] is not None:
+        if state["etag"]:
+            headers["If-None-Match"] = state["etag"]
+        if state["last_modified"]:
+            headers["If-Modified-Since"] = state["last_modified"]
+
+    session = await get_http_session()
+    async with session.get(
+        url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as response:
+        if response.status == 304 and state["raw"] is not None:
+            return state["raw"]
+        if response.status != 200:
+            return response.status
+        raw = await response.read()
+        state["etag"] = response.headers.get("ETag")
+        state["last_modified"] = response.headers.get("Last-Modified")
+        state["charset"] = response.charset
+
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest != state["digest"]:
+        state["raw"] = raw
+        state["digest"] = digest
+        state["valid"] = None  # Ще не перевіряли новий вміст
+        state["data"] = None
+    return state["raw"]
+
+
+def _decode_primary(raw):
+    """Декодує відповідь основного API (body — JSON-рядок всередині JSON)."""
+    try:
+        payload = json.loads(raw)
+        # Подвійний парсинг: body — це JSON-рядок
+        body_str = payload.get("body", "{}")
+        if isinstance(body_str, str):
+            data = json.loads(body_str)
+        else:
+            data = body_str
+        # Нормалізація назв для сумісності
+        return normalize_region_names(data)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"⚠️ Primary API JSON Error: {e}")
+    except Exception as e:
+        print(f"❌ Primary API Error: {e}")
+    return None
+
+
+def _decode_backup(raw):
+    """Декодує відповідь резервного API."""
+    try:
+        return json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"⚠️ Backup API JSON Error: {e}")
+    except Exception as e:
+        print(f"❌ Backup API Error: {e}")
+    return None
+
+
+def _decode_hoe(raw):
+    """Декодує HTML сайту HOE у формат регіонів."""
+    charset = _source_state["hoe"]["charset"] or "utf-8"
+    return parse_hoe_site(raw.decode(charset, errors="replace"))
+
+
+_DECODERS = {
+    "primary": _decode_primary,
+    "backup": _decode_backup,
+    "hoe": _decode_hoe,
+}
+
+
+def _decode_source(source, raw):
+    """Декодує сире тіло джерела і запам'ятовує, чи воно валідне."""
+    data = _DECODERS[source](raw) or None
+    state = _source_state[source]
+    state["valid"] = data is not None
+    state["data"] = data
+    return data
+
+
+def _take_source_data(source, raw):
+    """Декодований об'єкт джерела для зборки.
+
+    Об'єкт, декодований під час перевірки, віддається один раз: merge_api_data
+    та інтеграція сайту змінюють дані на місці, тому повторна зборка з тим самим
+    тілом (змінилось інше джерело) декодує його заново.
+    """
+    state = _source_state[source]
+    data = state["data"]
+    if data is None:
+        data = _decode_source(source, raw)
+    state["data"] = None
+    return data
+
+
+def _is_source_ok(source, raw):
+    """Чи є відповідь джерела придатною (без повторного декодування, якщо вміст не змінився)."""
+    if raw is None:
+        return False
+    state = _source_state[source]
+    if state["valid"] is None:
+        _decode_source(source, raw)
+    return bool(state["valid"])
+
+
+async def _fetch_primary_raw():
+    """Умовний запит до основного DTEK Proxy API. Повертає сирі байти або None."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                PRIMARY_API_URL, timeout=aiohttp.ClientTimeout(total=15)
-            ) as response:
-                if response.status == 200:
-                    raw = await response.json()
-                    # Подвійний парсинг: body — це JSON-рядок
-                    body_str = raw.get("body", "{}")
-                    if isinstance(body_str, str):
-                        data = json.loads(body_str)
-                    else:
-                        data = body_str
-                    # Нормалізація назв для сумісності
-                    data = normalize_region_names(data)
-                    return data
-                else:
-                    print(f"⚠️ Primary API HTTP {response.status}")
+        result = await _conditional_get("primary", PRIMARY_API_URL, 15)
+        if isinstance(result, bytes):
+            return result
+        print(f"⚠️ Primary API HTTP {result}")
     except asyncio.TimeoutError:
         print("⚠️ Primary API: Timeout")
-    except json.JSONDecodeError as e:
-        print(f"⚠️ Primary API JSON Error: {e}")
     except Exception as e:
         print(f"❌ Primary API Error: {e}")
     return None
 
 
-async def fetch_backup_api():
-    """Запит до резервного API (попереднє джерело)."""
+async def _fetch_backup_raw():
+    """Умовний запит до резервного API. Повертає сирі байти або None."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                BACKUP_API_URL, timeout=aiohttp.ClientTimeout(total=15)
-            ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    print(f"⚠️ Backup API HTTP {response.status}")
+        result = await _conditional_get("backup", BACKUP_API_URL, 15)
+        if isinstance(result, bytes):
+            return result
+        print(f"⚠️ Backup API HTTP {result}")
     except asyncio.TimeoutError:
         print("⚠️ Backup API: Timeout")
     except Exception as e:
@@ -134,6 +346,17 @@ async def fetch_backup_api():
     return None
 
 
+async def _fetch_hoe_raw():
+    """Умовний запит до сайту HOE. Повертає сирі байти або None."""
+    try:
+        result = await _conditional_get("hoe", HOE_SITE_URL, 10)
+        if isinstance(result, bytes):
+            return result
+    except Exception as e:
+        print(f"Site Parser Error: {e}")
+    return None
+
+
 def merge_api_data(primary, backup):
     """Гібридне злиття: Primary (детальніші черги) + Backup (більше областей і дат).
 
@@ -202,33 +425,131 @@ def merge_api_data(primary, backup):
     return primary
 
 
-async def fetch_api_data():
-    """ГОЛОВНА ФУНКЦІЯ ОТРИМАННЯ ДАНИХ — Гібридний режим з Failover."""
-    global api_state, api_cache
-    now = datetime.now()
+async def _skip_source():
+    """Заглушка для джерела, яке в цьому циклі не запитується."""
+    return None
+
+
+def _publish(data, timestamp=None):
+    """Публікує нові дані: сирий dict + незмінний індексований знімок."""
+    api_cache["data"] = data
+    api_cache["snapshot"] = ScheduleSnapshot(data)
+    if timestamp is not None:
+        api_cache["timestamp"] = timestamp
+
+
+@db.on_system_config_change
+def _on_config_change(key, value):
+    """Сайт HOE увімкнули/вимкнули — наступний запит даних оновить кеш."""
+    if key == "hoe_site_enabled":
+        api_cache["timestamp"] = None
+
+
+async def fetch_snapshot(wait_fresh=False):
+    """Як fetch_api_data(), але повертає ScheduleSnapshot (або None, якщо даних немає)."""
+    await fetch_api_data(wait_fresh=wait_fresh)
+    return api_cache["snapshot"]
+
+
+async def fetch_api_data(wait_fresh=False):
+    """ГОЛОВНА ФУНКЦІЯ ОТРИМАННЯ ДАНИХ — кеш + single-flight оновлення.
 
-    # 1. Перевіряємо кеш (Захист від Thundering Herd)
+    - Кеш свіжий (< CACHE_TTL) — повертаємо його одразу.
+    - Кеш застарів, але дані є — повертаємо останній знімок і запускаємо ОДНЕ
+      фонове оновлення на всіх (stale-while-revalidate). Хендлери не чекають API.
+    - Даних ще немає або wait_fresh=True (check_updates) — чекаємо те саме спільне оновлення.
+    """
     if api_cache["timestamp"] is not None:
-        elapsed_cache = (now - api_cache["timestamp"]).total_seconds()
+        elapsed_cache = (datetime.now() - api_cache["timestamp"]).total_seconds()
         if elapsed_cache < CACHE_TTL:
             return api_cache["data"]
 
-    primary_data = None
-    backup_data = None
+    task = _start_refresh()
+    if api_cache["data"] is not None and not wait_fresh:
+        return api_cache["data"]
 
-    if api_state["active_source"] == "primary":
-        # === Активне джерело: ОСНОВНЕ (DTEK Proxy) ===
-        primary_data = await fetch_primary_api()
+    # shield: скасування одного з очікувачів не повинно зупиняти спільне оновлення
+    return await asyncio.shield(task)
+
+
+def _start_refresh():
+    """Запускає оновлення, якщо воно ще не йде (одне на весь процес)."""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_api_data_safe())
+    return _refresh_task
+
+
+async def _refresh_api_data_safe():
+    """Обгортка фонового оновлення: помилка не повинна залишити задачу з винятком."""
+    try:
+        return await _refresh_api_data()
+    except Exception as e:
+        print(f"❌ Помилка оновлення даних API: {e}")
+        api_cache["timestamp"] = datetime.now()
+        return api_cache["data"]
+
+
+async def _refresh_api_data():
+    """Гібридне оновлення з Failover.
+
+    Усі потрібні джерела (Primary, Backup, сайт HOE) запитуються паралельно,
+    тому оновлення триває стільки, скільки найповільніше джерело, а не суму їх таймаутів.
+    Рішення про failover приймаються вже після того, як усі запити завершились.
+    Якщо жодне з використаних джерел не змінилось (304 або ті самі байти) —
+    декодування, злиття і публікація нових даних пропускаються.
+    """
+    global api_state, api_cache, _last_build_key
+    now = datetime.now()
+
+    # 1. Визначаємо, які джерела потрібні в цьому циклі
+    in_primary_mode = api_state["active_source"] == "primary"
+    recovery_check = False
+    forced_primary = False
+
+    if not in_primary_mode:
+        if api_state["last_primary_check"]:
+            elapsed_since_check = (
+                now - api_state["last_primary_check"]
+            ).total_seconds()
+            recovery_check = elapsed_since_check >= RECOVERY_CHECK_INTERVAL
+        else:
+            recovery_check = True
+
+        # Резерв вже лежить 2+ години — основне знадобиться, якщо резерв не відповість і зараз
+        if not recovery_check and api_state["backup_down_since"]:
+            elapsed_backup = (now - api_state["backup_down_since"]).total_seconds()
+            forced_primary = elapsed_backup >= FAILOVER_TIMEOUT
+
+    if recovery_check:
+        print("🔍 Перевірка основного API (recovery check)...")
+
+    is_site_enabled = db.is_hoe_site_enabled()
+
+    # 2. Паралельні (умовні) запити до всіх джерел — поки що лише сирі байти
+    primary_raw, backup_raw, site_raw = await asyncio.gather(
+        (
+            _fetch_primary_raw()
+            if in_primary_mode or recovery_check or forced_primary
+            else _skip_source()
+        ),
+        _fetch_backup_raw(),
+        _fetch_hoe_raw() if is_site_enabled else _skip_source(),
+    )
 
-        if primary_data:
+    primary_ok = _is_source_ok("primary", primary_raw)
+    backup_ok = _is_source_ok("backup", backup_raw)
+    site_ok = _is_source_ok("hoe", site_raw)
+
+    if in_primary_mode:
+        # === Активне джерело: ОСНОВНЕ (DTEK Proxy) ===
+        if primary_ok:
             # Основне працює — скидаємо лічильники
             api_state["consecutive_primary_fails"] = 0
             api_state["primary_down_since"] = None
 
             # === ГІБРИД: Добираємо відсутні регіони з Backup ===
-            backup_data = await fetch_backup_api()
-            if backup_data:
-                primary_data = merge_api_data(primary_data, backup_data)
+            if backup_ok:
                 api_state["consecutive_backup_fails"] = 0
                 api_state["backup_down_since"] = None
         else:
@@ -251,28 +572,14 @@ async def fetch_api_data():
                 api_state["last_switch"] = now
                 api_state["total_switches"] += 1
 
-            # Так чи інакше — беремо з резерву
-            backup_data = await fetch_backup_api()
+            # Так чи інакше — беремо з резерву (backup вже отримано паралельно)
 
     else:
         # === Активне джерело: РЕЗЕРВНЕ ===
-        should_check_primary = False
-
-        if api_state["last_primary_check"]:
-            elapsed_since_check = (
-                now - api_state["last_primary_check"]
-            ).total_seconds()
-            if elapsed_since_check >= RECOVERY_CHECK_INTERVAL:
-                should_check_primary = True
-        else:
-            should_check_primary = True
-
-        if should_check_primary:
-            print("🔍 Перевірка основного API (recovery check)...")
-            primary_data = await fetch_primary_api()
+        if recovery_check:
             api_state["last_primary_check"] = now
 
-            if primary_data:
+            if primary_ok:
                 print("✅ Основне API відновлено! Повертаємось на PRIMARY.")
                 api_state["active_source"] = "primary"
                 api_state["primary_down_since"] = None
@@ -280,41 +587,49 @@ async def fetch_api_data():
                 api_state["last_switch"] = now
                 api_state["total_switches"] += 1
 
-        # Завжди беремо backup коли в резервному режимі
-        backup_data = await fetch_backup_api()
-
         # Лічильник помилок резервного
-        if backup_data:
+        if backup_ok:
             api_state["consecutive_backup_fails"] = 0
             api_state["backup_down_since"] = None
+            # Резерв ожив — примусовий запит до основного не знадобився
+            if forced_primary:
+                primary_ok = False
         else:
             api_state["consecutive_backup_fails"] += 1
             if api_state["backup_down_since"] is None:
                 api_state["backup_down_since"] = now
 
-            # Якщо резерв теж лежить 2+ години — пробуємо основне примусово
-            if api_state["backup_down_since"]:
-                elapsed_backup = (now - api_state["backup_down_since"]).total_seconds()
-                if elapsed_backup >= FAILOVER_TIMEOUT:
-                    # Використовуємо результат recovery check якщо він вже був
-                    if primary_data is None:
-                        print(
-                            "🔄 FAILOVER: Резервне теж не працює 2+ год! Пробуємо основне..."
-                        )
-                        primary_data = await fetch_primary_api()
-                    if primary_data:
-                        api_state["active_source"] = "primary"
-                        api_state["primary_down_since"] = None
-                        api_state["backup_down_since"] = None
-                        api_state["last_switch"] = now
-                        api_state["total_switches"] += 1
-                        print("✅ Основне API працює! Повернулись.")
-
-        # Гібрид в резервному режимі (якщо recovery check дав primary_data)
-        if primary_data and backup_data:
-            backup_data = merge_api_data(primary_data, backup_data)
+            # Якщо резерв теж лежить 2+ години — беремо основне (запитане паралельно)
+            if forced_primary:
+                print("🔄 FAILOVER: Резервне теж не працює 2+ год! Пробуємо основне...")
+                if primary_ok:
+                    api_state["active_source"] = "primary"
+                    api_state["primary_down_since"] = None
+                    api_state["backup_down_since"] = None
+                    api_state["last_switch"] = now
+                    api_state["total_switches"] += 1
+                    print("✅ Основне API працює! Повернулись.")
+
+    # === ЧИ ЗМІНИЛОСЬ ЩОСЬ? ===
+    # Ключ зборки: digest кожного використаного джерела (None — джерело не увійшло)
+    build_key = (
+        _source_state["primary"]["digest"] if primary_ok else None,
+        _source_state["backup"]["digest"] if backup_ok else None,
+        _source_state["hoe"]["digest"] if site_ok else None,
+    )
+    if build_key == _last_build_key and api_cache["data"] is not None:
+        # Вміст ідентичний опублікованому — нічого не декодуємо і не зливаємо
+        api_cache["timestamp"] = now
+        return api_cache["data"]
 
     # === ЗБИРАЄМО ФІНАЛЬНІ ДАНІ ===
+    # Змінені джерела вже декодовані в _is_source_ok — беремо ті самі об'єкти
+    primary_data = _take_source_data("primary", primary_raw) if primary_ok else None
+    backup_data = _take_source_data("backup", backup_raw) if backup_ok else None
+    site_data = _take_source_data("hoe", site_raw) if site_ok else None
+
+    if primary_data and backup_data:
+        primary_data = merge_api_data(primary_data, backup_data)
     data = primary_data or backup_data
 
     # === ОБРОБКА ЕКСТРЕНИХ ВІДКЛЮЧЕНЬ (emergency) ===
@@ -325,37 +640,29 @@ async def fetch_api_data():
                 current_emergency.add(region["name_ua"])
         api_state["last_emergency_regions"] = current_emergency
 
-    # === ІНТЕГРАЦІЯ САЙТУ HOE (як раніше) ===
-    is_site_enabled = await db.get_system_config("hoe_site_enabled", "1")
-
-    if is_site_enabled == "1":
-        try:
-            site_data = await fetch_hoe_site()
-            if site_data and data:
-                found = False
-                for region in data.get("regions", []):
-                    if region["name_ua"] == "Хмельницька":
-                        region["schedule"] = site_data["regions"][0]["schedule"]
-                        found = True
-                        break
-                if not found:
-                    data.setdefault("regions", []).append(site_data["regions"][0])
-            elif site_data and not data:
-                api_cache["data"] = site_data
-                api_cache["timestamp"] = now
-                return site_data
-        except Exception as e:
-            print(f"⚠️ Помилка інтеграції сайту HOE: {e}")
+    # === ІНТЕГРАЦІЯ САЙТУ HOE (як раніше, дані вже завантажені паралельно) ===
+    try:
+        if site_data and data:
+            found = False
+            for region in data.get("regions", []):
+                if region["name_ua"] == "Хмельницька":
+                    region["schedule"] = site_data["regions"][0]["schedule"]
+                    found = True
+                    break
+            if not found:
+                data.setdefault("regions", []).append(site_data["regions"][0])
+        elif site_data and not data:
+            _publish(site_data, now)
+            _last_build_key = build_key
+            return site_data
+    except Exception as e:
+        print(f"⚠️ Помилка інтеграції сайту HOE: {e}")
 
     # Оновлюємо кеш ТІЛЬКИ якщо ми отримали нові дані
     if data:
-        api_cache["data"] = data
-        api_cache["timestamp"] = now
-        try:
-            with open("api_cache.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"⚠️ Помилка запису api_cache.json: {e}")
+        _publish(data, now)
+        _last_build_key = build_key
+        await persist_cache(data)
     else:
         # Якщо API впало, ми повертаємо старий кеш (якщо він є), щоб бот не видавав "Дані оновлюються..."
         # Змінюємо timestamp, щоб наступний запит не пішов одразу ж (throttle)
@@ -408,15 +715,9 @@ def get_api_status():
 # === ОРИГІНАЛЬНА ЛОГІКА (парсинг/форматування — БЕЗ ЗМІН) ===
 
 
-async def fetch_hoe_site():
-    """Завантажує HTML сайту і парсить черги."""
+def parse_hoe_site(html):
+    """Парсить HTML сайту HOE у формат {"regions": [...]}."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(HOE_SITE_URL, timeout=10) as response:
-                if response.status != 200:
-                    return None
-                html = await response.text()
-
         soup = BeautifulSoup(html, "html.parser")
         post_div = soup.find("div", class_="post")
         if not post_div:
@@ -471,148 +772,64 @@ def parse_queue_line(text, date_str, schedule_map):
 
 def calculate_off_hours(schedule_data):
     """Рахує суму годин БЕЗ світла (гарантовані, статус 2)."""
-    if not schedule_data:
-        return 0.0
-
-    if isinstance(schedule_data, list):
-        total_minutes = 0
-        for item in schedule_data:
-            try:
-                start, end = item.split("-")
-                end_t = "23:59" if end == "24:00" else end
-                bonus = 1 if end == "24:00" else 0
-                t1 = datetime.strptime(start, "%H:%M")
-                t2 = datetime.strptime(end_t, "%H:%M")
-                diff = (t2 - t1).total_seconds() / 60 + bonus
-                if diff < 0:
-                    diff += 24 * 60
-                total_minutes += diff
-            except:
-                pass
-        return round(total_minutes / 60, 1)
-
-    elif isinstance(schedule_data, dict):
-        count = sum(1 for k, v in schedule_data.items() if k != "24:00" and v == 2)
-        return count * 0.5
-    return 0
-
-
-def calculate_possible_hours(schedule_data):
-    if isinstance(schedule_data, dict):
-        count = sum(1 for k, v in schedule_data.items() if k != "24:00" and v == 3)
-        return count * 0.5
-    return 0
-
-
-def calculate_on_hours(schedule_data):
-    """Рахує суму годин ЗІ світлом."""
-    if not schedule_data:
-        return 24.0  # Якщо даних немає (пусто), вважаємо що світло є
-
-    if isinstance(schedule_data, list):
-        off = calculate_off_hours(schedule_data)
-        return max(0, 24.0 - off)
-    elif isinstance(schedule_data, dict):
-        count = sum(1 for k, v in schedule_data.items() if k != "24:00" and v == 1)
-        # Якщо немає явних 1, але і немає 2/3, треба рахувати все інше як світло
-        # Але для простоти, якщо це API зі статусами, краще відштовхуватися від зворотного
-        off = calculate_off_hours(schedule_data)
-        poss = calculate_possible_hours(schedule_data)
-        return max(0, 24.0 - off - poss)
-    return 24.0
+    return compile_schedule(schedule_data).off_hours
 
 
 def parse_intervals(schedule_data, target_status=None, inverse=False):
-    if not schedule_data:
+    compiled = compile_schedule(schedule_data)
+    if not compiled:
         return []
 
-    if isinstance(schedule_data, list):
+    if compiled.kind == "ranges":
         if not inverse and (target_status == 2 or target_status is None):
-            result = []
-            for i in schedule_data:
-                try:
-                    s, e = i.split("-")
-                    result.append((s, e))
-                except:
-                    pass
-            return sorted(result)
-        else:
-            return []
-
-    elif isinstance(schedule_data, dict):
-        times = sorted([k for k in schedule_data.keys() if k != "24:00"])
-        intervals = []
-        current_start = None
-        in_interval = False
-
-        for t in times:
-            val = schedule_data.get(t)
-            is_active = False
-            if inverse:
-                is_active = val == 1
-            else:
-                if target_status is not None:
-                    is_active = val == target_status
-                else:
-                    is_active = False
-
-            if is_active and not in_interval:
-                current_start = t
-                in_interval = True
-            elif not is_active and in_interval:
-                if current_start:
-                    intervals.append((current_start, t))
-                in_interval = False
-                current_start = None
-
-        if in_interval and current_start:
-            intervals.append((current_start, "24:00"))
-        return intervals
-    return []
-
-
-def invert_schedule_for_site(blackout_intervals):
-    light_intervals = []
-    parsed_blackouts = []
-    for interval in blackout_intervals:
-        try:
-            start_s, end_s = interval.split("-")
-            sh, sm = map(int, start_s.split(":"))
-            start_min = sh * 60 + sm
-            if end_s == "24:00":
-                end_min = 1440
-            else:
-                eh, em = map(int, end_s.split(":"))
-                end_min = eh * 60 + em
-                if end_min == 0 and start_min > 0:
-                    end_min = 1440
-            parsed_blackouts.append((start_min, end_min))
-        except:
-            continue
+            return list(compiled.intervals(STATUS_OFF))
+        return []
 
-    parsed_blackouts.sort()
-    last_end = 0
-    for start, end in parsed_blackouts:
-        if start > last_end:
-            light_intervals.append((last_end, start))
-        last_end = max(last_end, end)
-
-    if last_end < 1440:
-        light_intervals.append((last_end, 1440))
-
-    result = []
-    for start, end in light_intervals:
-        s_h, s_m = divmod(start, 60)
-        e_h, e_m = divmod(end, 60)
-        s_str = f"{s_h:02}:{s_m:02}"
-        e_str = "24:00" if end == 1440 else f"{e_h:02}:{e_m:02}"
-        result.append((s_str, e_str))
-    return result
+    if inverse:
+        return list(compiled.intervals(STATUS_ON))
+    if target_status is None:
+        return []
+    return list(compiled.intervals(target_status))
+
+
+def _interval_hours(start, end):
+    """Тривалість інтервалу "HH:MM"–"HH:MM" у годинах (з переходом через північ)."""
+    start_min = parse_hhmm(start)
+    end_min = parse_hhmm(end)
+    if start_min is None or end_min is None or start_min == MINUTES_PER_DAY:
+        return None
+    if end_min == MINUTES_PER_DAY:
+        return (MINUTES_PER_DAY - start_min) / 60
+    return ((end_min - start_min) % MINUTES_PER_DAY) / 60
+
+
+# === НОВЕ: LRU-кеш готових текстів графіків ===
+# Ключ: (відбиток графіка, черга, дата, завтра?, режим). Новий знімок зі зміненим
+# графіком дає новий відбиток, тож старі тексти просто витісняються з кешу.
+_render_cache = OrderedDict()
 
 
 def format_message(
     schedule_json, queue_name, date_str, is_tomorrow=False, display_mode="blackout"
 ):
+    if schedule_json is None:
+        return _render_message(None, queue_name, date_str, is_tomorrow, display_mode)
+
+    compiled = compile_schedule(schedule_json)
+    key = (compiled.fingerprint, queue_name, date_str, is_tomorrow, display_mode)
+    text = _render_cache.get(key)
+    if text is not None:
+        _render_cache.move_to_end(key)
+        return text
+
+    text = _render_message(compiled, queue_name, date_str, is_tomorrow, display_mode)
+    _render_cache[key] = text
+    if len(_render_cache) > RENDER_CACHE_SIZE:
+        _render_cache.popitem(last=False)
+    return text
+
+
+def _render_message(schedule_json, queue_name, date_str, is_tomorrow, display_mode):
     dt = datetime.strptime(date_str, "%Y-%m-%d")
     days = {
         "Monday": "Понеділок",
@@ -632,30 +849,23 @@ def format_message(
         else:
             return "⏳ **Дані оновлюються...**"
 
+    compiled = compile_schedule(schedule_json)
     timeline = []
 
     # === ВИПРАВЛЕННЯ 1: Якщо режим "light", НЕ показуємо години відключень ===
     if display_mode != "light":
-        confirmed = parse_intervals(schedule_json, target_status=2)
+        confirmed = parse_intervals(compiled, target_status=2)
         for s, e in confirmed:
             timeline.append((s, e, 2))
 
-    if isinstance(schedule_json, dict):
-        possible = parse_intervals(schedule_json, target_status=3)
+    if compiled.kind == "slots":
+        possible = parse_intervals(compiled, target_status=3)
         for s, e in possible:
             timeline.append((s, e, 3))
 
     if display_mode == "light":
-        if isinstance(schedule_json, dict):
-            light_ints = parse_intervals(schedule_json, target_status=1, inverse=False)
-        else:
-            raw_blackouts = parse_intervals(
-                schedule_json, target_status=2, inverse=False
-            )
-            str_blackouts = [f"{s}-{e}" for s, e in raw_blackouts]
-            light_tuples = invert_schedule_for_site(str_blackouts)
-            light_ints = light_tuples
-        for s, e in light_ints:
+        # Для API — слоти зі статусом 1, для сайту — інверсія відключень
+        for s, e in compiled.light_intervals():
             timeline.append((s, e, 1))
 
     timeline.sort(key=lambda x: x[0])
@@ -677,9 +887,9 @@ def format_message(
     header = f"{emoji_header} **{header_text} {when}, {date_nice} ({day_name})**"
 
     # СТАТИСТИКА
-    total_off = calculate_off_hours(schedule_json)
-    total_possible = calculate_possible_hours(schedule_json)
-    total_on = calculate_on_hours(schedule_json)
+    total_off = compiled.off_hours
+    total_possible = compiled.possible_hours
+    total_on = compiled.on_hours
 
     # === ВИПРАВЛЕННЯ 2: Захист для "завтра" ===
     # Якщо це завтра і відключень 0 - вважаємо, що графік ще не дали
@@ -707,16 +917,11 @@ def format_message(
                 emoji = "❓"
                 suffix = ""
 
-            try:
-                t1 = datetime.strptime(start, "%H:%M")
-                if end == "24:00":
-                    diff = 24 - t1.hour - (t1.minute / 60)
-                else:
-                    t2 = datetime.strptime(end, "%H:%M")
-                    diff = (t2 - t1).seconds / 3600
+            diff = _interval_hours(start, end)
+            if diff is not None:
                 diff_str = f"{int(diff)}" if diff.is_integer() else f"{diff:.1f}"
                 lines.append(f"{emoji} **{start} — {end}**{suffix} _({diff_str} год)_")
-            except:
+            else:
                 lines.append(f"{emoji} **{start} — {end}**{suffix}")
         body = "\n".join(lines)
 
@@ -24,6 +24,46 @@ RECOVERY_CHECK_INTERVAL = int(os.getenv("RECOVERY_CHECK_INTERVAL"))
 
 # База даних
 DB_NAME = os.getenv("DB_NAME")
+# Кількість постійних з'єднань для читання (запис — завжди одне з'єднання)
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Розмір кешу підготовлених SQL-запитів на з'єднання
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+# === ПРОФІЛЬ SQLITE (PRAGMA) ===
+# WAL: читання не блокуються записом (важливо під час ранкової розсилки)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL").upper()
+# NORMAL у режимі WAL — безпечно і значно швидше за FULL
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+# Кеш сторінок на з'єднання (КБ)
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+# Тимчасові таблиці та індекси — в пам'яті
+DB_TEMP_STORE = os.getenv("DB_TEMP_STORE", "MEMORY").upper()
+# Memory-mapped I/O (байти, 0 — вимкнено)
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+# Скільки чекати на зайняту базу перед помилкою "database is locked" (мс)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
 
 # Інтервал оновлення
 UPDATE_INTERVAL = int(os.getenv("UPDATE_INTERVAL"))
+# === БЕКАПИ ===
+# Папка для стиснутих копій бази та скільки останніх копій у ній тримати (0 — не зберігати)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+
+# Як часто записувати накопичену статистику відключень у базу (сек)
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", "60"))
+
+# === КЕШ ТЕКСТІВ ГРАФІКІВ ===
+# Скільки готових повідомлень format_message тримати в пам'яті (LRU)
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2048"))
+
+# === РОЗСИЛКА ===
+# Глобальний ліміт Telegram (~30 повідомлень/с) і кількість паралельних відправників
+DELIVERY_RATE = float(os.getenv("DELIVERY_RATE", "30"))
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "16"))
+# Мінімальний інтервал між повідомленнями в один чат (с): особисті / групи (20 за хвилину)
+DELIVERY_CHAT_INTERVAL = float(os.getenv("DELIVERY_CHAT_INTERVAL", "1"))
+DELIVERY_GROUP_INTERVAL = float(os.getenv("DELIVERY_GROUP_INTERVAL", "3"))
+# Скільки разів пробувати відправити повідомлення при збоях мережі / сервера Telegram
+# (flood control не рахується: повідомлення чекає, поки не застаріє)
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
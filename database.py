@@ -1,197 +1,509 @@
 # database.py
+import asyncio
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
 import aiosqlite
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from config import DB_NAME
+from config import (
+    DB_NAME,
+    DB_READERS,
+    DB_STATEMENT_CACHE,
+    DB_JOURNAL_MODE,
+    DB_SYNCHRONOUS,
+    DB_CACHE_SIZE_KB,
+    DB_TEMP_STORE,
+    DB_MMAP_SIZE,
+    DB_BUSY_TIMEOUT_MS,
+)
+from subscribers import (
+    NOTIFY_CHANGES,
+    NOTIFY_OUTAGE,
+    NOTIFY_RETURN,
+    SubscriberIndex,
+)
+
+# === НОВЕ: ПУЛ З'ЄДНАНЬ ===
+# Одне з'єднання для запису (під замком) + кілька постійних з'єднань для читання.
+# З'єднання відкриваються один раз, а не на кожен запит.
+_writer_conn = None
+_writer_lock = asyncio.Lock()
+_reader_conns = []
+_readers = None  # asyncio.Queue вільних з'єднань для читання
+_pool_lock = asyncio.Lock()
+
+
+# === НОВЕ: ПРОФІЛЬ SQLITE ===
+# Допустимі значення PRAGMA (значення з .env підставляються в SQL, тому перевіряємо)
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_TEMP_STORES = {"DEFAULT", "FILE", "MEMORY"}
+
+
+def _pragma_choice(name, value, allowed, default):
+    if value in allowed:
+        return value
+    print(f"⚠️ Невірне значення {name}={value!r}, використовую {default}")
+    return default
+
+
+JOURNAL_MODE = _pragma_choice("DB_JOURNAL_MODE", DB_JOURNAL_MODE, _JOURNAL_MODES, "WAL")
+SYNCHRONOUS = _pragma_choice(
+    "DB_SYNCHRONOUS", DB_SYNCHRONOUS, _SYNCHRONOUS_MODES, "NORMAL"
+)
+TEMP_STORE = _pragma_choice("DB_TEMP_STORE", DB_TEMP_STORE, _TEMP_STORES, "MEMORY")
+
+
+async def _connect():
+    conn = await aiosqlite.connect(
+        DB_NAME,
+        cached_statements=DB_STATEMENT_CACHE,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+    )
+    # Налаштування на рівні з'єднання (journal_mode зберігається у файлі бази).
+    # execute_fetchall закриває курсор: незакритий PRAGMA тримає блокування
+    await conn.execute_fetchall(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    await conn.execute_fetchall(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    await conn.execute_fetchall(f"PRAGMA cache_size = {-int(DB_CACHE_SIZE_KB)}")
+    await conn.execute_fetchall(f"PRAGMA temp_store = {TEMP_STORE}")
+    await conn.execute_fetchall(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    return conn
+
+
+async def init_pool():
+    """Відкриває з'єднання пулу (повторний виклик нічого не робить)."""
+    global _writer_conn, _readers
+    async with _pool_lock:
+        if _writer_conn is not None:
+            return
+        writer = await _connect()
+        # Режим журналу встановлюємо до відкриття читачів
+        await writer.execute_fetchall(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+        readers = asyncio.Queue()
+        for _ in range(max(1, DB_READERS)):
+            conn = await _connect()
+            _reader_conns.append(conn)
+            readers.put_nowait(conn)
+        _writer_conn = writer
+        _readers = readers
+
+
+async def close_db():
+    """Закриває всі з'єднання пулу (при зупинці бота)."""
+    global _writer_conn, _readers
+    async with _pool_lock:
+        if _writer_conn is None:
+            return
+        async with _writer_lock:
+            await _writer_conn.close()
+        for conn in _reader_conns:
+            await conn.close()
+        _reader_conns.clear()
+        _writer_conn = None
+        _readers = None
+
+
+async def check_storage_profile():
+    """Самоперевірка при старті: логуємо фактичні налаштування SQLite."""
+    names = ("journal_mode", "synchronous", "cache_size", "temp_store")
+    names += ("mmap_size", "busy_timeout")
+    sync_names = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+    temp_names = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+
+    effective = {}
+    async with _reader() as db:
+        for name in names:
+            async with db.execute(f"PRAGMA {name}") as cur:
+                row = await cur.fetchone()
+                effective[name] = row[0] if row else None
+
+    effective["journal_mode"] = str(effective["journal_mode"]).upper()
+    effective["synchronous"] = sync_names.get(
+        effective["synchronous"], effective["synchronous"]
+    )
+    effective["temp_store"] = temp_names.get(
+        effective["temp_store"], effective["temp_store"]
+    )
+    print(
+        "🗄 SQLite: "
+        f"journal={effective['journal_mode']}, "
+        f"synchronous={effective['synchronous']}, "
+        f"cache={effective['cache_size']}, "
+        f"temp_store={effective['temp_store']}, "
+        f"mmap={effective['mmap_size']}, "
+        f"busy_timeout={effective['busy_timeout']}ms, "
+        f"readers={len(_reader_conns)}"
+    )
+    if effective["journal_mode"] != JOURNAL_MODE:
+        print(
+            f"⚠️ SQLite не увімкнув journal_mode={JOURNAL_MODE} "
+            f"(фактично {effective['journal_mode']})"
+        )
+    return effective
+
+
+# === НОВЕ: ОНЛАЙН-БЕКАП (SQLite backup API) ===
+def _backup_sync(dest_dir, keep):
+    """Копіює базу через backup API, стискає gzip і прибирає старі копії (у потоці)."""
+    os.makedirs(dest_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(DB_NAME))[0]
+    stamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    raw_path = os.path.join(dest_dir, f"{stem}_{stamp}.db")
+    gz_path = raw_path + ".gz"
+
+    # Узгоджений знімок: backup API читає базу в одній транзакції,
+    # паралельні записи бота (WAL) на копію не впливають
+    src = sqlite3.connect(DB_NAME)
+    dst = sqlite3.connect(raw_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+    digest = hashlib.sha256()
+    try:
+        with open(raw_path, "rb") as f_in, gzip.open(gz_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    finally:
+        os.remove(raw_path)
+    with open(gz_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    # Ротація: лишаємо тільки keep останніх архівів
+    if keep > 0:
+        archives = sorted(
+            name
+            for name in os.listdir(dest_dir)
+            if name.startswith(f"{stem}_") and name.endswith(".db.gz")
+        )
+        for name in archives[:-keep]:
+            os.remove(os.path.join(dest_dir, name))
 
+    return gz_path, os.path.getsize(gz_path), digest.hexdigest()
 
-async def init_db():
-    """Створює таблиці та безпечно оновлює структуру."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # === 1. ОСНОВНІ ДАНІ (НЕ ЧІПАЄМО) ===
-        # Таблиця для користувачів
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                region TEXT,
-                queue TEXT,
-                mode TEXT DEFAULT 'normal'
-            )
-        """)
 
-        # === МІГРАЦІЯ: ДОДАВАННЯ НАЛАШТУВАНЬ (Personalization 2.0) ===
-        # Додаємо нові колонки до існуючої таблиці users.
+async def backup_database(dest_dir, keep=7):
+    """Створює стиснутий бекап бази, не блокуючи event loop.
 
-        try:
-            # Час попередження про ВІДКЛЮЧЕННЯ (стандарт 5 хв)
-            await db.execute(
-                "ALTER TABLE users ADD COLUMN notify_before INTEGER DEFAULT 5"
-            )
-        except:
-            pass
+    Повертає (шлях до .db.gz, розмір у байтах, sha256 архіву).
+    keep — скільки локальних архівів зберігати (0 — без ротації).
+    """
+    await flush_stats()
+    return await asyncio.to_thread(_backup_sync, dest_dir, keep)
 
-        try:
-            # === НОВЕ: Час попередження про ВКЛЮЧЕННЯ (стандарт 0 - ВИМКНЕНО) ===
-            await db.execute(
-                "ALTER TABLE users ADD COLUMN notify_return_before INTEGER DEFAULT 0"
-            )
-        except:
-            pass
 
-        # === ФІКС ДЛЯ НОВОГО ТАЙМЕРА ===
-        # Якщо ми помилково встановили 5 хвилин у попередній версії коду (до релізу меню),
-        # цей рядок примусово вимкне таймер включення для всіх, щоб не спамити.
+@asynccontextmanager
+async def _writer():
+    """З'єднання для запису: одночасно пише тільки одна корутина."""
+    if _writer_conn is None:
+        await init_pool()
+    async with _writer_lock:
+        conn = _writer_conn
         try:
-            # Перевіряємо, чи є користувачі, у яких стоїть 5 (помилковий дефолт)
-            # ВАЖЛИВО: Це спрацює тільки якщо ми запускаємо це ДО того, як люди почали користуватись меню.
-            await db.execute(
-                "UPDATE users SET notify_return_before = 0 WHERE notify_return_before = 5"
-            )
-            await db.commit()
-        except:
-            pass
+            yield conn
+        except BaseException:
+            # Не залишаємо незавершену транзакцію на спільному з'єднанні
+            if conn.in_transaction:
+                await conn.rollback()
+            raise
+
+
+@asynccontextmanager
+async def _reader():
+    """Вільне з'єднання для читання з пулу."""
+    if _readers is None:
+        await init_pool()
+    readers = _readers
+    conn = await readers.get()
+    try:
+        yield conn
+    finally:
+        readers.put_nowait(conn)
 
-        try:
-            # Сповіщення про відключення (1 = вкл, 0 = викл)
-            await db.execute(
-                "ALTER TABLE users ADD COLUMN notify_outage INTEGER DEFAULT 1"
-            )
-        except:
-            pass
 
-        try:
-            # Сповіщення про включення (рівно в момент події)
-            await db.execute(
-                "ALTER TABLE users ADD COLUMN notify_return INTEGER DEFAULT 1"
-            )
-        except:
-            pass
+async def init_db():
+    """Відкриває пул і доводить структуру бази до актуальної версії."""
+    await init_pool()
+    async with _writer() as db:
+        # Міграції за PRAGMA user_version: на "теплому" старті — жодного DDL
+        await _apply_migrations(db)
+
+    await check_storage_profile()
+    await check_query_plans()
+    await load_system_config()
+    await load_subscriber_index()
+
+
+# === НОВЕ: ВЕРСІЙНІ МІГРАЦІЇ (PRAGMA user_version) ===
+# Колонки, які додавались до таблиць після першого релізу (Personalization 2.0 тощо)
+_LEGACY_COLUMNS = {
+    "users": [
+        # Час попередження про ВІДКЛЮЧЕННЯ (стандарт 5 хв)
+        ("notify_before", "INTEGER DEFAULT 5"),
+        # Час попередження про ВКЛЮЧЕННЯ (стандарт 0 - ВИМКНЕНО)
+        ("notify_return_before", "INTEGER DEFAULT 0"),
+        # Сповіщення про відключення (1 = вкл, 0 = викл)
+        ("notify_outage", "INTEGER DEFAULT 1"),
+        # Сповіщення про включення (рівно в момент події)
+        ("notify_return", "INTEGER DEFAULT 1"),
+        # Сповіщення про зміни графіку
+        ("notify_changes", "INTEGER DEFAULT 1"),
+        # Режим відображення ('blackout' - відключення, 'light' - світло)
+        ("display_mode", "TEXT DEFAULT 'blackout'"),
+        # Активність (чи не заблокував користувач бота)
+        ("is_active", "INTEGER DEFAULT 1"),
+    ],
+    "group_subscriptions": [
+        ("notify_before", "INTEGER DEFAULT 5"),
+        ("notify_return_before", "INTEGER DEFAULT 0"),
+    ],
+}
+
+
+async def _add_missing_columns(db, table, columns):
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        existing = {row[1] for row in await cur.fetchall()}
+    for name, definition in columns:
+        if name not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+async def _migration_base_schema(db):
+    """Версія 1: усі таблиці та колонки (безпечно і для нової, і для старої бази)."""
+    # === 1. ОСНОВНІ ДАНІ (НЕ ЧІПАЄМО) ===
+    # Таблиця для користувачів
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            region TEXT,
+            queue TEXT,
+            mode TEXT DEFAULT 'normal'
+        )
+    """)
+
+    # Таблиця для статистики
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            date TEXT,
+            region TEXT,
+            queue TEXT,
+            off_hours REAL,
+            PRIMARY KEY (date, region, queue)
+        )
+    """)
 
-        try:
-            # Сповіщення про зміни графіку
-            await db.execute(
-                "ALTER TABLE users ADD COLUMN notify_changes INTEGER DEFAULT 1"
-            )
-        except:
-            pass
+    # === СИСТЕМНІ НАЛАШТУВАННЯ ===
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS system_config (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    # Дефолт: Сайт увімкнено (1)
+    await db.execute(
+        "INSERT OR IGNORE INTO system_config (key, value) VALUES ('hoe_site_enabled', '1')"
+    )
+
+    # === 2. ПЕРЕВІРКА І ВИПРАВЛЕННЯ ТІЛЬКИ ТАБЛИЦЬ ПІДТРИМКИ ===
+    # Якщо таблиця support_messages є, але в ній немає потрібної колонки 'ticket_id'
+    async with db.execute("PRAGMA table_info(support_messages)") as cur:
+        columns = [row[1] for row in await cur.fetchall()]
+    if columns and "ticket_id" not in columns:
+        print("⚠️ Оновлення структури таблиць підтримки... (Основні дані збережено)")
+        # Видаляємо тільки старі таблиці підтримки, бо вони не сумісні з новим кодом
+        await db.execute("DROP TABLE IF EXISTS support_messages")
+        await db.execute("DROP TABLE IF EXISTS support_tickets")
+
+    # === 3. СТВОРЕННЯ ТАБЛИЦЬ ПІДТРИМКИ (ЯКЩО ЇХ НЕМАЄ) ===
+    # Таблиця тікетів
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS support_tickets (
+            ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            status TEXT DEFAULT 'unread',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_message_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    """)
+
+    # Таблиця повідомлень
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS support_messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            from_user TEXT NOT NULL,
+            message_text TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (ticket_id) REFERENCES support_tickets(ticket_id)
+        )
+    """)
+
+    # === ТАБЛИЦЯ ПІДПИСОК ГРУП І КАНАЛІВ ===
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS group_subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            chat_title TEXT,
+            chat_type TEXT,
+            region TEXT NOT NULL,
+            queue TEXT NOT NULL,
+            display_mode TEXT DEFAULT 'blackout',
+            notify_outage INTEGER DEFAULT 1,
+            notify_return INTEGER DEFAULT 1,
+            notify_changes INTEGER DEFAULT 1,
+            notify_before INTEGER DEFAULT 5,
+            notify_return_before INTEGER DEFAULT 0,
+            notify_morning INTEGER DEFAULT 1,
+            added_by INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Колонки, яких немає у старих базах
+    for table, columns in _LEGACY_COLUMNS.items():
+        await _add_missing_columns(db, table, columns)
+
+
+# Індекси для гарячих запитів: пошук підписників черги, груп користувача, тікетів
+_INDEXES = [
+    ("idx_users_region_queue", "users(region, queue)"),
+    ("idx_users_is_active", "users(is_active)"),
+    ("idx_groups_region_queue", "group_subscriptions(region, queue)"),
+    ("idx_groups_added_by", "group_subscriptions(added_by)"),
+    ("idx_tickets_status_last", "support_tickets(status, last_message_at)"),
+    ("idx_tickets_last", "support_tickets(last_message_at)"),
+    ("idx_tickets_user_last", "support_tickets(user_id, last_message_at)"),
+    ("idx_messages_ticket_created", "support_messages(ticket_id, created_at)"),
+    ("idx_stats_region_queue_date", "daily_stats(region, queue, date)"),
+]
+
+
+async def _migration_indexes(db):
+    """Версія 2: індекси для гарячих запитів."""
+    for name, target in _INDEXES:
+        await db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+async def _migration_outbox(db):
+    """Версія 3: черга вихідних повідомлень і стан сповіщень, що переживає рестарт."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            is_group INTEGER NOT NULL DEFAULT 0,
+            priority INTEGER NOT NULL,
+            event_at TEXT,
+            deadline TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS alert_history (
+            alert_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (day, alert_id)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS sent_notifications (
+            region TEXT NOT NULL,
+            queue TEXT NOT NULL,
+            date TEXT NOT NULL,
+            PRIMARY KEY (region, queue)
+        )
+    """)
 
-        try:
-            # Режим відображення ('blackout' - відключення, 'light' - світло)
-            await db.execute(
-                "ALTER TABLE users ADD COLUMN display_mode TEXT DEFAULT 'blackout'"
-            )
-        except:
-            pass
 
-        try:
-            # Активність (чи не заблокував користувач бота)
-            await db.execute("ALTER TABLE users ADD COLUMN is_active INTEGER DEFAULT 1")
-        except:
-            pass
+# (версія, функція) — застосовуються по черзі, якщо user_version бази менша.
+# Нові зміни схеми — лише новою версією в кінці списку.
+_MIGRATIONS = [
+    (1, _migration_base_schema),
+    (2, _migration_indexes),
+    (3, _migration_outbox),
+]
 
-        # Таблиця для статистики
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                date TEXT,
-                region TEXT,
-                queue TEXT,
-                off_hours REAL,
-                PRIMARY KEY (date, region, queue)
-            )
-        """)
 
-        # === НОВЕ: СИСТЕМНІ НАЛАШТУВАННЯ ===
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS system_config (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        # Дефолт: Сайт увімкнено (1)
-        await db.execute(
-            "INSERT OR IGNORE INTO system_config (key, value) VALUES ('hoe_site_enabled', '1')"
-        )
+async def _apply_migrations(db):
+    async with db.execute("PRAGMA user_version") as cur:
+        row = await cur.fetchone()
+        current = row[0] if row else 0
 
-        # === 2. ПЕРЕВІРКА І ВИПРАВЛЕННЯ ТІЛЬКИ ТАБЛИЦЬ ПІДТРИМКИ ===
-        # Перевіряємо, чи існує таблиця support_messages і чи є в ній колонка ticket_id
-        try:
-            async with db.execute("PRAGMA table_info(support_messages)") as cur:
-                columns = [row[1] for row in await cur.fetchall()]
-                # Якщо таблиця є, але в ній немає потрібної колонки 'ticket_id'
-                if columns and "ticket_id" not in columns:
-                    print(
-                        "⚠️ Оновлення структури таблиць підтримки... (Основні дані збережено)"
-                    )
-                    # Видаляємо тільки старі таблиці підтримки, бо вони не сумісні з новим кодом
-                    await db.execute("DROP TABLE IF EXISTS support_messages")
-                    await db.execute("DROP TABLE IF EXISTS support_tickets")
-                    await db.commit()
-        except Exception as e:
-            print(f"Non-critical DB check error: {e}")
-
-        # === 3. СТВОРЕННЯ ТАБЛИЦЬ ПІДТРИМКИ (ЯКЩО ЇХ НЕМАЄ) ===
-
-        # Таблиця тікетів
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS support_tickets (
-                ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                status TEXT DEFAULT 'unread',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_message_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-
-        # Таблиця повідомлень
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS support_messages (
-                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticket_id INTEGER NOT NULL,
-                from_user TEXT NOT NULL,
-                message_text TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (ticket_id) REFERENCES support_tickets(ticket_id)
-            )
-        """)
-
-        # === НОВЕ: ТАБЛИЦЯ ПІДПИСОК ГРУП І КАНАЛІВ ===
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS group_subscriptions (
-                chat_id INTEGER PRIMARY KEY,
-                chat_title TEXT,
-                chat_type TEXT,
-                region TEXT NOT NULL,
-                queue TEXT NOT NULL,
-                display_mode TEXT DEFAULT 'blackout',
-                notify_outage INTEGER DEFAULT 1,
-                notify_return INTEGER DEFAULT 1,
-                notify_changes INTEGER DEFAULT 1,
-                notify_before INTEGER DEFAULT 5,
-                notify_return_before INTEGER DEFAULT 0,
-                notify_morning INTEGER DEFAULT 1,
-                added_by INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    for version, migration in _MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"🛠 Міграція бази до версії {version}...")
+        await migration(db)
+        await db.execute(f"PRAGMA user_version = {int(version)}")
+        await db.commit()
 
-        # Міграція для додавання нових колонок, якщо їх немає
-        try:
-            await db.execute(
-                "ALTER TABLE group_subscriptions ADD COLUMN notify_before INTEGER DEFAULT 5"
-            )
-            await db.execute(
-                "ALTER TABLE group_subscriptions ADD COLUMN notify_return_before INTEGER DEFAULT 0"
-            )
-        except Exception:
-            pass
 
-        await db.commit()
+# Гарячі запити для самоперевірки планів: SQL береться з тих самих констант і
+# функцій, що й у хелперів нижче (список будується при виклику — вони ще не визначені)
+def _hot_queries():
+    queries = [
+        ("get_all_subs", _SQL_ALL_SUBS, ()),
+        ("get_users_by_queue", _SQL_USERS_BY_QUEUE, ("", "")),
+        ("get_active_users_count", _SQL_ACTIVE_USERS_COUNT, ()),
+        ("get_stats_data", _SQL_STATS_DATA, ("", "")),
+        ("get_off_hours_for_date", _SQL_OFF_HOURS_FOR_DATE, ("", "", "")),
+        ("get_groups_by_queue", _SQL_GROUPS_BY_QUEUE, ("", "")),
+        ("get_user_managed_groups", _SQL_USER_MANAGED_GROUPS, (0,)),
+        ("create_or_get_ticket", _SQL_OPEN_TICKET, (0,)),
+        ("get_unread_tickets", _SQL_UNREAD_TICKETS, ()),
+        ("get_all_tickets", _SQL_ALL_TICKETS, ()),
+        ("get_ticket_messages", _SQL_TICKET_MESSAGES, (0,)),
+        ("get_unread_count", _SQL_UNREAD_COUNT, ()),
+    ]
+    # Запасний SQL-шлях розсилки — усі варіанти типу сповіщення і хвилин
+    for kind, (_, offset_condition) in _NOTIFY_FILTERS.items():
+        for offset in (None, 5) if offset_condition else (None,):
+            for name, build in (
+                ("get_queue_recipients", _queue_recipients_sql),
+                ("get_group_recipients", _group_recipients_sql),
+            ):
+                sql, params = build(kind, offset)
+                queries.append((f"{name}[{kind}, {offset}]", sql, ("", "", *params)))
+    return queries
+
+
+async def _query_plan_problems(db):
+    """[(запит: деталь плану), ...] для гарячих запитів, що читають таблицю повністю."""
+    problems = []
+    for name, sql, params in _hot_queries():
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cur:
+            for row in await cur.fetchall():
+                detail = row[-1]
+                if detail.startswith("SCAN") and " USING " not in detail:
+                    problems.append(f"{name}: {detail}")
+    return problems
+
+
+async def check_query_plans():
+    """Самоперевірка: жоден гарячий запит не повинен читати всю таблицю (SCAN без індексу)."""
+    # Через з'єднання запису: воно саме виконувало міграції і бачить актуальну схему
+    async with _writer() as db:
+        problems = await _query_plan_problems(db)
+
+    if problems:
+        for problem in problems:
+            print(f"⚠️ Запит без індексу — {problem}")
+    else:
+        print(
+            f"✅ Плани запитів: {len(_hot_queries())} гарячих запитів використовують індекси"
+        )
+    return problems
 
 
 async def save_user(user_id, region, queue):
     """Зберігає або оновлює вибір користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             """
             INSERT INTO users (user_id, region, queue) 
@@ -201,11 +513,12 @@ async def save_user(user_id, region, queue):
             (user_id, region, queue),
         )
         await db.commit()
+    subscriber_index.save_user(user_id, region, queue)
 
 
 async def get_user(user_id):
     """Повертає регіон і чергу користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute(
             "SELECT region, queue FROM users WHERE user_id = ?", (user_id,)
         ) as cur:
@@ -217,7 +530,7 @@ async def get_user(user_id):
 
 async def get_user_settings(user_id):
     """Отримує всі налаштування користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         # Якщо користувача немає або поля пусті, повертаємо дефолтні налаштування
         defaults = {
             "notify_before": 5,
@@ -272,78 +585,244 @@ async def update_user_setting(user_id, key, value):
     if key not in allowed_keys:
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             f"UPDATE users SET {key} = ? WHERE user_id = ?", (value, user_id)
         )
         await db.commit()
+    subscriber_index.update_user(user_id, **{key: value})
 
 
 # --- КІНЕЦЬ НОВИХ ФУНКЦІЙ ---
 
 
+# === НОВЕ: ВІДКЛАДЕНИЙ ЗАПИС СТАТИСТИКИ (write-behind) ===
+# Ще не записані значення: { (date, region, queue): off_hours }
+_stats_pending = {}
+# Значення, які вже є в базі (щоб не переписувати однакові)
+_stats_flushed = {}
+# Дата відсічення, з якою вже чистили daily_stats
+_stats_cutoff = None
+
+
 async def save_stats(region, queue, date_str, off_hours):
-    """Записує статистику за день."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            """
-            INSERT INTO daily_stats (date, region, queue, off_hours) 
-            VALUES (?, ?, ?, ?) 
-            ON CONFLICT(date, region, queue) DO UPDATE SET off_hours=excluded.off_hours
-        """,
-            (date_str, region, queue, off_hours),
-        )
-        await db.commit()
+    """Записує статистику за день (у буфер; в базу — через flush_stats)."""
+    key = (date_str, region, queue)
+    if key not in _stats_pending and _stats_flushed.get(key) == off_hours:
+        return
+    _stats_pending[key] = off_hours
+
+
+async def flush_stats():
+    """Записує накопичену статистику однією транзакцією. Повертає кількість рядків."""
+    if not _stats_pending:
+        return 0
+    batch = dict(_stats_pending)
+    _stats_pending.clear()
+    try:
+        async with _writer() as db:
+            await db.executemany(
+                """
+                INSERT INTO daily_stats (date, region, queue, off_hours)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(date, region, queue) DO UPDATE SET off_hours=excluded.off_hours
+            """,
+                [(d, r, q, off) for (d, r, q), off in batch.items()],
+            )
+            await db.commit()
+    except Exception:
+        # Повертаємо в буфер (новіші значення, що прийшли під час запису, мають пріоритет)
+        for key, off in batch.items():
+            _stats_pending.setdefault(key, off)
+        raise
+    _stats_flushed.update(batch)
+    return len(batch)
+
+
+_SQL_STATS_DATA = """
+    SELECT date, off_hours
+    FROM daily_stats
+    WHERE region = ? AND queue = ?
+    ORDER BY date DESC
+    LIMIT 7
+"""
 
 
 async def get_stats_data(region, queue):
     """Отримує статистику за останні 7 днів (від сьогодні і назад)."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        sql = """
-            SELECT date, off_hours 
-            FROM daily_stats 
-            WHERE region = ? AND queue = ? 
-            ORDER BY date DESC 
-            LIMIT 7
-        """
-        async with db.execute(sql, (region, queue)) as cur:
-            rows = await cur.fetchall()
-            return list(reversed(rows))
+    async with _reader() as db:
+        async with db.execute(_SQL_STATS_DATA, (region, queue)) as cur:
+            rows = dict(await cur.fetchall())
+    # Додаємо ще не записані значення з буфера
+    for (date_str, r, q), off_hours in _stats_pending.items():
+        if r == region and q == queue:
+            rows[date_str] = off_hours
+    return sorted(rows.items())[-7:]
+
+
+_SQL_ALL_SUBS = "SELECT DISTINCT region, queue FROM users"
 
 
 async def get_all_subs():
     """Отримує список всіх унікальних підписок (регіон + черга)."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT DISTINCT region, queue FROM users") as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_ALL_SUBS) as cur:
             return await cur.fetchall()
 
 
+_SQL_USERS_BY_QUEUE = "SELECT user_id FROM users WHERE region = ? AND queue = ?"
+
+
 async def get_users_by_queue(region, queue):
     """Отримує ID всіх користувачів конкретної черги."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
+        async with db.execute(_SQL_USERS_BY_QUEUE, (region, queue)) as cur:
+            return await cur.fetchall()
+
+
+# === НОВЕ: ВИБІРКА ОТРИМУВАЧІВ РОЗСИЛКИ ===
+# Типи сповіщень (NOTIFY_CHANGES / NOTIFY_OUTAGE / NOTIFY_RETURN) — з subscribers.py.
+# Після init_db отримувачі беруться з індексу в пам'яті, SQL — запасний шлях.
+subscriber_index = SubscriberIndex()
+
+_USER_INDEX_COLUMNS = (
+    "user_id",
+    "region",
+    "queue",
+    "is_active",
+    "display_mode",
+    "notify_changes",
+    "notify_outage",
+    "notify_before",
+    "notify_return",
+    "notify_return_before",
+)
+_GROUP_INDEX_COLUMNS = (
+    "chat_id",
+    "region",
+    "queue",
+    "display_mode",
+    "notify_changes",
+    "notify_outage",
+    "notify_before",
+    "notify_return",
+    "notify_return_before",
+    "notify_morning",
+)
+
+
+async def load_subscriber_index():
+    """Завантажує всіх підписників у індекс (при старті)."""
+    async with _reader() as db:
+        async with db.execute(
+            f"SELECT {', '.join(_USER_INDEX_COLUMNS)} FROM users"
+        ) as cur:
+            user_rows = await cur.fetchall()
         async with db.execute(
-            "SELECT user_id FROM users WHERE region = ? AND queue = ?", (region, queue)
+            f"SELECT {', '.join(_GROUP_INDEX_COLUMNS)} FROM group_subscriptions"
         ) as cur:
+            group_rows = await cur.fetchall()
+
+    users = []
+    for row in user_rows:
+        record = dict(zip(_USER_INDEX_COLUMNS, row))
+        record["chat_id"] = record.pop("user_id")
+        record["active"] = record.pop("is_active")
+        users.append(record)
+    groups = [dict(zip(_GROUP_INDEX_COLUMNS, row)) for row in group_rows]
+
+    subscriber_index.load(users, groups)
+    stats = subscriber_index.stats()
+    print(
+        f"👥 Індекс підписників: {stats['users']} користувачів, "
+        f"{stats['groups']} груп"
+    )
+
+
+# (умова типу, умова на хвилини попередження). COALESCE — ті самі дефолти,
+# що й у get_user_settings / get_group_settings
+_NOTIFY_FILTERS = {
+    NOTIFY_CHANGES: ("COALESCE(notify_changes, 1) = 1", None),
+    NOTIFY_OUTAGE: (
+        "COALESCE(notify_outage, 1) = 1",
+        "COALESCE(notify_before, 5) = ?",
+    ),
+    NOTIFY_RETURN: (
+        "COALESCE(notify_return, 1) = 1",
+        "COALESCE(notify_return_before, 0) = ?",
+    ),
+}
+
+
+def _notify_filter(kind, offset=None):
+    condition, offset_condition = _NOTIFY_FILTERS[kind]
+    if offset is None or offset_condition is None:
+        return condition, ()
+    return f"{condition} AND {offset_condition}", (offset,)
+
+
+def _queue_recipients_sql(kind, offset=None):
+    """SQL і параметри (без region, queue) для get_queue_recipients."""
+    condition, params = _notify_filter(kind, offset)
+    sql = f"""
+        SELECT user_id, COALESCE(display_mode, 'blackout')
+        FROM users
+        WHERE region = ? AND queue = ?
+          AND (is_active = 1 OR is_active IS NULL)
+          AND {condition}
+    """
+    return sql, params
+
+
+def _group_recipients_sql(kind, offset=None):
+    """SQL і параметри (без region, queue) для get_group_recipients."""
+    condition, params = _notify_filter(kind, offset)
+    sql = f"""
+        SELECT chat_id, COALESCE(NULLIF(display_mode, ''), 'blackout')
+        FROM group_subscriptions
+        WHERE region = ? AND queue = ? AND {condition}
+    """
+    return sql, params
+
+
+async def get_queue_recipients(region, queue, kind, offset=None):
+    """Активні користувачі черги, яким треба надіслати сповіщення: [(user_id, display_mode)]."""
+    if subscriber_index.ready:
+        return subscriber_index.user_recipients(region, queue, kind, offset)
+    sql, params = _queue_recipients_sql(kind, offset)
+    async with _reader() as db:
+        async with db.execute(sql, (region, queue, *params)) as cur:
+            return await cur.fetchall()
+
+
+async def get_group_recipients(region, queue, kind, offset=None):
+    """Групи/канали черги, яким треба надіслати сповіщення: [(chat_id, display_mode)]."""
+    if subscriber_index.ready:
+        return subscriber_index.group_recipients(region, queue, kind, offset)
+    sql, params = _group_recipients_sql(kind, offset)
+    async with _reader() as db:
+        async with db.execute(sql, (region, queue, *params)) as cur:
             return await cur.fetchall()
 
 
 async def delete_user(user_id):
     """Видаляє користувача з бази даних (відписка)."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
         await db.commit()
+    subscriber_index.remove_user(user_id)
 
 
 async def set_user_mode(user_id, mode):
     """Встановлює режим користувача (normal, support, admin)."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute("UPDATE users SET mode = ? WHERE user_id = ?", (mode, user_id))
         await db.commit()
 
 
 async def get_user_mode(user_id):
     """Отримує режим користувача."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute(
             "SELECT mode FROM users WHERE user_id = ?", (user_id,)
         ) as cur:
@@ -353,58 +832,77 @@ async def get_user_mode(user_id):
 
 async def get_users_count():
     """Отримує кількість всіх користувачів."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute("SELECT COUNT(*) FROM users") as cur:
             row = await cur.fetchone()
             return row[0] if row else 0
 
 
+# Враховуємо і 1, і NULL (на випадок якщо ALTER TABLE не застосував дефолт)
+_SQL_ACTIVE_USERS_COUNT = (
+    "SELECT COUNT(*) FROM users WHERE is_active = 1 OR is_active IS NULL"
+)
+
+
 async def get_active_users_count():
     """Отримує кількість активних користувачів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Враховуємо і 1, і NULL (на випадок якщо ALTER TABLE не застосував дефолт)
-        async with db.execute(
-            "SELECT COUNT(*) FROM users WHERE is_active = 1 OR is_active IS NULL"
-        ) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_ACTIVE_USERS_COUNT) as cur:
             row = await cur.fetchone()
             return row[0] if row else 0
 
 
 async def mark_user_active(user_id):
     """Позначає користувача активним."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute("UPDATE users SET is_active = 1 WHERE user_id = ?", (user_id,))
         await db.commit()
+    subscriber_index.update_user(user_id, active=1)
 
 
 async def mark_user_inactive(user_id):
     """Позначає користувача неактивним (заблокував бота)."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute("UPDATE users SET is_active = 0 WHERE user_id = ?", (user_id,))
         await db.commit()
+    subscriber_index.update_user(user_id, active=0)
 
 
 async def get_all_users_for_broadcast():
     """Отримує всіх користувачів для розсилки."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute("SELECT DISTINCT user_id FROM users") as cur:
             return await cur.fetchall()
 
 
 async def cleanup_old_stats():
-    """Видаляє статистику старше 7 днів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        cutoff_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+    """Видаляє статистику старше 7 днів (один раз на добу)."""
+    global _stats_cutoff
+    cutoff_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+    if cutoff_date == _stats_cutoff:
+        return
+    async with _writer() as db:
         await db.execute("DELETE FROM daily_stats WHERE date < ?", (cutoff_date,))
         await db.commit()
+    _stats_cutoff = cutoff_date
+    for cache in (_stats_pending, _stats_flushed):
+        for key in [k for k in cache if k[0] < cutoff_date]:
+            del cache[key]
+
+
+_SQL_OFF_HOURS_FOR_DATE = (
+    "SELECT off_hours FROM daily_stats WHERE region = ? AND queue = ? AND date = ?"
+)
 
 
 async def get_off_hours_for_date(region, queue, date_str):
     """Отримує години відключення для конкретної дати."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    pending = _stats_pending.get((date_str, region, queue))
+    if pending is not None:
+        return pending
+    async with _reader() as db:
         async with db.execute(
-            "SELECT off_hours FROM daily_stats WHERE region = ? AND queue = ? AND date = ?",
-            (region, queue, date_str),
+            _SQL_OFF_HOURS_FOR_DATE, (region, queue, date_str)
         ) as cur:
             row = await cur.fetchone()
             return row[0] if row else None
@@ -413,37 +911,160 @@ async def get_off_hours_for_date(region, queue, date_str):
 # === НОВІ ФУНКЦІЇ ДЛЯ КОНФІГУРАЦІЇ ===
 
 
+# === НОВЕ: OUTBOX (ЧЕРГА ВИХІДНИХ ПОВІДОМЛЕНЬ) ===
+_OUTBOX_COLUMNS = "chat_id, text, is_group, priority, event_at, deadline"
+
+
+async def outbox_enqueue(rows):
+    """Додає повідомлення в outbox однією транзакцією. Повертає їхні id.
+
+    rows — [(chat_id, text, is_group, priority, event_at, deadline), ...]
+    (event_at/deadline — рядки ISO або None).
+    """
+    if not rows:
+        return []
+    async with _writer() as db:
+        await db.executemany(
+            f"INSERT INTO outbox ({_OUTBOX_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        async with db.execute("SELECT last_insert_rowid()") as cur:
+            last_id = (await cur.fetchone())[0]
+        await db.commit()
+    # AUTOINCREMENT в одній транзакції єдиного писача — id ідуть підряд
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+async def outbox_ack(ids):
+    """Прибирає з outbox оброблені повідомлення (відправлені або відкинуті)."""
+    if not ids:
+        return
+    async with _writer() as db:
+        await db.executemany(
+            "DELETE FROM outbox WHERE id = ?", [(outbox_id,) for outbox_id in ids]
+        )
+        await db.commit()
+
+
+async def outbox_pending():
+    """Невідправлені повідомлення (після рестарту): [(id, chat_id, text, ...)]."""
+    async with _reader() as db:
+        async with db.execute(
+            f"SELECT id, {_OUTBOX_COLUMNS} FROM outbox ORDER BY priority, id"
+        ) as cur:
+            return await cur.fetchall()
+
+
+# === НОВЕ: СТАН СПОВІЩЕНЬ (alert_history / sent_notifications) ===
+async def add_alert_history(alert_id, day):
+    async with _writer() as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO alert_history (alert_id, day) VALUES (?, ?)",
+            (alert_id, day),
+        )
+        await db.commit()
+
+
+async def get_alert_history(day):
+    """Id сповіщень, уже надісланих за день."""
+    async with _reader() as db:
+        async with db.execute(
+            "SELECT alert_id FROM alert_history WHERE day = ?", (day,)
+        ) as cur:
+            return {row[0] for row in await cur.fetchall()}
+
+
+async def cleanup_alert_history(day):
+    """Видаляє історію сповіщень за дні до day."""
+    async with _writer() as db:
+        await db.execute("DELETE FROM alert_history WHERE day < ?", (day,))
+        await db.commit()
+
+
+async def set_sent_notification(region, queue, date_str):
+    async with _writer() as db:
+        await db.execute(
+            """
+            INSERT INTO sent_notifications (region, queue, date) VALUES (?, ?, ?)
+            ON CONFLICT(region, queue) DO UPDATE SET date=excluded.date
+        """,
+            (region, queue, date_str),
+        )
+        await db.commit()
+
+
+async def get_sent_notifications():
+    """{ (region, queue): дата останнього надісланого графіка }"""
+    async with _reader() as db:
+        async with db.execute(
+            "SELECT region, queue, date FROM sent_notifications"
+        ) as cur:
+            return {(r, q): d for r, q, d in await cur.fetchall()}
+
+
+# === НОВЕ: КЕШ СИСТЕМНИХ НАЛАШТУВАНЬ ===
+# Усі рядки system_config у пам'яті (завантажуються в init_db, оновлюються set_system_config)
+_system_config = {}
+# Обробники змін: listener(key, value) — викликаються одразу після запису
+_config_listeners = []
+
+
+async def load_system_config():
+    """Завантажує всі системні налаштування в кеш (при старті)."""
+    async with _reader() as db:
+        async with db.execute("SELECT key, value FROM system_config") as cur:
+            rows = await cur.fetchall()
+    _system_config.clear()
+    _system_config.update(rows)
+
+
+def on_system_config_change(listener):
+    """Підписує listener(key, value) на зміни системних налаштувань."""
+    _config_listeners.append(listener)
+    return listener
+
+
 async def set_system_config(key, value):
     """Зберігає системне налаштування."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    value = str(value)
+    async with _writer() as db:
         await db.execute(
             "INSERT INTO system_config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, str(value)),
+            (key, value),
         )
         await db.commit()
 
+    changed = _system_config.get(key) != value
+    _system_config[key] = value
+    if changed:
+        for listener in _config_listeners:
+            try:
+                listener(key, value)
+            except Exception as e:
+                print(f"⚠️ Config listener error ({key}): {e}")
 
-async def get_system_config(key, default=None):
-    """Отримує системне налаштування."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            "SELECT value FROM system_config WHERE key = ?", (key,)
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else default
+
+def get_system_config(key, default=None):
+    """Отримує системне налаштування з кешу (база читається лише в load_system_config)."""
+    return _system_config.get(key, default)
+
+
+def is_hoe_site_enabled():
+    """Чи використовується сайт HOE як джерело графіків (з кешу, без запиту до бази)."""
+    return get_system_config("hoe_site_enabled", "1") == "1"
 
 
 # ========== НОВА СИСТЕМА ПІДТРИМКИ ==========
 
 
+_SQL_OPEN_TICKET = "SELECT ticket_id FROM support_tickets WHERE user_id = ? AND status != 'closed' ORDER BY last_message_at DESC LIMIT 1"
+
+
 async def create_or_get_ticket(user_id, username):
     """Створює новий тікет або повертає існуючий відкритий тікет."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         # Перевіряємо чи є відкритий тікет
-        async with db.execute(
-            "SELECT ticket_id FROM support_tickets WHERE user_id = ? AND status != 'closed' ORDER BY last_message_at DESC LIMIT 1",
-            (user_id,),
-        ) as cur:
+        async with db.execute(_SQL_OPEN_TICKET, (user_id,)) as cur:
             row = await cur.fetchone()
             if row:
                 return row[0]
@@ -459,7 +1080,7 @@ async def create_or_get_ticket(user_id, username):
 
 async def save_support_message(ticket_id, from_user, message_text):
     """Зберігає повідомлення в тікет."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             "INSERT INTO support_messages (ticket_id, from_user, message_text) VALUES (?, ?, ?)",
             (ticket_id, from_user, message_text),
@@ -472,50 +1093,56 @@ async def save_support_message(ticket_id, from_user, message_text):
         await db.commit()
 
 
+_SQL_UNREAD_TICKETS = """
+    SELECT t.ticket_id, t.user_id, t.username, t.created_at, t.last_message_at,
+           (SELECT COUNT(*) FROM support_messages WHERE ticket_id = t.ticket_id) as msg_count
+    FROM support_tickets t
+    WHERE t.status = 'unread'
+    ORDER BY t.last_message_at DESC
+"""
+
+
 async def get_unread_tickets():
     """Отримує всі непрочитані тікети."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("""
-            SELECT t.ticket_id, t.user_id, t.username, t.created_at, t.last_message_at,
-                   (SELECT COUNT(*) FROM support_messages WHERE ticket_id = t.ticket_id) as msg_count
-            FROM support_tickets t
-            WHERE t.status = 'unread'
-            ORDER BY t.last_message_at DESC
-        """) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_UNREAD_TICKETS) as cur:
             return await cur.fetchall()
 
 
+_SQL_ALL_TICKETS = """
+    SELECT t.ticket_id, t.user_id, t.username, t.status, t.created_at, t.last_message_at,
+           (SELECT COUNT(*) FROM support_messages WHERE ticket_id = t.ticket_id) as msg_count
+    FROM support_tickets t
+    ORDER BY t.last_message_at DESC
+    LIMIT 20
+"""
+
+
 async def get_all_tickets():
     """Отримує всі тікети."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("""
-            SELECT t.ticket_id, t.user_id, t.username, t.status, t.created_at, t.last_message_at,
-                   (SELECT COUNT(*) FROM support_messages WHERE ticket_id = t.ticket_id) as msg_count
-            FROM support_tickets t
-            ORDER BY t.last_message_at DESC
-            LIMIT 20
-        """) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_ALL_TICKETS) as cur:
             return await cur.fetchall()
 
 
+_SQL_TICKET_MESSAGES = """
+    SELECT from_user, message_text, created_at
+    FROM support_messages
+    WHERE ticket_id = ?
+    ORDER BY created_at ASC
+"""
+
+
 async def get_ticket_messages(ticket_id):
     """Отримує всі повідомлення тікету."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            """
-            SELECT from_user, message_text, created_at
-            FROM support_messages
-            WHERE ticket_id = ?
-            ORDER BY created_at ASC
-        """,
-            (ticket_id,),
-        ) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_TICKET_MESSAGES, (ticket_id,)) as cur:
             return await cur.fetchall()
 
 
 async def mark_ticket_read(ticket_id):
     """Позначає тікет як прочитаний."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             "UPDATE support_tickets SET status = 'read' WHERE ticket_id = ?",
             (ticket_id,),
@@ -525,7 +1152,7 @@ async def mark_ticket_read(ticket_id):
 
 async def close_ticket(ticket_id):
     """Закриває тікет."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             "UPDATE support_tickets SET status = 'closed' WHERE ticket_id = ?",
             (ticket_id,),
@@ -535,7 +1162,7 @@ async def close_ticket(ticket_id):
 
 async def reopen_ticket(ticket_id):
     """Знову відкриває тікет."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             "UPDATE support_tickets SET status = 'unread', last_message_at = CURRENT_TIMESTAMP WHERE ticket_id = ?",
             (ticket_id,),
@@ -545,7 +1172,7 @@ async def reopen_ticket(ticket_id):
 
 async def get_ticket_info(ticket_id):
     """Отримує інформацію про тікет."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute(
             "SELECT user_id, username, status FROM support_tickets WHERE ticket_id = ?",
             (ticket_id,),
@@ -553,12 +1180,13 @@ async def get_ticket_info(ticket_id):
             return await cur.fetchone()
 
 
+_SQL_UNREAD_COUNT = "SELECT COUNT(*) FROM support_tickets WHERE status = 'unread'"
+
+
 async def get_unread_count():
     """Отримує кількість непрочитаних тікетів."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            "SELECT COUNT(*) FROM support_tickets WHERE status = 'unread'"
-        ) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_UNREAD_COUNT) as cur:
             row = await cur.fetchone()
             return row[0] if row else 0
 
@@ -568,7 +1196,7 @@ async def get_unread_count():
 
 async def save_group_sub(chat_id, chat_title, chat_type, region, queue, added_by):
     """Зберігає або оновлює підписку групи/каналу."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             """
             INSERT INTO group_subscriptions (chat_id, chat_title, chat_type, region, queue, added_by)
@@ -582,11 +1210,12 @@ async def save_group_sub(chat_id, chat_title, chat_type, region, queue, added_by
             (chat_id, chat_title, chat_type, region, queue, added_by),
         )
         await db.commit()
+    subscriber_index.save_group(chat_id, region, queue)
 
 
 async def get_group_sub(chat_id):
     """Повертає підписку групи/каналу."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute(
             "SELECT region, queue, display_mode, notify_outage, notify_return, notify_changes, notify_morning FROM group_subscriptions WHERE chat_id = ?",
             (chat_id,),
@@ -596,43 +1225,44 @@ async def get_group_sub(chat_id):
 
 async def delete_group_sub(chat_id):
     """Видаляє підписку групи/каналу."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             "DELETE FROM group_subscriptions WHERE chat_id = ?", (chat_id,)
         )
         await db.commit()
+    subscriber_index.remove_group(chat_id)
 
 
 async def get_all_group_subs():
     """Отримує список усіх підписок груп/каналів."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute(
             "SELECT chat_id, chat_title, chat_type, region, queue FROM group_subscriptions"
         ) as cur:
             return await cur.fetchall()
 
 
+_SQL_USER_MANAGED_GROUPS = "SELECT chat_id, chat_title, chat_type, region, queue FROM group_subscriptions WHERE added_by = ?"
+
+
 async def get_user_managed_groups(user_id):
     """Отримує всі групи/канали, додані цим користувачем."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            "SELECT chat_id, chat_title, chat_type, region, queue FROM group_subscriptions WHERE added_by = ?",
-            (user_id,),
-        ) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_USER_MANAGED_GROUPS, (user_id,)) as cur:
             return await cur.fetchall()
 
 
+_SQL_GROUPS_BY_QUEUE = """
+    SELECT chat_id, display_mode, notify_outage, notify_return, notify_changes, notify_morning, notify_before, notify_return_before
+    FROM group_subscriptions
+    WHERE region = ? AND queue = ?
+"""
+
+
 async def get_groups_by_queue(region, queue):
     """Отримує групи/канали з конкретною чергою (для розсилки)."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            """
-            SELECT chat_id, display_mode, notify_outage, notify_return, notify_changes, notify_morning, notify_before, notify_return_before 
-            FROM group_subscriptions 
-            WHERE region = ? AND queue = ?
-        """,
-            (region, queue),
-        ) as cur:
+    async with _reader() as db:
+        async with db.execute(_SQL_GROUPS_BY_QUEUE, (region, queue)) as cur:
             return await cur.fetchall()
 
 
@@ -649,12 +1279,13 @@ async def update_group_setting(chat_id, key, value):
     ]
     if key not in allowed_keys:
         return
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _writer() as db:
         await db.execute(
             f"UPDATE group_subscriptions SET {key} = ? WHERE chat_id = ?",
             (value, chat_id),
         )
         await db.commit()
+    subscriber_index.update_group(chat_id, **{key: value})
 
 
 async def get_group_settings(chat_id):
@@ -668,7 +1299,7 @@ async def get_group_settings(chat_id):
         "notify_before": 5,
         "notify_return_before": 0,
     }
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         try:
             async with db.execute(
                 """
@@ -699,7 +1330,7 @@ async def get_group_settings(chat_id):
 
 async def get_groups_count():
     """Отримує кількість підключених груп/каналів."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _reader() as db:
         async with db.execute("SELECT COUNT(*) FROM group_subscriptions") as cur:
             row = await cur.fetchone()
             return row[0] if row else 0
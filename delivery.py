@@ -0,0 +1,431 @@
+# delivery.py
+import asyncio
+import itertools
+import math
+import time
+from datetime import datetime
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+import database as db
+from config import (
+    DELIVERY_RATE,
+    DELIVERY_WORKERS,
+    DELIVERY_CHAT_INTERVAL,
+    DELIVERY_GROUP_INTERVAL,
+    DELIVERY_MAX_ATTEMPTS,
+)
+
+# === КЛАСИ ПРІОРИТЕТУ (менше — важливіше) ===
+ALERT = 0  # Попередження про відключення/включення, екстрені
+CHANGE = 1  # Зміни графіка
+DIGEST = 2  # Ранкове зведення
+BULK = 3  # Розсилка від адміна
+
+# Адаптивне зниження швидкості після flood control
+_MIN_RATE = 1.0  # не повільніше 1 повідомлення/с
+_THROTTLE_FACTOR = 0.5  # у скільки разів зменшуємо швидкість після RetryAfter
+_RECOVERY_STEP = 0.05  # +повідомлень/с за кожну успішну відправку
+
+# Як часто прибирати з outbox оброблені повідомлення (с)
+_ACK_INTERVAL = 1.0
+
+
+class TokenBucket:
+    """Глобальний ліміт відправок: не більше rate повідомлень за секунду.
+
+    paused_until (monotonic) — до цього моменту токени не видаються зовсім:
+    пауза перевіряється безпосередньо перед видачею токена, тож відправник,
+    що вже чекав у черзі за токеном, теж не відправить під час flood control.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def paused(self):
+        return self.paused_until > time.monotonic()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.paused_until > now:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Batch:
+    """Група повідомлень однієї розсилки: лічильники та очікування завершення."""
+
+    __slots__ = ("total", "sent", "failed", "_done")
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self._done = asyncio.Event()
+        if total == 0:
+            self._done.set()
+
+    def _finish(self, ok):
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if self.sent + self.failed >= self.total:
+            self._done.set()
+
+    async def wait(self):
+        """Чекає, поки всі повідомлення розсилки будуть оброблені."""
+        await self._done.wait()
+        return self
+
+
+class OutboundMessage:
+    """Повідомлення в черзі розсилки.
+
+    event_at — момент події, до якої відлічує попередження: у тексті "{mins}"
+    замінюється на хвилини, що лишились, у момент відправки; після event_at
+    повідомлення вже не відправляється. deadline — крайній час відправки.
+    """
+
+    __slots__ = (
+        "chat_id",
+        "text",
+        "is_group",
+        "batch",
+        "attempts",
+        "priority",
+        "event_at",
+        "deadline",
+        "outbox_id",
+    )
+
+    def __init__(
+        self,
+        chat_id,
+        text,
+        is_group,
+        batch,
+        priority,
+        event_at=None,
+        deadline=None,
+        outbox_id=None,
+    ):
+        self.chat_id = chat_id
+        self.text = text
+        self.is_group = is_group
+        self.batch = batch
+        self.attempts = 0
+        self.priority = priority
+        self.event_at = event_at
+        self.deadline = deadline
+        self.outbox_id = outbox_id
+
+    @property
+    def due(self):
+        """Ключ EDF всередині класу пріоритету: раніший дедлайн — раніше в черзі."""
+        limit = self.event_at or self.deadline
+        return limit.timestamp() if limit else math.inf
+
+    def render(self, now):
+        """Текст на момент відправки або None, якщо повідомлення вже неактуальне."""
+        if self.deadline and now > self.deadline:
+            return None
+        if self.event_at is None:
+            return self.text
+        left = (self.event_at - now).total_seconds()
+        if left <= 0:
+            return None
+        return self.text.replace("{mins}", str(math.ceil(left / 60)))
+
+
+class DeliveryEngine:
+    """Паралельна розсилка з лімітами Telegram.
+
+    - глобальний token bucket (DELIVERY_RATE повідомлень/с на весь бот);
+    - інтервал між повідомленнями в один чат (для груп — суворіший);
+    - пул з DELIVERY_WORKERS відправників, що беруть повідомлення з черги
+      пріоритетів (ALERT → CHANGE → DIGEST → BULK, всередині — за дедлайном);
+    - RetryAfter від Telegram ставить на паузу всю розсилку, знижує швидкість
+      і повертає повідомлення в чергу (швидкість поступово відновлюється);
+    - кожне повідомлення спершу пишеться в outbox (SQLite) і прибирається звідти
+      після обробки, тож після рестарту недоставлене відправляється знову.
+    """
+
+    def __init__(
+        self,
+        rate=DELIVERY_RATE,
+        workers=DELIVERY_WORKERS,
+        chat_interval=DELIVERY_CHAT_INTERVAL,
+        group_interval=DELIVERY_GROUP_INTERVAL,
+    ):
+        self.rate = rate
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.stats = {
+            "sent": 0,
+            "failed": 0,
+            "throttled": 0,
+            "retried": 0,
+            "expired": 0,
+        }
+        self._bot = None
+        self._queue = None
+        self._seq = itertools.count()
+        self._bucket = None
+        self._tasks = []
+        # Найближчий дозволений час відправки в кожен чат: { chat_id: monotonic }
+        self._chat_ready = {}
+        # Id з outbox, які вже оброблені і чекають на пакетне видалення
+        self._acks = []
+        self._ack_task = None
+        self._ack_stop = None
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    async def start(self, bot):
+        """Запускає пул відправників і дочитує з outbox недоставлене до рестарту."""
+        if self._tasks:
+            return
+        self._bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._bucket = TokenBucket(self.rate)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._ack_stop = asyncio.Event()
+        self._ack_task = asyncio.create_task(self._ack_loop())
+        print(f"📨 Розсилка: {self.workers} відправників, до {self.rate} повідомлень/с")
+        await self._resume()
+
+    async def stop(self):
+        """Зупиняє відправників. Недоставлене лишається в outbox до наступного старту."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Цикл підтверджень не скасовуємо посеред запису в outbox — просимо завершитись
+        if self._ack_task is not None:
+            self._ack_stop.set()
+            await asyncio.gather(self._ack_task, return_exceptions=True)
+            self._ack_task = None
+        await self._flush_acks()
+
+    async def submit(
+        self, items, is_group=False, priority=CHANGE, event_at=None, deadline=None
+    ):
+        """Записує [(chat_id, text), ...] в outbox, ставить у чергу і повертає Batch.
+
+        Чекати на batch.wait() не обов'язково — відправка йде у фоні.
+        """
+        if not self._tasks:
+            raise RuntimeError("DeliveryEngine не запущено (engine.start(bot))")
+        items = list(items)
+        batch = Batch(len(items))
+        rows = [
+            (
+                chat_id,
+                text,
+                int(is_group),
+                priority,
+                event_at.isoformat() if event_at else None,
+                deadline.isoformat() if deadline else None,
+            )
+            for chat_id, text in items
+        ]
+        try:
+            ids = await db.outbox_enqueue(rows)
+        except Exception as e:
+            # База недоступна — все одно відправляємо (але без гарантії після рестарту)
+            print(f"⚠️ Outbox error: {e}")
+            ids = [None] * len(items)
+        for (chat_id, text), outbox_id in zip(items, ids):
+            self._put(
+                OutboundMessage(
+                    chat_id,
+                    text,
+                    is_group,
+                    batch,
+                    priority,
+                    event_at,
+                    deadline,
+                    outbox_id,
+                )
+            )
+        return batch
+
+    async def _resume(self):
+        rows = await db.outbox_pending()
+        if not rows:
+            return
+        batch = Batch(len(rows))
+        for outbox_id, chat_id, text, is_group, priority, event_at, deadline in rows:
+            self._put(
+                OutboundMessage(
+                    chat_id,
+                    text,
+                    bool(is_group),
+                    batch,
+                    priority,
+                    datetime.fromisoformat(event_at) if event_at else None,
+                    datetime.fromisoformat(deadline) if deadline else None,
+                    outbox_id,
+                )
+            )
+        print(f"📨 Outbox: відновлено {len(rows)} недоставлених повідомлень")
+
+    async def _ack_loop(self):
+        while not self._ack_stop.is_set():
+            try:
+                await asyncio.wait_for(self._ack_stop.wait(), timeout=_ACK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush_acks()
+
+    async def _flush_acks(self):
+        if not self._acks:
+            return
+        ids, self._acks = self._acks, []
+        try:
+            await db.outbox_ack(ids)
+        except BaseException as e:
+            # Навіть при скасуванні id не губимо — інакше після рестарту повтор
+            self._acks[:0] = ids
+            if not isinstance(e, Exception):
+                raise
+            print(f"⚠️ Outbox ack error: {e}")
+
+    def _put(self, msg):
+        self._queue.put_nowait((msg.priority, msg.due, next(self._seq), msg))
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def current_rate(self):
+        """Поточна (адаптивна) швидкість розсилки, повідомлень/с."""
+        return self._bucket.rate if self._bucket is not None else self.rate
+
+    def _throttle(self, retry_after):
+        """Flood control: пауза для всіх відправників і зниження швидкості.
+
+        RetryAfter на запити, що вже були в дорозі, коли почалась пауза, лише
+        подовжують її: швидкість знижується один раз за паузу.
+        """
+        self.stats["throttled"] += 1
+        bucket = self._bucket
+        already_paused = bucket.paused
+        bucket.paused_until = max(bucket.paused_until, time.monotonic() + retry_after)
+        if already_paused:
+            return
+        bucket.rate = max(_MIN_RATE, bucket.rate * _THROTTLE_FACTOR)
+        print(
+            f"⏸ Flood control: пауза {retry_after} с, швидкість "
+            f"{self._bucket.rate:.1f}/с (разів: {self.stats['throttled']})"
+        )
+
+    def _retry(self, msg, delay=0):
+        """Повертає повідомлення в чергу (з затримкою)."""
+        self.stats["retried"] += 1
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._put, msg)
+        else:
+            self._put(msg)
+
+    async def _wait_chat(self, chat_id, interval):
+        """Чекає, поки в чат знову можна писати, і займає його на interval секунд."""
+        while True:
+            now = time.monotonic()
+            wait = self._chat_ready.get(chat_id, 0) - now
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        if len(self._chat_ready) > 50000:
+            self._chat_ready = {
+                cid: ready for cid, ready in self._chat_ready.items() if ready > now
+            }
+        self._chat_ready[chat_id] = now + interval
+
+    async def _worker(self):
+        while True:
+            *_, msg = await self._queue.get()
+            try:
+                ok = await self._deliver(msg)
+            except Exception as e:
+                print(f"⚠️ Delivery error ({msg.chat_id}): {e}")
+                ok = False
+            # None — повідомлення повернуто в чергу і ще буде відправлене
+            if ok is not None:
+                self.stats["sent" if ok else "failed"] += 1
+                msg.batch._finish(ok)
+                if msg.outbox_id is not None:
+                    self._acks.append(msg.outbox_id)
+            self._queue.task_done()
+
+    async def _deliver(self, msg):
+        # "Через 5 хв" після самої події не надсилаємо (і не витрачаємо на це ліміт)
+        if msg.render(datetime.now()) is None:
+            self.stats["expired"] += 1
+            return False
+        interval = self.group_interval if msg.is_group else self.chat_interval
+        await self._wait_chat(msg.chat_id, interval)
+        # Пауза після flood control перевіряється всередині acquire()
+        await self._bucket.acquire()
+        # Хвилини в тексті рахуємо на момент фактичної відправки
+        text = msg.render(datetime.now())
+        if text is None:
+            self.stats["expired"] += 1
+            return False
+        # Інтервал рахуємо від фактичної відправки, а не від бронювання
+        self._chat_ready[msg.chat_id] = time.monotonic() + interval
+        try:
+            await self._bot.send_message(msg.chat_id, text, parse_mode="Markdown")
+        except TelegramRetryAfter as e:
+            # Flood control — сигнал темпу, а не збій: повертаємо в чергу без ліміту
+            # спроб, застаріле повідомлення відкине render() (event_at / deadline)
+            self._throttle(e.retry_after)
+            self._retry(msg)
+            return None
+        except (TelegramNetworkError, TelegramServerError):
+            # Тимчасова помилка мережі/Telegram — повтор із експоненційною затримкою
+            msg.attempts += 1
+            if msg.attempts >= DELIVERY_MAX_ATTEMPTS:
+                return False
+            self._retry(msg, 2 ** (msg.attempts - 1))
+            return None
+        except (TelegramForbiddenError, TelegramBadRequest):
+            # Користувач заблокував бота / чат недоступний
+            if not msg.is_group:
+                await db.mark_user_inactive(msg.chat_id)
+            return False
+        except Exception:
+            return False
+
+        # Після успішних відправок поступово повертаємось до повної швидкості
+        if self._bucket.rate < self.rate:
+            self._bucket.rate = min(self.rate, self._bucket.rate + _RECOVERY_STEP)
+        return True
+
+
+# Спільний рушій розсилки (запускається в main.py)
+engine = DeliveryEngine()
@@ -11,11 +11,11 @@ from aiogram.filters import (
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.types import KeyboardButton, InlineKeyboardButton, ChatMemberUpdated
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 import database as db
 import api_utils as api
 import scheduler
+import delivery
 from config import ADMIN_IDS, BOT_TOKEN  # Імпортуємо список адмінів
 
 # Для сумісності з вашим старим кодом, якщо ADMIN_ID використовується як число
@@ -248,8 +248,8 @@ async def bot_added_to_group(event: ChatMemberUpdated):
 # --- КОМАНДА /setup ДЛЯ ГРУПИ ---
 async def send_group_region_menu(message_or_callback, target_chat_id):
     """Показує меню вибору регіону для групи/каналів. Може викликатись з групи або в особистих."""
-    data = await api.fetch_api_data()
-    if not data:
+    snapshot = await api.fetch_snapshot()
+    if not snapshot:
         if isinstance(message_or_callback, types.Message):
             await message_or_callback.answer("⚠️ Помилка отримання даних.")
         else:
@@ -257,10 +257,8 @@ async def send_group_region_menu(message_or_callback, target_chat_id):
         return
 
     kb = InlineKeyboardBuilder()
-    for idx, region in enumerate(data["regions"]):
-        kb.button(
-            text=region["name_ua"], callback_data=f"grp_reg|{target_chat_id}|{idx}"
-        )
+    for idx, region_name in enumerate(snapshot.region_names):
+        kb.button(text=region_name, callback_data=f"grp_reg|{target_chat_id}|{idx}")
     kb.adjust(2)
 
     text = "⚙️ **Налаштування групи/каналу**\n\n" "👇 Оберіть область:"
@@ -301,35 +299,33 @@ async def grp_select_region(callback: types.CallbackQuery):
         await callback.answer("⛔ Тільки адмін!", show_alert=True)
         return
 
-    data = await api.fetch_api_data()
-    if not data or "regions" not in data or region_idx >= len(data["regions"]):
+    snapshot = await api.fetch_snapshot()
+    region_name = snapshot.region_at(region_idx) if snapshot else None
+    if region_name is None:
         await callback.answer("Помилка API", show_alert=True)
         return
 
-    region_data = data["regions"][region_idx]
-    region_name = region_data["name_ua"]
-
     # Показуємо першу сторінку черг
     await show_grp_queue_page(
-        callback, target_chat_id, region_idx, region_name, region_data, page=0
+        callback,
+        target_chat_id,
+        region_idx,
+        region_name,
+        snapshot.queues(region_name),
+        page=0,
     )
 
 
 async def show_grp_queue_page(
-    callback, target_chat_id, region_idx, region_name, region_data, page=0
+    callback, target_chat_id, region_idx, region_name, queues, page=0
 ):
-    """Показує сторінку черг для групи (пагінація по 12)."""
+    """Показує сторінку черг для групи (пагінація по 12). queues — вже відсортовані."""
     QUEUES_PER_PAGE = 12
 
-    sch = region_data.get("schedule")
-    if not sch:
+    if not queues:
         await callback.answer("Черги не знайдено", show_alert=True)
         return
 
-    queues = sorted(
-        sch.keys(),
-        key=lambda x: [int(p) for p in x.split(".")] if "." in x else [int(x), 0],
-    )
     total_pages = (len(queues) + QUEUES_PER_PAGE - 1) // QUEUES_PER_PAGE
     page = max(0, min(page, total_pages - 1))
     start = page * QUEUES_PER_PAGE
@@ -383,15 +379,19 @@ async def grp_queue_page_nav(callback: types.CallbackQuery):
     region_idx = int(parts[2])
     page = int(parts[3])
 
-    data = await api.fetch_api_data()
-    if not data or "regions" not in data or region_idx >= len(data["regions"]):
+    snapshot = await api.fetch_snapshot()
+    region_name = snapshot.region_at(region_idx) if snapshot else None
+    if region_name is None:
         await callback.answer("Помилка API", show_alert=True)
         return
 
-    region_data = data["regions"][region_idx]
-    region_name = region_data["name_ua"]
     await show_grp_queue_page(
-        callback, target_chat_id, region_idx, region_name, region_data, page=page
+        callback,
+        target_chat_id,
+        region_idx,
+        region_name,
+        snapshot.queues(region_name),
+        page=page,
     )
 
 
@@ -407,13 +407,12 @@ async def grp_select_queue(callback: types.CallbackQuery):
         await callback.answer("⛔ Тільки адмін!", show_alert=True)
         return
 
-    data = await api.fetch_api_data()
-    if not data or "regions" not in data or region_idx >= len(data["regions"]):
+    snapshot = await api.fetch_snapshot()
+    region_name = snapshot.region_at(region_idx) if snapshot else None
+    if region_name is None:
         await callback.answer("Помилка API", show_alert=True)
         return
 
-    region_name = data["regions"][region_idx]["name_ua"]
-
     # Зберігаємо підписку групи. `added_by` = callback.from_user.id
     chat_title = "Без назви"
     chat_type = "supergroup"
@@ -452,13 +451,8 @@ async def grp_select_queue(callback: types.CallbackQuery):
         cached_data = scheduler.schedules_cache.get((region_name, queue))
         if cached_data is not None:
             schedule = cached_data.get("today")
-        else:
-            api_data = await api.fetch_api_data()
-            if api_data:
-                for r in api_data["regions"]:
-                    if r["name_ua"] == region_name:
-                        schedule = r["schedule"].get(queue, {}).get(today)
-                        break
+        elif snapshot:
+            schedule = snapshot.schedule(region_name, queue, today)
 
         if schedule:
             text = api.format_message(
@@ -1146,14 +1140,14 @@ async def close_settings_handler(callback: types.CallbackQuery):
 
 
 async def show_regions_menu(message: types.Message, text):
-    data = await api.fetch_api_data()
-    if not data:
+    snapshot = await api.fetch_snapshot()
+    if not snapshot:
         await message.answer("⚠️ Помилка отримання даних.")
         return
 
     kb = InlineKeyboardBuilder()
-    for region in data["regions"]:
-        kb.button(text=region["name_ua"], callback_data=f"reg|{region['name_ua']}")
+    for region_name in snapshot.region_names:
+        kb.button(text=region_name, callback_data=f"reg|{region_name}")
     kb.adjust(2)
     kb.row(
         InlineKeyboardButton(
@@ -1174,23 +1168,13 @@ async def show_queue_page(callback, region_name, page=0):
     """Показує сторінку черг для обраного регіону (пагінація по 12)."""
     QUEUES_PER_PAGE = 12
 
-    data = await api.fetch_api_data()
-    if not data:
+    snapshot = await api.fetch_snapshot()
+    if not snapshot:
         await callback.answer("⚠️ Помилка API", show_alert=True)
         return
 
-    queues = []
-    for r in data["regions"]:
-        if r["name_ua"] == region_name:
-            sch = r.get("schedule")
-            if sch:
-                queues = sorted(
-                    sch.keys(),
-                    key=lambda x: (
-                        [int(p) for p in x.split(".")] if "." in x else [int(x), 0]
-                    ),
-                )
-            break
+    # Черги вже відсортовані в знімку — на перегортанні сторінок нічого не рахуємо
+    queues = snapshot.queues(region_name)
 
     if not queues:
         await callback.answer("Черги не знайдено", show_alert=True)
@@ -1299,15 +1283,9 @@ async def show_today_schedule(
     if cached_data is not None:
         schedule = cached_data.get("today")
     else:
-        data = await api.fetch_api_data()
-        if data:
-            for r in data["regions"]:
-                if r["name_ua"] == region:
-                    schedule = r["schedule"].get(queue, {}).get(today)
-                    break
-
-    if schedule:
-        await db.save_stats(region, queue, today, api.calculate_off_hours(schedule))
+        snapshot = await api.fetch_snapshot()
+        if snapshot:
+            schedule = snapshot.schedule(region, queue, today)
 
     text = api.format_message(
         schedule, queue, today, is_tomorrow=False, display_mode=display_mode
@@ -1372,17 +1350,9 @@ async def btn_tomorrow(message: types.Message):
     if cached_data is not None:
         schedule = cached_data.get("tomorrow")
     else:
-        data = await api.fetch_api_data()
-        if data:
-            for r in data["regions"]:
-                if r["name_ua"] == user[0]:
-                    schedule = r["schedule"].get(user[1], {}).get(tomorrow, None)
-                    break
-
-    if schedule:
-        await db.save_stats(
-            user[0], user[1], tomorrow, api.calculate_off_hours(schedule)
-        )
+        snapshot = await api.fetch_snapshot()
+        if snapshot:
+            schedule = snapshot.schedule(user[0], user[1], tomorrow)
 
     text = api.format_message(
         schedule, user[1], tomorrow, is_tomorrow=True, display_mode=display_mode
@@ -1403,7 +1373,7 @@ async def btn_stats(message: types.Message):
             await message.answer("Налаштуйте бота в особистих повідомленнях.")
         return
 
-    api_data = await api.fetch_api_data()
+    snapshot = await api.fetch_snapshot()
 
     total = 0
     lines = []
@@ -1415,17 +1385,10 @@ async def btn_stats(message: types.Message):
         d_str = d.strftime("%Y-%m-%d")
 
         val = await db.get_off_hours_for_date(user[0], user[1], d_str)
-        if val is None and api_data:
-            schedule = None
-            for r in api_data["regions"]:
-                if r["name_ua"] == user[0]:
-                    schedule = r["schedule"].get(user[1], {}).get(d_str)
-                    break
-            if schedule:
-                val = api.calculate_off_hours(schedule)
-                await db.save_stats(user[0], user[1], d_str, val)
-            else:
-                val = 0
+        if val is None and snapshot:
+            schedule = snapshot.schedule(user[0], user[1], d_str)
+            # Статистику записує check_updates; тут лише рахуємо для показу
+            val = api.calculate_off_hours(schedule) if schedule else 0
         elif val is None:
             val = 0
 
@@ -1531,8 +1494,7 @@ async def admin_sources_control(message: types.Message):
         return
 
     # Отримуємо поточний стан HOE сайту
-    site_enabled = await db.get_system_config("hoe_site_enabled", "1")
-    status_icon = "✅" if site_enabled == "1" else "❌"
+    status_icon = "✅" if db.is_hoe_site_enabled() else "❌"
 
     # Отримуємо стан API failover
     api_status = api.get_api_status()
@@ -1626,8 +1588,7 @@ async def force_switch_api_callback(call: types.CallbackQuery):
 
     # Оновлюємо повідомлення
     api_status_new = api.get_api_status()
-    site_enabled = await db.get_system_config("hoe_site_enabled", "1")
-    status_icon = "✅" if site_enabled == "1" else "❌"
+    status_icon = "✅" if db.is_hoe_site_enabled() else "❌"
 
     text = (
         "🛠 **Керування джерелами даних**\n\n"
@@ -1662,8 +1623,7 @@ async def toggle_hoe_site_callback(call: types.CallbackQuery):
     if call.from_user.id != ADMIN_ID:
         return
 
-    current = await db.get_system_config("hoe_site_enabled", "1")
-    new_value = "0" if current == "1" else "1"
+    new_value = "0" if db.is_hoe_site_enabled() else "1"
     await db.set_system_config("hoe_site_enabled", new_value)
 
     status_icon = "✅" if new_value == "1" else "❌"
@@ -1951,26 +1911,17 @@ async def handle_text_messages(message: types.Message):
             return
 
         users = await db.get_all_users_for_broadcast()
-        sent, failed = 0, 0
         if users:
             await message.answer(f"📤 Відправка {len(users)} користувачам...")
-            for (uid,) in users:
-                try:
-                    await message.bot.send_message(
-                        uid,
-                        f"📢 **Сповіщення:**\n\n{message.text}",
-                        parse_mode="Markdown",
-                    )
-                    sent += 1
-                    await asyncio.sleep(0.05)
-                except (TelegramForbiddenError, TelegramBadRequest):
-                    failed += 1
-                    await db.mark_user_inactive(uid)
-                except Exception:
-                    failed += 1
+            text = f"📢 **Сповіщення:**\n\n{message.text}"
+            # Найнижчий пріоритет: не затримує попередження про відключення
+            batch = await delivery.engine.submit(
+                ((uid, text) for (uid,) in users), priority=delivery.BULK
+            )
+            await batch.wait()
 
             await message.answer(
-                f"✅ **Розсилка завершена!**\n✓ {sent} / ✗ {failed}",
+                f"✅ **Розсилка завершена!**\n✓ {batch.sent} / ✗ {batch.failed}",
                 parse_mode="Markdown",
             )
         else:
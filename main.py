@@ -4,8 +4,10 @@ import logging
 from aiogram import Bot, Dispatcher
 from config import BOT_TOKEN
 import database
+import api_utils
 import handlers
 import scheduler
+import delivery
 
 # Налаштування логування (щоб бачити помилки в консолі)
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +18,11 @@ async def main():
     await database.init_db()
     print("✅ База даних підключена")
 
+    # Спільна HTTP-сесія для всіх джерел графіків (keep-alive пул)
+    await api_utils.init_http_session()
+    # Останні відомі графіки з диска (щоб бот відповідав ще до першого запиту до API)
+    await api_utils.load_cache_from_disk()
+
     # 2. Створення бота і диспетчера
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
@@ -23,18 +30,30 @@ async def main():
     # 3. Підключення роутера з handlers.py
     dp.include_router(handlers.router)
 
+    # Історія сповіщень і пул відправників (з дочитуванням outbox після рестарту)
+    await scheduler.restore_state()
+    await delivery.engine.start(bot)
+
     # 4. Запуск фонових задач (передаємо бота, щоб вони могли слати повідомлення)
     asyncio.create_task(scheduler.check_updates(bot))
     asyncio.create_task(scheduler.check_alerts(bot))
 
     # === НОВЕ: ЗАПУСК БЕКАПЕРА ===
     asyncio.create_task(scheduler.auto_backup(bot))
+    # Відкладений запис статистики відключень
+    asyncio.create_task(scheduler.flush_stats_loop())
 
     print("✅ Фонові процеси запущені")
 
     # 5. Старт бота
     print("🤖 Бот запущено! Натисніть Ctrl+C для зупинки.")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await delivery.engine.stop()
+        await api_utils.close_http_session()
+        await database.flush_stats()
+        await database.close_db()
 
 
 if __name__ == "__main__":
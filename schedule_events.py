@@ -0,0 +1,199 @@
+# schedule_events.py
+from snapshot import STATUS_OFF
+
+# === ТИПИ ПОДІЙ ===
+TODAY_PUBLISHED = "today_published"  # З'явився графік на сьогодні (новий день)
+TODAY_CHANGED = "today_changed"  # Змінились гарантовані відключення на сьогодні
+TOMORROW_PUBLISHED = "tomorrow_published"  # Оприлюднено графік на завтра
+TOMORROW_CHANGED = "tomorrow_changed"  # Змінились відключення на завтра
+EMERGENCY_ENTERED = "emergency_entered"  # Регіон перейшов в екстрений режим
+REGION_DISAPPEARED = "region_disappeared"  # Регіон зник з даних API
+QUEUE_ADDED = "queue_added"  # У регіоні з'явилась нова черга
+
+# Обробники подій: { kind: [async handler(event, bot), ...] }
+_handlers = {}
+
+
+class ScheduleEvent:
+    """Типізована подія зміни графіка.
+
+    intervals — гарантовані відключення (статус 2) нового графіка,
+    previous — інтервали попереднього графіка (для *_CHANGED).
+    initial=True — подія з першого знімка після старту (стан лише ініціалізується).
+    """
+
+    __slots__ = (
+        "kind",
+        "region",
+        "queue",
+        "date",
+        "schedule",
+        "intervals",
+        "previous",
+        "initial",
+    )
+
+    def __init__(
+        self,
+        kind,
+        region,
+        queue=None,
+        date=None,
+        schedule=None,
+        previous=None,
+        initial=False,
+    ):
+        self.kind = kind
+        self.region = region
+        self.queue = queue
+        self.date = date
+        self.schedule = schedule
+        self.intervals = schedule.intervals(STATUS_OFF) if schedule is not None else ()
+        self.previous = previous.intervals(STATUS_OFF) if previous is not None else ()
+        self.initial = initial
+
+    def __repr__(self):
+        where = "/".join(str(p) for p in (self.region, self.queue, self.date) if p)
+        return f"<ScheduleEvent {self.kind} {where}>"
+
+
+class ScheduleDiffer:
+    """Порівнює послідовні знімки графіків і повертає список подій.
+
+    known — стан "що вже відомо" по чергах: { (region, queue): {"date", "today", "tomorrow"} }.
+    Якщо графік на сьогодні/завтра тимчасово зник з API, відомий графік зберігається до кінця дня.
+    """
+
+    def __init__(self, known=None):
+        self.known = known if known is not None else {}
+        self._prev = None
+        self._date = None
+
+    def feed(self, snapshot, today, tomorrow):
+        prev = self._prev
+        initial = prev is None
+        events = []
+
+        if not initial and prev is not snapshot:
+            events.extend(self._diff_regions(prev, snapshot))
+
+        # Новий день (або перший знімок) — перевіряємо всі черги,
+        # інакше тільки ті, чиї відбитки на сьогодні/завтра змінились
+        if initial or self._date != today:
+            pairs = {
+                (region, queue)
+                for region in snapshot.region_names
+                for queue in snapshot.queues(region)
+            }
+        else:
+            pairs = {
+                (region, queue)
+                for region, queue, date_str in snapshot.changed_since(prev)
+                if date_str in (today, tomorrow)
+            }
+
+        for region, queue in sorted(pairs):
+            if snapshot.has_region(region):
+                events.extend(
+                    self._diff_queue(snapshot, region, queue, today, tomorrow, initial)
+                )
+
+        self._prev = snapshot
+        self._date = today
+        return events
+
+    def _diff_regions(self, prev, snapshot):
+        events = []
+        for region in snapshot.emergency_regions - prev.emergency_regions:
+            events.append(ScheduleEvent(EMERGENCY_ENTERED, region))
+        for region in prev.region_names:
+            if not snapshot.has_region(region):
+                events.append(ScheduleEvent(REGION_DISAPPEARED, region))
+        for region in snapshot.region_names:
+            if not prev.has_region(region):
+                continue
+            old_queues = set(prev.queues(region))
+            for queue in snapshot.queues(region):
+                if queue not in old_queues:
+                    events.append(ScheduleEvent(QUEUE_ADDED, region, queue))
+        return events
+
+    def _diff_queue(self, snapshot, region, queue, today, tomorrow, initial):
+        events = []
+        today_sch = snapshot.schedule(region, queue, today)
+        tom_sch = snapshot.schedule(region, queue, tomorrow)
+
+        old = self.known.get((region, queue), {})
+        same_day = old.get("date") == today
+        known_today = old.get("today") if same_day else None
+        known_tom = old.get("tomorrow") if same_day else None
+
+        # --- 1. СЬОГОДНІ ---
+        if today_sch:
+            if not known_today:
+                kind = TODAY_PUBLISHED
+            elif today_sch.intervals(STATUS_OFF) != known_today.intervals(STATUS_OFF):
+                kind = TODAY_CHANGED
+            else:
+                kind = None
+            if kind:
+                events.append(
+                    ScheduleEvent(
+                        kind, region, queue, today, today_sch, known_today, initial
+                    )
+                )
+
+        # --- 2. ЗАВТРА ---
+        if tom_sch is not None:
+            if known_tom is None:
+                events.append(
+                    ScheduleEvent(
+                        TOMORROW_PUBLISHED,
+                        region,
+                        queue,
+                        tomorrow,
+                        tom_sch,
+                        initial=initial,
+                    )
+                )
+            elif tom_sch.intervals(STATUS_OFF) != known_tom.intervals(STATUS_OFF):
+                events.append(
+                    ScheduleEvent(
+                        TOMORROW_CHANGED,
+                        region,
+                        queue,
+                        tomorrow,
+                        tom_sch,
+                        known_tom,
+                        initial,
+                    )
+                )
+
+        # Захист від збою API серед дня: відсутній графік не затирає відомий
+        self.known[(region, queue)] = {
+            "date": today,
+            "today": known_today if same_day and today_sch is None else today_sch,
+            "tomorrow": known_tom if same_day and tom_sch is None else tom_sch,
+        }
+        return events
+
+
+def on(*kinds):
+    """Декоратор: підписує async-обробник на події вказаних типів."""
+
+    def decorator(handler):
+        for kind in kinds:
+            _handlers.setdefault(kind, []).append(handler)
+        return handler
+
+    return decorator
+
+
+async def dispatch(events, bot):
+    """Передає події підписаним обробникам (помилка одного не зупиняє інших)."""
+    for event in events:
+        for handler in _handlers.get(event.kind, ()):
+            try:
+                await handler(event, bot)
+            except Exception as e:
+                print(f"⚠️ Event handler error ({event!r}): {e}")
@@ -1,117 +1,115 @@
 # scheduler.py
 import asyncio
-import json
+import os
 from datetime import datetime, timedelta
 from aiogram.types import FSInputFile
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+import alert_plan
 import api_utils as api
 import database as db
-from config import UPDATE_INTERVAL, ADMIN_IDS, DB_NAME
+import delivery
+import schedule_events
+from config import (
+    UPDATE_INTERVAL,
+    ADMIN_IDS,
+    STATS_FLUSH_INTERVAL,
+    BACKUP_DIR,
+    BACKUP_KEEP,
+)
 
 # Кеш в пам'яті
 schedules_cache = {}
+# Порівняння знімків графіків → події (стан зберігається в schedules_cache)
+schedule_differ = schedule_events.ScheduleDiffer(schedules_cache)
 # Історія сповіщень
 alert_history = set()
+# Заплановані сповіщення (перебудовуються лише при зміні графіків або набору
+# черг з підписниками; черги без підписників не плануються)
+planned_alerts = alert_plan.AlertPlan(wanted=lambda key: _has_subscribers(*key))
+# Знімок, для якого вже порахована статистика відключень
+_stats_snapshot = None
 
 # === НОВЕ: Трекінг стану API для сповіщень адміну ===
 _last_known_api_source = None
-_last_known_emergency = set()
 
 # Словник відправок: { (region, queue): "2024-01-26" }
 sent_notifications = {}
 
-
-async def smart_broadcast(bot, region, queue, text_blackout, text_light, filter_func):
+# Скільки часу ранкове зведення ще актуальне в черзі розсилки
+_DIGEST_TTL = timedelta(hours=3)
+
+
+async def smart_broadcast(
+    bot,
+    region,
+    queue,
+    text_blackout,
+    text_light,
+    kind,
+    offset=None,
+    priority=delivery.CHANGE,
+    event_at=None,
+    deadline=None,
+):
     """
     Розумна розсилка в ОСОБИСТІ:
-    1. Перевіряє налаштування кожного юзера (filter_func).
-    2. Відправляє текст залежно від режиму (blackout/light).
+    1. Отримує активних юзерів черги, у яких увімкнено сповіщення
+       типу kind (і, якщо задано, попередження за offset хвилин).
+    2. Ставить текст залежно від режиму (blackout/light) у спільну чергу розсилки
+       з указаним пріоритетом і не чекає на відправку (повертає Batch).
     """
-    users = await db.get_users_by_queue(region, queue)
-
-    for (uid,) in users:
-        try:
-            # Отримуємо налаштування юзера
-            settings = await db.get_user_settings(uid)
-
-            # Перевіряємо, чи підходить цей юзер під умови розсилки
-            if not filter_func(settings):
-                continue
-
-            # Вибираємо правильний текст
-            mode = settings.get("display_mode", "blackout")
-            text_to_send = text_light if mode == "light" else text_blackout
-
-            await bot.send_message(uid, text_to_send, parse_mode="Markdown")
-        except (TelegramForbiddenError, TelegramBadRequest):
-            await db.mark_user_inactive(uid)
-        except Exception:
-            pass
-
-        # Невелика затримка, щоб уникнути блокування за флуд
-        await asyncio.sleep(0.05)
-
-
-async def group_broadcast(bot, region, queue, text_blackout, text_light, filter_func):
+    users = await db.get_queue_recipients(region, queue, kind, offset)
+    return await delivery.engine.submit(
+        (
+            (uid, text_light if mode == "light" else text_blackout)
+            for uid, mode in users
+        ),
+        priority=priority,
+        event_at=event_at,
+        deadline=deadline,
+    )
+
+
+async def group_broadcast(
+    bot,
+    region,
+    queue,
+    text_blackout,
+    text_light,
+    kind,
+    offset=None,
+    priority=delivery.CHANGE,
+    event_at=None,
+    deadline=None,
+):
     """
     Розсилка в ГРУПИ І КАНАЛИ:
-    1. Перевіряє налаштування групи (filter_func).
-    2. Відправляє текст залежно від режиму (blackout/light).
+    1. Отримує групи черги з увімкненим сповіщенням kind/offset.
+    2. Ставить текст залежно від режиму (blackout/light) у спільну чергу розсилки.
     """
-    groups = await db.get_groups_by_queue(region, queue)
-
-    for group in groups:
-        chat_id = group[0]
-        settings = {
-            "display_mode": group[1] or "blackout",
-            "notify_outage": group[2] if group[2] is not None else 1,
-            "notify_return": group[3] if group[3] is not None else 1,
-            "notify_changes": group[4] if group[4] is not None else 1,
-            "notify_morning": group[5] if group[5] is not None else 1,
-            "notify_before": group[6] if len(group) > 6 and group[6] is not None else 5,
-            "notify_return_before": (
-                group[7] if len(group) > 7 and group[7] is not None else 0
-            ),
-        }
-
-        try:
-            if not filter_func(settings):
-                continue
-
-            mode = settings.get("display_mode", "blackout")
-            text_to_send = text_light if mode == "light" else text_blackout
-
-            await bot.send_message(chat_id, text_to_send, parse_mode="Markdown")
-        except Exception:
-            pass
-
-        await asyncio.sleep(0.05)
-
-
-def find_next_outage(current_time_str, today_intervals, tomorrow_intervals):
-    """Шукає час наступного відключення."""
-    for start, end in today_intervals:
-        if start > current_time_str:
-            return f"сьогодні о {start}"
-
-    if tomorrow_intervals:
-        start, end = tomorrow_intervals[0]
-        return f"завтра о {start}"
-
-    return None
+    groups = await db.get_group_recipients(region, queue, kind, offset)
+    return await delivery.engine.submit(
+        (
+            (chat_id, text_light if mode == "light" else text_blackout)
+            for chat_id, mode in groups
+        ),
+        is_group=True,
+        priority=priority,
+        event_at=event_at,
+        deadline=deadline,
+    )
 
 
 async def check_updates(bot):
     """Перевіряє оновлення графіків на сайті."""
-    global _last_known_api_source, _last_known_emergency
-    first_run = True
+    global _last_known_api_source
 
     while True:
         try:
             # Очищаємо старі дані статистики
             await db.cleanup_old_stats()
 
-            data = await api.fetch_api_data()
+            # Чекаємо свіже оновлення (а не знімок із кешу), щоб не пропустити зміни
+            snapshot = await api.fetch_snapshot(wait_fresh=True)
 
             # === НОВЕ: Трекінг перемикання API та сповіщення адміну ===
             current_source = api.api_state.get("active_source", "primary")
@@ -147,220 +145,19 @@ async def check_updates(bot):
                     pass
             _last_known_api_source = current_source
 
-            # === НОВЕ: Сповіщення про екстрені відключення ===
-            current_emergency = api.api_state.get("last_emergency_regions", set())
-            new_emergency = current_emergency - _last_known_emergency
-            if new_emergency and not first_run:
-                for region_name in new_emergency:
-                    emergency_msg = f"🚨 **ЕКСТРЕНІ ВІДКЛЮЧЕННЯ!**\n📍 {region_name}\n\nВ регіоні діють позапланові відключення."
-                    # Розсилка всім юзерам цього регіону
-                    subs = await db.get_all_subs()
-                    for reg, queue in subs:
-                        if reg == region_name:
-                            await smart_broadcast(
-                                bot,
-                                reg,
-                                queue,
-                                emergency_msg,
-                                emergency_msg,
-                                lambda s: s["notify_changes"] == 1,
-                            )
-                            await group_broadcast(
-                                bot,
-                                reg,
-                                queue,
-                                emergency_msg,
-                                emergency_msg,
-                                lambda s: s["notify_changes"] == 1,
-                            )
-            _last_known_emergency = (
-                current_emergency.copy() if current_emergency else set()
-            )
-
-            if data:
-                today = datetime.now().strftime("%Y-%m-%d")
-                tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-
-                today_nice = datetime.now().strftime("%d.%m")
-                tomorrow_nice = (datetime.now() + timedelta(days=1)).strftime("%d.%m")
+            if snapshot:
+                now = datetime.now()
+                today = now.strftime("%Y-%m-%d")
+                tomorrow = (now + timedelta(days=1)).strftime("%Y-%m-%d")
 
-                subs = await db.get_all_subs()
+                # Статистика рахується тут, а не при перегляді графіка користувачем
+                await _materialize_stats(snapshot)
 
-                for region, queue in subs:
-                    r_data = next(
-                        (r for r in data["regions"] if r["name_ua"] == region), None
-                    )
-                    if not r_data:
-                        continue
-
-                    today_sch = r_data["schedule"].get(queue, {}).get(today, None)
-                    tom_sch = r_data["schedule"].get(queue, {}).get(tomorrow, None)
-
-                    cached = schedules_cache.get((region, queue), {})
-                    cached_date = cached.get("date")
-
-                    if cached_date != today:
-                        cached_today = None
-                        cached_tom = None
-                    else:
-                        cached_today = cached.get("today")
-                        cached_tom = cached.get("tomorrow")
-
-                    # --- 1. ПЕРЕВІРКА СЬОГОДНІ ---
-                    if today_sch:
-                        await db.save_stats(
-                            region, queue, today, api.calculate_off_hours(today_sch)
-                        )
-
-                        # ВАЖЛИВО: target_status=2 означає, що ми реагуємо на зміни ГАРАНТОВАНИХ відключень
-                        current_norm = api.parse_intervals(today_sch, target_status=2)
-                        cached_norm = (
-                            api.parse_intervals(cached_today, target_status=2)
-                            if cached_today
-                            else None
-                        )
-
-                        # print(f"[DEBUG] {region}/{queue} | cached_today={cached_today} | today_sch={today_sch}")
-                        # print(f"[DEBUG] cached_norm={cached_norm} | current_norm={current_norm}")
-
-                        if cached_norm is not None and json.dumps(
-                            current_norm, sort_keys=True
-                        ) != json.dumps(cached_norm, sort_keys=True):
-                            txt_b = api.format_message(
-                                today_sch, queue, today, False, "blackout"
-                            )
-                            txt_l = api.format_message(
-                                today_sch, queue, today, False, "light"
-                            )
-
-                            if not first_run:
-                                header = f"🔄 📅 **Оновлено графік на СЬОГОДНІ! ({today_nice})**\n"
-                                await smart_broadcast(
-                                    bot,
-                                    region,
-                                    queue,
-                                    header + txt_b.split("\n", 1)[1],
-                                    header + txt_l.split("\n", 1)[1],
-                                    lambda s: s["notify_changes"] == 1,
-                                )
-                                # === НОВЕ: розсилка в групи ===
-                                await group_broadcast(
-                                    bot,
-                                    region,
-                                    queue,
-                                    header + txt_b.split("\n", 1)[1],
-                                    header + txt_l.split("\n", 1)[1],
-                                    lambda s: s["notify_changes"] == 1,
-                                )
-                                # Запам'ятовуємо, що для цієї черги вже було відправлено актуальний графік
-                                sent_notifications[(region, queue)] = today
-
-                    # --- 2. ПЕРЕВІРКА ЗАВТРА ---
-                    if (tom_sch is not None) and (cached_tom is None):
-                        await db.save_stats(
-                            region, queue, tomorrow, api.calculate_off_hours(tom_sch)
-                        )
-
-                        if not first_run and api.calculate_off_hours(tom_sch) > 0:
-                            txt_b = api.format_message(
-                                tom_sch, queue, tomorrow, True, "blackout"
-                            )
-                            txt_l = api.format_message(
-                                tom_sch, queue, tomorrow, True, "light"
-                            )
-
-                            await smart_broadcast(
-                                bot,
-                                region,
-                                queue,
-                                txt_b,
-                                txt_l,
-                                lambda s: s["notify_changes"] == 1,
-                            )
-                            # === НОВЕ: розсилка в групи ===
-                            await group_broadcast(
-                                bot,
-                                region,
-                                queue,
-                                txt_b,
-                                txt_l,
-                                lambda s: s["notify_changes"] == 1,
-                            )
-
-                    elif (tom_sch is not None) and (cached_tom is not None):
-                        tom_norm = api.parse_intervals(tom_sch, target_status=2)
-                        cached_tom_norm = api.parse_intervals(
-                            cached_tom, target_status=2
-                        )
-
-                        if json.dumps(tom_norm, sort_keys=True) != json.dumps(
-                            cached_tom_norm, sort_keys=True
-                        ):
-                            await db.save_stats(
-                                region,
-                                queue,
-                                tomorrow,
-                                api.calculate_off_hours(tom_sch),
-                            )
-
-                            if not first_run:
-                                txt_b = api.format_message(
-                                    tom_sch, queue, tomorrow, True, "blackout"
-                                )
-                                txt_l = api.format_message(
-                                    tom_sch, queue, tomorrow, True, "light"
-                                )
-
-                                if txt_b:
-                                    header = f"🔄 🔮 **Оновлено графік на ЗАВТРА! ({tomorrow_nice})**\n"
-                                    await smart_broadcast(
-                                        bot,
-                                        region,
-                                        queue,
-                                        header + txt_b.split("\n", 1)[1],
-                                        header + txt_l.split("\n", 1)[1],
-                                        lambda s: s["notify_changes"] == 1,
-                                    )
-                                    # === НОВЕ: розсилка в групи ===
-                                    await group_broadcast(
-                                        bot,
-                                        region,
-                                        queue,
-                                        header + txt_b.split("\n", 1)[1],
-                                        header + txt_l.split("\n", 1)[1],
-                                        lambda s: s["notify_changes"] == 1,
-                                    )
-
-                    old_cache = schedules_cache.get((region, queue), {})
-                    # Зберігаємо старий кеш тільки якщо вже були дані на СЬОГОДНІ (захист від збою API серед дня)
-                    # Якщо новий день — None є нормою, не підміняємо
-                    same_day = old_cache.get("date") == today
-                    schedules_cache[(region, queue)] = {
-                        "date": today,
-                        "today": (
-                            old_cache.get("today")
-                            if same_day and today_sch is None
-                            else today_sch
-                        ),
-                        "tomorrow": (
-                            old_cache.get("tomorrow")
-                            if same_day and tom_sch is None
-                            else tom_sch
-                        ),
-                    }
-
-                current_date = datetime.now()
-                for i in range(7):
-                    d = (current_date - timedelta(days=i)).strftime("%Y-%m-%d")
-                    if "r_data" in locals() and r_data:
-                        sch = r_data["schedule"].get(queue, {}).get(d)
-                        if sch:
-                            await db.save_stats(
-                                region, queue, d, api.calculate_off_hours(sch)
-                            )
-
-                if first_run:
-                    first_run = False
+                # Порівнюємо зі станом попереднього знімка — обробляємо лише зміни
+                events = schedule_differ.feed(snapshot, today, tomorrow)
+                await schedule_events.dispatch(events, bot)
+                # Перебудовуємо план сповіщень для черг зі зміненим графіком
+                planned_alerts.refresh(schedules_cache)
 
         except Exception as e:
             print(f"Update Error: {e}")
@@ -368,296 +165,280 @@ async def check_updates(bot):
         await asyncio.sleep(UPDATE_INTERVAL)
 
 
-async def check_alerts(bot):
-    """Щохвилинна перевірка для сповіщень."""
-    # global schedule_sent_today # Більше не потрібно
-
-    while True:
-        try:
-            now = datetime.now()
-            curr_time = now.strftime("%H:%M")
-            today_str = now.strftime("%Y-%m-%d")
-
-            # --- СБРОС У 00:00 ---
-            if curr_time == "00:00":
-                alert_history.clear()
-                # Очищаємо історію відправок на новий день (опціонально, бо ми перевіряємо дату)
-                # sent_notifications.clear()
-
-            # --- НОВЕ: РАНКОВЕ ОПОВІЩЕННЯ (06:00) ---
-            if curr_time == "06:00":
-                print("☀️ Перевірка ранкового зведення...")
-                # Проходимо по всіх відомих чергах в кеші
-                for (region, queue), data in schedules_cache.items():
-                    # Переконуємось, що дані свіжі
-                    if data.get("date") != today_str:
-                        continue
-
-                    # Перевіряємо, чи ми вже відправляли графік для цієї конкретної черги сьогодні
-                    last_sent = sent_notifications.get((region, queue))
-                    if last_sent == today_str:
-                        continue  # Вже було оновлення вночі, пропускаємо
-
-                    today_sch = data.get("today")
-                    if not today_sch:
-                        continue
-
-                    # === НОВА ЛОГІКА: УНИКНЕННЯ СПАМУ ===
-                    # Отримуємо статистику
-                    today_off = api.calculate_off_hours(today_sch)
-
-                    # Отримуємо вчорашню дату і статистику
-                    yesterday = (datetime.now() - timedelta(days=1)).strftime(
-                        "%Y-%m-%d"
-                    )
-                    yesterday_off = await db.get_off_hours_for_date(
-                        region, queue, yesterday
-                    )
+async def _materialize_stats(snapshot):
+    """Записує години відключень для всіх графіків, що змінились з попереднього знімка."""
+    global _stats_snapshot
+    for region, queue, date_str in snapshot.changed_since(_stats_snapshot):
+        schedule = snapshot.schedule(region, queue, date_str)
+        if schedule:
+            await db.save_stats(
+                region, queue, date_str, api.calculate_off_hours(schedule)
+            )
+    _stats_snapshot = snapshot
 
-                    # Якщо ВЧОРА було 0 годин відключень, і СЬОГОДНІ теж 0 - пропускаємо
-                    # (Щоб не писати кожен день "Світла не вимикають")
-                    if today_off == 0 and yesterday_off == 0:
-                        # Але ставимо галочку, що ми "обробили" цю чергу, щоб не повертатися
-                        sent_notifications[(region, queue)] = today_str
-                        continue
-                    # ===================================
-
-                    # Формуємо повідомлення
-                    txt_b = api.format_message(
-                        today_sch, queue, today_str, False, "blackout"
-                    )
-                    txt_l = api.format_message(
-                        today_sch, queue, today_str, False, "light"
-                    )
 
-                    # Заголовок
-                    header = f"☀️ **Добрий ранок! Графік на сьогодні:**\n"
+# === НОВЕ: СТАН СПОВІЩЕНЬ, ЩО ПЕРЕЖИВАЄ РЕСТАРТ ===
+async def restore_state():
+    """Відновлює з бази історію сповіщень та дати надісланих графіків."""
+    await _load_alert_history(datetime.now())
+    sent_notifications.update(await db.get_sent_notifications())
+
 
-                    await smart_broadcast(
-                        bot,
-                        region,
-                        queue,
-                        header + txt_b.split("\n", 1)[1],
-                        header + txt_l.split("\n", 1)[1],
-                        lambda s: s["notify_changes"] == 1,
-                    )
-                    # === НОВЕ: розсилка в групи (ранкове зведення) ===
-                    await group_broadcast(
-                        bot,
-                        region,
-                        queue,
-                        header + txt_b.split("\n", 1)[1],
-                        header + txt_l.split("\n", 1)[1],
-                        lambda s: s["notify_changes"] == 1,
-                    )
+async def _load_alert_history(now):
+    # Сповіщення про завтрашні події (напр. 23:00 → відключення о 00:00) пишуться під завтрашньою датою
+    for day in (now, now + timedelta(days=1)):
+        alert_history.update(await db.get_alert_history(day.strftime("%Y-%m-%d")))
+
+
+async def _remember_alert(alert_id, day):
+    alert_history.add(alert_id)
+    await db.add_alert_history(alert_id, day)
+
+
+async def _remember_sent(region, queue, date_str):
+    sent_notifications[(region, queue)] = date_str
+    await db.set_sent_notification(region, queue, date_str)
+
+
+# === ОБРОБНИКИ ПОДІЙ ГРАФІКІВ ===
+# schedules_cache (стан ScheduleDiffer) містить усі черги знімка, а не лише ті,
+# на які хтось підписаний: так нова підписка одразу бачить відомий графік.
+# Розсилки та записи в базу робимо тільки для черг, у яких є підписники.
+def _has_subscribers(region, queue):
+    return db.subscriber_index.has_queue(region, queue)
+
+
+def _has_recipients(region, queue, kind, offset=None):
+    return db.subscriber_index.has_recipients(region, queue, kind, offset)
+
+
+@db.subscriber_index.on_queues_change
+def _replan_alerts():
+    # Черга отримала першого підписника або втратила останнього
+    planned_alerts.refresh(schedules_cache)
+
+
+def _nice_date(date_str):
+    return datetime.strptime(date_str, "%Y-%m-%d").strftime("%d.%m")
+
+
+async def _broadcast_change(bot, event, header=""):
+    """Розсилка графіка з події (в особисті та групи)."""
+    is_tomorrow = event.kind in (
+        schedule_events.TOMORROW_PUBLISHED,
+        schedule_events.TOMORROW_CHANGED,
+    )
+    txt_b = api.format_message(
+        event.schedule, event.queue, event.date, is_tomorrow, "blackout"
+    )
+    txt_l = api.format_message(
+        event.schedule, event.queue, event.date, is_tomorrow, "light"
+    )
+    if header:
+        txt_b = header + txt_b.split("\n", 1)[1]
+        txt_l = header + txt_l.split("\n", 1)[1]
+
+    await smart_broadcast(
+        bot,
+        event.region,
+        event.queue,
+        txt_b,
+        txt_l,
+        db.NOTIFY_CHANGES,
+    )
+    # === НОВЕ: розсилка в групи ===
+    await group_broadcast(
+        bot,
+        event.region,
+        event.queue,
+        txt_b,
+        txt_l,
+        db.NOTIFY_CHANGES,
+    )
+
+
+@schedule_events.on(schedule_events.TODAY_CHANGED)
+async def _on_today_changed(event, bot):
+    if event.initial or not _has_subscribers(event.region, event.queue):
+        return
+    header = f"🔄 📅 **Оновлено графік на СЬОГОДНІ! ({_nice_date(event.date)})**\n"
+    await _broadcast_change(bot, event, header)
+    # Запам'ятовуємо, що для цієї черги вже було відправлено актуальний графік
+    await _remember_sent(event.region, event.queue, event.date)
+
+
+@schedule_events.on(schedule_events.TOMORROW_PUBLISHED)
+async def _on_tomorrow_published(event, bot):
+    if event.initial or not _has_subscribers(event.region, event.queue):
+        return
+    if api.calculate_off_hours(event.schedule) <= 0:
+        return
+    await _broadcast_change(bot, event)
+
+
+@schedule_events.on(schedule_events.TOMORROW_CHANGED)
+async def _on_tomorrow_changed(event, bot):
+    if event.initial or not _has_subscribers(event.region, event.queue):
+        return
+    header = f"🔄 🔮 **Оновлено графік на ЗАВТРА! ({_nice_date(event.date)})**\n"
+    await _broadcast_change(bot, event, header)
+
+
+# === НОВЕ: Сповіщення про екстрені відключення ===
+@schedule_events.on(schedule_events.EMERGENCY_ENTERED)
+async def _on_emergency_entered(event, bot):
+    emergency_msg = f"🚨 **ЕКСТРЕНІ ВІДКЛЮЧЕННЯ!**\n📍 {event.region}\n\nВ регіоні діють позапланові відключення."
+    # Розсилка всім юзерам цього регіону
+    subs = await db.get_all_subs()
+    for reg, queue in subs:
+        if reg == event.region:
+            await smart_broadcast(
+                bot,
+                reg,
+                queue,
+                emergency_msg,
+                emergency_msg,
+                db.NOTIFY_CHANGES,
+                priority=delivery.ALERT,
+            )
+            await group_broadcast(
+                bot,
+                reg,
+                queue,
+                emergency_msg,
+                emergency_msg,
+                db.NOTIFY_CHANGES,
+                priority=delivery.ALERT,
+            )
 
-                    # Запам'ятовуємо, що відправили
-                    sent_notifications[(region, queue)] = today_str
 
-            # Часові точки для перевірки
-            check_moments = {
-                5: (now + timedelta(minutes=5)).strftime("%H:%M"),
-                15: (now + timedelta(minutes=15)).strftime("%H:%M"),
-                30: (now + timedelta(minutes=30)).strftime("%H:%M"),
-                60: (now + timedelta(minutes=60)).strftime("%H:%M"),
-            }
+@schedule_events.on(schedule_events.REGION_DISAPPEARED, schedule_events.QUEUE_ADDED)
+async def _on_structure_changed(event, bot):
+    if event.kind == schedule_events.REGION_DISAPPEARED:
+        print(f"⚠️ Регіон зник з даних API: {event.region}")
+    else:
+        print(f"➕ Нова черга: {event.region}/{event.queue}")
+
+
+async def _send_morning_digest(bot, now):
+    """Ранкове зведення (06:00) для черг, яким сьогодні ще не надсилали графік."""
+    print("☀️ Перевірка ранкового зведення...")
+    today_str = now.strftime("%Y-%m-%d")
+    # Проходимо по всіх відомих чергах в кеші
+    for (region, queue), data in list(schedules_cache.items()):
+        # Переконуємось, що дані свіжі і що зведення взагалі є кому надсилати
+        if data.get("date") != today_str:
+            continue
+        if not _has_recipients(region, queue, db.NOTIFY_CHANGES):
+            continue
+
+        # Перевіряємо, чи ми вже відправляли графік для цієї конкретної черги сьогодні
+        last_sent = sent_notifications.get((region, queue))
+        if last_sent == today_str:
+            continue  # Вже було оновлення вночі, пропускаємо
+
+        today_sch = data.get("today")
+        if not today_sch:
+            continue
+
+        # === НОВА ЛОГІКА: УНИКНЕННЯ СПАМУ ===
+        # Отримуємо статистику
+        today_off = api.calculate_off_hours(today_sch)
+
+        # Отримуємо вчорашню дату і статистику
+        yesterday = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+        yesterday_off = await db.get_off_hours_for_date(region, queue, yesterday)
+
+        # Якщо ВЧОРА було 0 годин відключень, і СЬОГОДНІ теж 0 - пропускаємо
+        # (Щоб не писати кожен день "Світла не вимикають")
+        if today_off == 0 and yesterday_off == 0:
+            # Але ставимо галочку, що ми "обробили" цю чергу, щоб не повертатися
+            await _remember_sent(region, queue, today_str)
+            continue
+        # ===================================
+
+        # Формуємо повідомлення
+        txt_b = api.format_message(today_sch, queue, today_str, False, "blackout")
+        txt_l = api.format_message(today_sch, queue, today_str, False, "light")
+
+        # Заголовок
+        header = f"☀️ **Добрий ранок! Графік на сьогодні:**\n"
+
+        await smart_broadcast(
+            bot,
+            region,
+            queue,
+            header + txt_b.split("\n", 1)[1],
+            header + txt_l.split("\n", 1)[1],
+            db.NOTIFY_CHANGES,
+            priority=delivery.DIGEST,
+            deadline=now + _DIGEST_TTL,
+        )
+        # === НОВЕ: розсилка в групи (ранкове зведення) ===
+        await group_broadcast(
+            bot,
+            region,
+            queue,
+            header + txt_b.split("\n", 1)[1],
+            header + txt_l.split("\n", 1)[1],
+            db.NOTIFY_CHANGES,
+            priority=delivery.DIGEST,
+            deadline=now + _DIGEST_TTL,
+        )
+
+        # Запам'ятовуємо, що відправили
+        await _remember_sent(region, queue, today_str)
+
+
+async def _fire_alert(bot, item):
+    """Розсилка одного запланованого сповіщення черги (особисті + групи)."""
+    if item.alert_id in alert_history:
+        return
+    region, queue = item.key
+    # Нікому надсилати — не ставимо в чергу розсилки і не пишемо в історію
+    if not _has_recipients(region, queue, item.notify, item.offset):
+        return
+    for broadcast in (smart_broadcast, group_broadcast):
+        await broadcast(
+            bot,
+            region,
+            queue,
+            item.text,
+            item.text,
+            item.notify,
+            item.offset,
+            priority=delivery.ALERT,
+            event_at=item.event_at,
+            deadline=item.deadline,
+        )
+    await _remember_alert(item.alert_id, item.day)
 
-            for key, data in list(schedules_cache.items()):
-                today_sch = data.get("today")
-                tom_sch = data.get("tomorrow")
 
-                if not today_sch:
-                    continue
+async def check_alerts(bot):
+    """Сповіщення за планом: спить до найближчого запланованого моменту, а не опитує щохвилини."""
+    planned_alerts.refresh(schedules_cache)
+    print(f"⏰ План сповіщень: {len(planned_alerts)} подій")
 
-                # ВАЖЛИВО: Отримуємо ГАРАНТОВАНІ відключення (status=2)
-                today_intervals = api.parse_intervals(today_sch, target_status=2)
-                tom_intervals = (
-                    api.parse_intervals(tom_sch, target_status=2) if tom_sch else []
-                )
+    while True:
+        try:
+            await planned_alerts.wait_next()
+            now = datetime.now()
 
-                # --- 1. ПЕРЕВІРКА ГАРАНТОВАНИХ (Status 2) ---
-                for start, end in today_intervals:
-                    # А) СПОВІЩЕННЯ ПРО ВІДКЛЮЧЕННЯ
-                    if start != "00:00":
-                        for mins, check_time in check_moments.items():
-                            if check_time == start:
-                                alert_id = f"{key}_{start}_out_pre_{mins}"
-                                if alert_id not in alert_history:
-                                    actual_end = end
-                                    if (
-                                        end == "24:00"
-                                        and tom_intervals
-                                        and tom_intervals[0][0] == "00:00"
-                                    ):
-                                        actual_end = tom_intervals[0][1]
-                                        actual_end = (
-                                            "кінця завтрашньої доби (24:00)"
-                                            if actual_end == "24:00"
-                                            else f"завтра до {actual_end}"
-                                        )
-                                    elif end == "24:00":
-                                        actual_end = "24:00"
-
-                                    msg = f"⏳ **Скоро відключення (через {mins} хв).**\nСвітла не буде до **{actual_end}**."
-
-                                    await smart_broadcast(
-                                        bot,
-                                        key[0],
-                                        key[1],
-                                        msg,
-                                        msg,
-                                        lambda s, m=mins: s["notify_outage"] == 1
-                                        and s["notify_before"] == m,
-                                    )
-                                    # === НОВЕ: розсилка в групи ===
-                                    await group_broadcast(
-                                        bot,
-                                        key[0],
-                                        key[1],
-                                        msg,
-                                        msg,
-                                        lambda s, m=mins: s["notify_outage"] == 1
-                                        and s["notify_before"] == m,
-                                    )
-                                    alert_history.add(alert_id)
-
-                    # Б) СПОВІЩЕННЯ ПРО ВКЛЮЧЕННЯ
-                    if end != "24:00":
-                        for mins, check_time in check_moments.items():
-                            if check_time == end:
-                                alert_id = f"{key}_{end}_ret_pre_{mins}"
-                                if alert_id not in alert_history:
-                                    msg = f"💡 **Світло з'явиться орієнтовно через {mins} хв (о {end}).**"
-
-                                    await smart_broadcast(
-                                        bot,
-                                        key[0],
-                                        key[1],
-                                        msg,
-                                        msg,
-                                        lambda s, m=mins: s["notify_return"] == 1
-                                        and s["notify_return_before"] == m,
-                                    )
-                                    # === НОВЕ: розсилка в групи ===
-                                    await group_broadcast(
-                                        bot,
-                                        key[0],
-                                        key[1],
-                                        msg,
-                                        msg,
-                                        lambda s, m=mins: s["notify_return"] == 1
-                                        and s["notify_return_before"] == m,
-                                    )
-                                    alert_history.add(alert_id)
-
-                # --- 2. МОЖЛИВІ (3) - СПОВІЩЕННЯ ПРО ПОЧАТОК ---
-                # Отримуємо інтервали можливих відключень
-                intervals_possible = api.parse_intervals(today_sch, target_status=3)
-                for start, end in intervals_possible:
-                    if start != "00:00":
-                        for mins, check_time in check_moments.items():
-                            if check_time == start:
-                                alert_id = f"{key}_{start}_poss_pre_{mins}"
-                                if alert_id not in alert_history:
-                                    msg = f"⚠️ **Увага! Через {mins} хв можливе відключення.**\nСіра зона графіку (до {end})."
-
-                                    # Використовуємо налаштування notify_outage (або можна створити окреме)
-                                    # Тут поки що прив'язано до сповіщень про відключення
-                                    await smart_broadcast(
-                                        bot,
-                                        key[0],
-                                        key[1],
-                                        msg,
-                                        msg,
-                                        lambda s, m=mins: s["notify_outage"] == 1
-                                        and s["notify_before"] == m,
-                                    )
-                                    # === НОВЕ: розсилка в групи ===
-                                    await group_broadcast(
-                                        bot,
-                                        key[0],
-                                        key[1],
-                                        msg,
-                                        msg,
-                                        lambda s, m=mins: s["notify_outage"] == 1
-                                        and s["notify_before"] == m,
-                                    )
-                                    alert_history.add(alert_id)
-
-                # --- 3. Стик днів (23:XX -> 00:00) ---
-                if tom_intervals and tom_intervals[0][0] == "00:00":
-                    start_tom, end_tom = tom_intervals[0]
-                    for mins, check_time in check_moments.items():
-                        if check_time == "00:00":
-                            alert_id = f"{key}_00:00_tom_pre_{mins}"
-                            if alert_id not in alert_history:
-                                end_display = "24:00" if end_tom == "24:00" else end_tom
-                                msg = f"⏳ **Скоро відключення (через {mins} хв, о 00:00).**\nСвітла не буде до **{end_display}**."
-
-                                await smart_broadcast(
-                                    bot,
-                                    key[0],
-                                    key[1],
-                                    msg,
-                                    msg,
-                                    lambda s, m=mins: s["notify_outage"] == 1
-                                    and s["notify_before"] == m,
-                                )
-                                # === НОВЕ: розсилка в групи ===
-                                await group_broadcast(
-                                    bot,
-                                    key[0],
-                                    key[1],
-                                    msg,
-                                    msg,
-                                    lambda s, m=mins: s["notify_outage"] == 1
-                                    and s["notify_before"] == m,
-                                )
-                                alert_history.add(alert_id)
-
-                # --- 4. СПОВІЩЕННЯ В МОМЕНТ ВКЛЮЧЕННЯ (Тільки після гарантованих) ---
-                for start, end in today_intervals:
-                    if curr_time == end and end != "24:00":
-                        alert_id = f"{key}_{end}_on"
-                        if alert_id not in alert_history:
-                            next_outage = find_next_outage(
-                                end, today_intervals, tom_intervals
-                            )
-                            next_info = (
-                                f"Наступне відключення: **{next_outage}**."
-                                if next_outage
-                                else "✅ Далі без відключень."
-                            )
-
-                            msg = (
-                                f"⚡️ **Світло повертається!**\n"
-                                f"Включення за графіком ({end}).\n"
-                                f"{next_info}"
-                            )
-
-                            await smart_broadcast(
-                                bot,
-                                key[0],
-                                key[1],
-                                msg,
-                                msg,
-                                lambda s: s["notify_return"] == 1,
-                            )
-                            # === НОВЕ: розсилка в групи ===
-                            await group_broadcast(
-                                bot,
-                                key[0],
-                                key[1],
-                                msg,
-                                msg,
-                                lambda s: s["notify_return"] == 1,
-                            )
-                            alert_history.add(alert_id)
+            for item in planned_alerts.pop_due(now):
+                if item.action == alert_plan.MIDNIGHT:
+                    # --- НОВА ДОБА: прибираємо історію за минулі дні ---
+                    today_str = item.fire_at.strftime("%Y-%m-%d")
+                    await db.cleanup_alert_history(today_str)
+                    alert_history.clear()
+                    await _load_alert_history(item.fire_at)
+                elif item.action == alert_plan.DIGEST:
+                    await _send_morning_digest(bot, now)
+                else:
+                    await _fire_alert(bot, item)
 
         except Exception as e:
             print(f"Alert Error: {e}")
-
-        await asyncio.sleep(60 - datetime.now().second)
+            await asyncio.sleep(5)
 
 
 # === НОВЕ: ФОНОВА ЗАДАЧА ДЛЯ БЕКАПУ ===
@@ -686,16 +467,25 @@ async def auto_backup(bot):
                 ADMIN_IDS[0] if isinstance(ADMIN_IDS, list) and ADMIN_IDS else ADMIN_IDS
             )
 
-            db_file = FSInputFile(DB_NAME)
-            caption = f"📦 **Автоматичний бекап бази даних**\n📅 {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+            # Узгоджена стиснута копія (SQLite backup API у окремому потоці)
+            path, size, sha256 = await db.backup_database(BACKUP_DIR, BACKUP_KEEP)
+            caption = (
+                f"📦 **Автоматичний бекап бази даних**\n"
+                f"📅 {datetime.now().strftime('%Y-%m-%d %H:%M')}\n"
+                f"🗜 {size / 1024:.1f} КБ (gzip)\n"
+                f"🔐 SHA-256: `{sha256}`"
+            )
 
             try:
                 await bot.send_document(
-                    admin_id, db_file, caption=caption, parse_mode="Markdown"
+                    admin_id, FSInputFile(path), caption=caption, parse_mode="Markdown"
                 )
                 print("✅ Бекап успішно відправлено!")
             except Exception as e:
                 print(f"Помилка відправки файлу: {e}")
+            finally:
+                if BACKUP_KEEP <= 0:
+                    os.remove(path)
 
             # Спимо трохи, щоб не відправити двічі в ту саму секунду (хоча timedelta захищає)
             await asyncio.sleep(60)
@@ -703,3 +493,15 @@ async def auto_backup(bot):
         except Exception as e:
             print(f"Backup Error: {e}")
             await asyncio.sleep(300)  # Якщо помилка, пробуємо через 5 хв
+
+
+async def flush_stats_loop():
+    """Періодично записує накопичену статистику відключень у базу."""
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        try:
+            written = await db.flush_stats()
+            if written:
+                print(f"📊 Статистика: записано {written} рядків")
+        except Exception as e:
+            print(f"Stats Flush Error: {e}")
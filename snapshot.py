@@ -0,0 +1,386 @@
+# snapshot.py
+import hashlib
+import itertools
+from datetime import datetime
+from types import MappingProxyType
+
+# Лічильник версій знімків (кожна нова публікація даних — нова версія)
+_version_counter = itertools.count(1)
+
+_EMPTY = MappingProxyType({})
+
+# === КОМПАКТНЕ ПРЕДСТАВЛЕННЯ ГРАФІКА (48 півгодинних слотів) ===
+SLOTS_PER_DAY = 48
+SLOT_MINUTES = 30
+MINUTES_PER_DAY = 24 * 60
+
+STATUS_ON = 1  # Світло є
+STATUS_OFF = 2  # Гарантоване відключення
+STATUS_POSSIBLE = 3  # Можливе відключення (сіра зона)
+
+
+def parse_hhmm(value):
+    """Час "HH:MM" → хвилини від початку доби ("24:00" → 1440, None — невірний формат)."""
+    if not isinstance(value, str) or len(value) != 5 or value[2] != ":":
+        return None
+    if value == "24:00":
+        return MINUTES_PER_DAY
+    hh, mm = value[:2], value[3:]
+    if not (hh.isdigit() and mm.isdigit()):
+        return None
+    hours, minutes = int(hh), int(mm)
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def format_minutes(minutes):
+    """Хвилини від початку доби → "HH:MM" (1440 → "24:00")."""
+    return f"{minutes // 60:02}:{minutes % 60:02}"
+
+
+def mask_runs(mask):
+    """Безперервні ділянки встановлених бітів: [(перший_слот, слот_після_останнього), ...]."""
+    runs = []
+    offset = 0
+    while mask:
+        # Пропускаємо нулі (кількість молодших нульових бітів)
+        zeros = (mask & -mask).bit_length() - 1
+        mask >>= zeros
+        offset += zeros
+        # Рахуємо одиниці поспіль
+        ones = (~mask & (mask + 1)).bit_length() - 1
+        runs.append((offset, offset + ones))
+        mask >>= ones
+        offset += ones
+    return runs
+
+
+class CompiledSchedule:
+    """Графік черги на одну дату, скомпільований один раз на знімок.
+
+    kind == "slots": графік API {"HH:MM": статус} → bytes з 48 кодів статусу + бітові маски.
+    kind == "ranges": графік сайту HOE ["HH:MM-HH:MM", ...] → інтервали в хвилинах.
+    Години, інтервали та інверсія рахуються цілочисельними операціями, без strptime.
+    """
+
+    __slots__ = (
+        "raw",
+        "kind",
+        "codes",
+        "ranges",
+        "fingerprint",
+        "_masks",
+        "_off_minutes",
+        "_memo",
+    )
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.codes = None
+        self.ranges = ()
+        self._masks = {}
+        self._off_minutes = 0
+        self._memo = {}
+
+        if isinstance(raw, list):
+            self.kind = "ranges"
+            self._compile_ranges(raw)
+        else:
+            self.kind = "slots"
+            self._compile_slots(raw if isinstance(raw, dict) else {})
+        self.fingerprint = self._make_fingerprint()
+
+    def _compile_slots(self, raw):
+        points = []
+        for key, value in raw.items():
+            if key == "24:00":
+                continue
+            minute = parse_hhmm(key)
+            if minute is None:
+                continue
+            code = value if isinstance(value, int) and 0 <= value < 256 else 0
+            points.append((minute // SLOT_MINUTES, code))
+        points.sort()
+
+        # Статус ключа діє до наступного ключа (останній — до 24:00)
+        codes = bytearray(SLOTS_PER_DAY)
+        for idx, (slot, code) in enumerate(points):
+            end = points[idx + 1][0] if idx + 1 < len(points) else SLOTS_PER_DAY
+            codes[slot:end] = bytes((code,)) * (end - slot)
+        self.codes = bytes(codes)
+
+        masks = {}
+        for slot, code in enumerate(self.codes):
+            if code:
+                masks[code] = masks.get(code, 0) | (1 << slot)
+        self._masks = masks
+
+    def _compile_ranges(self, raw):
+        ranges = []
+        total = 0
+        for item in raw:
+            try:
+                start, end = item.split("-")
+            except (AttributeError, ValueError):
+                continue
+            start_min = parse_hhmm(start)
+            end_min = parse_hhmm(end)
+            ranges.append((start, end, start_min, end_min))
+            if start_min is None or end_min is None:
+                continue
+            # "24:00" рахується як повна доба (як і раніше: 23:59 + 1 хв)
+            diff = end_min - start_min
+            if diff < 0:
+                diff += MINUTES_PER_DAY
+            total += diff
+        ranges.sort(key=lambda r: (r[0], r[1]))
+        self.ranges = tuple(ranges)
+        self._off_minutes = total
+
+    def _make_fingerprint(self):
+        """Стабільний відбиток структури графіка (однаковий між перезапусками)."""
+        h = hashlib.blake2b(digest_size=8)
+        if self.kind == "slots":
+            h.update(b"s")
+            h.update(self.codes)
+        else:
+            h.update(b"r")
+            h.update("\n".join(f"{r[0]}-{r[1]}" for r in self.ranges).encode())
+        return h.hexdigest()
+
+    def __bool__(self):
+        return bool(self.raw)
+
+    def mask(self, status):
+        """48-бітна маска слотів з указаним статусом (тільки для kind == "slots")."""
+        return self._masks.get(status, 0)
+
+    # --- Години ---
+    def hours(self, status):
+        if not self.raw:
+            return 0.0
+        if self.kind == "slots":
+            return self.mask(status).bit_count() * SLOT_MINUTES / 60
+        return round(self._off_minutes / 60, 1) if status == STATUS_OFF else 0
+
+    @property
+    def off_hours(self):
+        return self.hours(STATUS_OFF)
+
+    @property
+    def possible_hours(self):
+        return self.hours(STATUS_POSSIBLE) if self.kind == "slots" else 0
+
+    @property
+    def on_hours(self):
+        if not self.raw:
+            return 24.0
+        return max(0, 24.0 - self.off_hours - self.possible_hours)
+
+    # --- Інтервали ---
+    def interval_minutes(self, status):
+        """[(початок_хв, кінець_хв), ...] для статусу (кінець 1440 = "24:00")."""
+        key = ("min", status)
+        if key not in self._memo:
+            if self.kind == "slots":
+                result = [
+                    (start * SLOT_MINUTES, end * SLOT_MINUTES)
+                    for start, end in mask_runs(self.mask(status))
+                ]
+            elif status == STATUS_OFF:
+                # Інтервали з нерозпізнаним часом лишаються тільки в текстовому вигляді
+                result = [
+                    (r[2], r[3])
+                    for r in self.ranges
+                    if r[2] is not None and r[3] is not None
+                ]
+            else:
+                result = []
+            self._memo[key] = tuple(result)
+        return self._memo[key]
+
+    def intervals(self, status):
+        """[("HH:MM", "HH:MM"), ...] для статусу — як parse_intervals()."""
+        key = ("str", status)
+        if key not in self._memo:
+            if self.kind == "slots":
+                result = [
+                    (format_minutes(s), format_minutes(e))
+                    for s, e in self.interval_minutes(status)
+                ]
+            elif status == STATUS_OFF:
+                result = [(r[0], r[1]) for r in self.ranges]
+            else:
+                result = []
+            self._memo[key] = tuple(result)
+        return self._memo[key]
+
+    def light_intervals(self):
+        """Інтервали зі світлом: статус 1 для API, інверсія відключень для сайту."""
+        if self.kind == "slots":
+            return self.intervals(STATUS_ON)
+        if "light" not in self._memo:
+            self._memo["light"] = tuple(
+                (format_minutes(s), format_minutes(e))
+                for s, e in invert_minute_ranges(self.interval_minutes(STATUS_OFF))
+            )
+        return self._memo["light"]
+
+
+def invert_minute_ranges(blackouts):
+    """Доповнення відключень до доби: [(s, e), ...] у хвилинах → проміжки зі світлом."""
+    parsed = []
+    for start, end in blackouts:
+        if start is None or end is None:
+            continue
+        if end == 0 and start > 0:
+            end = MINUTES_PER_DAY
+        parsed.append((start, end))
+    parsed.sort()
+
+    light = []
+    last_end = 0
+    for start, end in parsed:
+        if start > last_end:
+            light.append((last_end, start))
+        last_end = max(last_end, end)
+    if last_end < MINUTES_PER_DAY:
+        light.append((last_end, MINUTES_PER_DAY))
+    return light
+
+
+_EMPTY_SLOTS = CompiledSchedule({})
+_EMPTY_RANGES = CompiledSchedule([])
+
+
+def compile_schedule(schedule_data):
+    """Повертає CompiledSchedule (вже скомпільований графік повертається як є)."""
+    if isinstance(schedule_data, CompiledSchedule):
+        return schedule_data
+    if not schedule_data:
+        return _EMPTY_RANGES if isinstance(schedule_data, list) else _EMPTY_SLOTS
+    return CompiledSchedule(schedule_data)
+
+
+def queue_sort_key(queue_id):
+    """Ключ сортування черг: "1.2" → [1, 2], "3" → [3, 0]. Нечислові — в кінець."""
+    try:
+        if "." in queue_id:
+            return [int(p) for p in queue_id.split(".")]
+        return [int(queue_id), 0]
+    except ValueError:
+        return [float("inf"), 0]
+
+
+class ScheduleSnapshot:
+    """Незмінний індексований знімок графіків, який публікує fetch_api_data().
+
+    Замість перебору data["regions"] на кожен запит:
+    - регіон → черга → дата → CompiledSchedule (O(1) пошук)
+    - відсортований список черг для кожного регіону (рахується один раз)
+    """
+
+    __slots__ = (
+        "version",
+        "created_at",
+        "data",
+        "region_names",
+        "emergency_regions",
+        "_regions",
+        "_queues",
+        "_fingerprints",
+    )
+
+    def __init__(self, data):
+        regions = {}
+        queues = {}
+        names = []
+        emergency = set()
+        fingerprints = {}
+
+        for region in (data or {}).get("regions", []):
+            name = region.get("name_ua")
+            if not name or name in regions:
+                continue
+            names.append(name)
+            if region.get("emergency", False):
+                emergency.add(name)
+
+            schedule = region.get("schedule")
+            if not isinstance(schedule, dict):
+                schedule = {}
+            # Кожен (черга, дата) компілюється один раз на знімок
+            regions[name] = MappingProxyType(
+                {
+                    queue_id: MappingProxyType(
+                        {
+                            date_str: compile_schedule(raw)
+                            for date_str, raw in dates.items()
+                            if raw is not None
+                        }
+                        if isinstance(dates, dict)
+                        else {}
+                    )
+                    for queue_id, dates in schedule.items()
+                }
+            )
+            queues[name] = tuple(sorted(schedule.keys(), key=queue_sort_key))
+            for queue_id, dates in regions[name].items():
+                for date_str, compiled in dates.items():
+                    fingerprints[(name, queue_id, date_str)] = compiled.fingerprint
+
+        object.__setattr__(self, "version", next(_version_counter))
+        object.__setattr__(self, "created_at", datetime.now())
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "region_names", tuple(names))
+        object.__setattr__(self, "emergency_regions", frozenset(emergency))
+        object.__setattr__(self, "_regions", MappingProxyType(regions))
+        object.__setattr__(self, "_queues", MappingProxyType(queues))
+        object.__setattr__(self, "_fingerprints", MappingProxyType(fingerprints))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ScheduleSnapshot є незмінним")
+
+    def __bool__(self):
+        return bool(self.region_names)
+
+    def has_region(self, region):
+        return region in self._regions
+
+    def region_at(self, idx):
+        """Назва регіону за індексом (для callback_data груп) або None."""
+        if 0 <= idx < len(self.region_names):
+            return self.region_names[idx]
+        return None
+
+    def queues(self, region):
+        """Відсортовані черги регіону (порожній кортеж, якщо регіону немає)."""
+        return self._queues.get(region, ())
+
+    def dates(self, region, queue):
+        """Скомпільовані графіки черги по датах: {date: CompiledSchedule}."""
+        return self._regions.get(region, _EMPTY).get(queue, _EMPTY)
+
+    def schedule(self, region, queue, date_str):
+        """Скомпільований графік черги на дату або None."""
+        return self._regions.get(region, _EMPTY).get(queue, _EMPTY).get(date_str)
+
+    def fingerprint(self, region, queue, date_str):
+        """Відбиток графіка черги на дату або None."""
+        return self._fingerprints.get((region, queue, date_str))
+
+    def changed_since(self, prev):
+        """Множина (регіон, черга, дата), чий графік змінився/з'явився/зник відносно prev.
+
+        prev=None — змінилось усе (перший запуск).
+        """
+        if prev is None:
+            return frozenset(self._fingerprints)
+        if prev is self:
+            return frozenset()
+        current = self._fingerprints
+        previous = prev._fingerprints
+        changed = {key for key, fp in current.items() if previous.get(key) != fp}
+        changed.update(key for key in previous if key not in current)
+        return frozenset(changed)
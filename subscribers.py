@@ -0,0 +1,231 @@
+# subscribers.py
+
+# Типи сповіщень (доступні також як database.NOTIFY_*)
+NOTIFY_CHANGES = "changes"
+NOTIFY_OUTAGE = "outage"
+NOTIFY_RETURN = "return"
+
+USER_DEFAULTS = {
+    "active": 1,
+    "display_mode": "blackout",
+    "notify_changes": 1,
+    "notify_outage": 1,
+    "notify_before": 5,
+    "notify_return": 1,
+    "notify_return_before": 0,
+}
+
+GROUP_DEFAULTS = dict(USER_DEFAULTS, notify_morning=1)
+
+
+def _value(record, key, defaults):
+    value = record.get(key)
+    return defaults[key] if value is None else value
+
+
+def _bucket_keys(record, defaults):
+    """Кошики (регіон, черга, тип, хвилини), у які потрапляє підписник."""
+    if not _value(record, "active", defaults):
+        return set()
+    region, queue = record.get("region"), record.get("queue")
+    keys = set()
+    if _value(record, "notify_changes", defaults) == 1:
+        keys.add((region, queue, NOTIFY_CHANGES, None))
+    if _value(record, "notify_outage", defaults) == 1:
+        keys.add((region, queue, NOTIFY_OUTAGE, None))
+        keys.add(
+            (region, queue, NOTIFY_OUTAGE, _value(record, "notify_before", defaults))
+        )
+    if _value(record, "notify_return", defaults) == 1:
+        keys.add((region, queue, NOTIFY_RETURN, None))
+        keys.add(
+            (
+                region,
+                queue,
+                NOTIFY_RETURN,
+                _value(record, "notify_return_before", defaults),
+            )
+        )
+    return keys
+
+
+class _Bucketed:
+    """Записи підписників + кошики { (region, queue, kind, offset): {chat_id} }.
+
+    queues — { (region, queue): скільки підписників отримують хоч якісь сповіщення }.
+    put / update / remove повертають черги, які з'явились у queues або зникли з нього.
+    """
+
+    def __init__(self, defaults):
+        self.defaults = defaults
+        self.records = {}
+        self.buckets = {}
+        self.queues = {}
+        self._keys = {}
+
+    def put(self, chat_id, record):
+        old_queue = self._unlink(chat_id)
+        self.records[chat_id] = record
+        keys = _bucket_keys(record, self.defaults)
+        for key in keys:
+            self.buckets.setdefault(key, set()).add(chat_id)
+        self._keys[chat_id] = keys
+        new_queue = None
+        if keys:
+            new_queue = (record.get("region"), record.get("queue"))
+            self.queues[new_queue] = self.queues.get(new_queue, 0) + 1
+
+        # Зміна налаштувань у тій самій черзі набір черг не змінює
+        changed = set()
+        if old_queue is not None and old_queue not in self.queues:
+            changed.add(old_queue)
+        if new_queue is not None and new_queue != old_queue:
+            if self.queues[new_queue] == 1:
+                changed.add(new_queue)
+        return changed
+
+    def update(self, chat_id, fields, create=False):
+        record = self.records.get(chat_id)
+        if record is None:
+            if not create:
+                return set()
+            record = {}
+        return self.put(chat_id, {**record, **fields})
+
+    def remove(self, chat_id):
+        old_queue = self._unlink(chat_id)
+        self.records.pop(chat_id, None)
+        if old_queue is not None and old_queue not in self.queues:
+            return {old_queue}
+        return set()
+
+    def recipients(self, region, queue, kind, offset=None):
+        ids = self.buckets.get((region, queue, kind, offset), ())
+        return [
+            (chat_id, _value(self.records[chat_id], "display_mode", self.defaults))
+            for chat_id in ids
+        ]
+
+    def _unlink(self, chat_id):
+        keys = self._keys.pop(chat_id, ())
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(chat_id)
+                if not bucket:
+                    del self.buckets[key]
+        if not keys:
+            return None
+        queue_key = next(iter(keys))[:2]
+        left = self.queues.get(queue_key, 1) - 1
+        if left > 0:
+            self.queues[queue_key] = left
+        else:
+            self.queues.pop(queue_key, None)
+        return queue_key
+
+
+class SubscriberIndex:
+    """Індекс підписників у пам'яті: хто з користувачів і груп отримує сповіщення.
+
+    Завантажується з бази один раз (load), далі оновлюється функціями database.py,
+    що змінюють підписки та налаштування. Розсилка бере отримувачів зі словника,
+    без запитів до SQLite.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.users = _Bucketed(USER_DEFAULTS)
+        self.groups = _Bucketed(GROUP_DEFAULTS)
+        self._listeners = []
+
+    def load(self, user_rows, group_rows):
+        """user_rows/group_rows — словники з колонками таблиць users / group_subscriptions."""
+        self.users = _Bucketed(USER_DEFAULTS)
+        self.groups = _Bucketed(GROUP_DEFAULTS)
+        for row in user_rows:
+            row = dict(row)
+            self.users.put(row.pop("chat_id"), row)
+        for row in group_rows:
+            row = dict(row)
+            self.groups.put(row.pop("chat_id"), row)
+        self.ready = True
+        self._queues_changed()
+
+    def on_queues_change(self, listener):
+        """Підписує listener() на зміну набору черг, у яких є підписники."""
+        self._listeners.append(listener)
+        return listener
+
+    def _users_changed(self, queues):
+        # Черга, що є в групах, для спільного набору не з'являлась і не зникала
+        if self.ready and any(key not in self.groups.queues for key in queues):
+            self._queues_changed()
+
+    def _groups_changed(self, queues):
+        if self.ready and any(key not in self.users.queues for key in queues):
+            self._queues_changed()
+
+    def _queues_changed(self):
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"⚠️ Subscriber listener error: {e}")
+
+    # --- Користувачі ---
+    def save_user(self, user_id, region, queue):
+        self._users_changed(
+            self.users.update(
+                user_id, {"region": region, "queue": queue, "active": 1}, create=True
+            )
+        )
+
+    def update_user(self, user_id, **fields):
+        self._users_changed(self.users.update(user_id, fields))
+
+    def remove_user(self, user_id):
+        self._users_changed(self.users.remove(user_id))
+
+    def user_recipients(self, region, queue, kind, offset=None):
+        return self.users.recipients(region, queue, kind, offset)
+
+    # --- Групи / канали ---
+    def save_group(self, chat_id, region, queue):
+        self._groups_changed(
+            self.groups.update(chat_id, {"region": region, "queue": queue}, create=True)
+        )
+
+    def update_group(self, chat_id, **fields):
+        self._groups_changed(self.groups.update(chat_id, fields))
+
+    def remove_group(self, chat_id):
+        self._groups_changed(self.groups.remove(chat_id))
+
+    def group_recipients(self, region, queue, kind, offset=None):
+        return self.groups.recipients(region, queue, kind, offset)
+
+    # --- Черги ---
+    def has_queue(self, region, queue):
+        """Чи є в черзі хоч один користувач або група, яким щось надсилається.
+
+        Поки індекс не завантажено — True (отримувачів тоді шукає SQL).
+        """
+        if not self.ready:
+            return True
+        key = (region, queue)
+        return key in self.users.queues or key in self.groups.queues
+
+    def has_recipients(self, region, queue, kind, offset=None):
+        """Чи отримає хтось (користувач або група) сповіщення kind/offset черги."""
+        if not self.ready:
+            return True
+        key = (region, queue, kind, offset)
+        return key in self.users.buckets or key in self.groups.buckets
+
+    def stats(self):
+        return {
+            "users": len(self.users.records),
+            "groups": len(self.groups.records),
+            "buckets": len(self.users.buckets) + len(self.groups.buckets),
+        }
@@ -0,0 +1,26 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# Модулі бота лежать у корені репозиторію
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Обов'язкові змінні config.py (без .env тести теж мають імпортувати database)
+for _name, _value in (
+    ("FAILOVER_TIMEOUT", "10"),
+    ("RECOVERY_CHECK_INTERVAL", "300"),
+    ("UPDATE_INTERVAL", "60"),
+    ("DB_NAME", ":memory:"),
+):
+    os.environ.setdefault(_name, _value)
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """database з пулом на тимчасовому файлі (кілька з'єднань бачать одну базу)."""
+    import database
+
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "bot.db"))
+    return database
@@ -0,0 +1,64 @@
+# tests/test_alert_plan.py
+from datetime import datetime
+
+from alert_plan import ALERT, AlertPlan, build_queue_alerts
+from snapshot import STATUS_OFF, compile_schedule
+
+DAY = "2026-10-16"
+
+
+def _alert_ids(items):
+    return {item.alert_id for item in items if item.action == ALERT}
+
+
+def test_ranges_with_bad_start_are_skipped():
+    items = build_queue_alerts(
+        "1.1", {"date": DAY, "today": ["10:00-12:00", "1x:00-14:00"]}
+    )
+    ids = _alert_ids(items)
+    assert f"1.1_{DAY}_10:00_out_pre_15" in ids
+    assert f"1.1_{DAY}_12:00_on" in ids
+    assert not any("14:00" in alert_id for alert_id in ids)
+
+
+def test_ranges_with_bad_end_are_skipped():
+    schedule = compile_schedule(["10:00-12:00", "13:00-1x:00"])
+    assert schedule.interval_minutes(STATUS_OFF) == ((600, 720),)
+    items = build_queue_alerts(
+        "1.1", {"date": DAY, "today": ["10:00-12:00", "13:00-1x:00"]}
+    )
+    assert not any("13:00" in alert_id for alert_id in _alert_ids(items))
+
+
+def test_refresh_keeps_planning_other_queues():
+    plan = AlertPlan()
+    cache = {
+        "1.1": {"date": DAY, "today": ["1x:00-14:00", "15:00-16:00"]},
+        "1.2": {"date": DAY, "today": ["18:00-20:00"]},
+    }
+    plan.refresh(cache, now=datetime(2026, 10, 16, 0, 30))
+    keys = {entry[3].key for entry in plan._heap if entry[3].key}
+    assert keys == {"1.1", "1.2"}
+
+
+def test_refresh_plans_only_wanted_queues():
+    subscribed = {"1.2"}
+    plan = AlertPlan(wanted=lambda key: key in subscribed)
+    cache = {
+        "1.1": {"date": DAY, "today": ["10:00-12:00"]},
+        "1.2": {"date": DAY, "today": ["18:00-20:00"]},
+    }
+    now = datetime(2026, 10, 16, 0, 30)
+    plan.refresh(cache, now=now)
+    assert {entry[3].key for entry in plan._heap if entry[3].key} == {"1.2"}
+
+    # Підписка на нову чергу і відписка від старої
+    subscribed.clear()
+    subscribed.add("1.1")
+    assert plan.refresh(cache, now=now) == 2
+    live = {
+        item.key
+        for _, _, gen, item in plan._heap
+        if item.key and not plan._is_stale(gen, item)
+    }
+    assert live == {"1.1"}
@@ -0,0 +1,394 @@
+# tests/test_delivery.py
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiogram.methods import SendMessage
+
+import delivery
+from delivery import DeliveryEngine, TokenBucket
+
+
+class FakeBot:
+    """Замість Telegram: запам'ятовує відправлене; fail(chat_id, text) може кинути виняток."""
+
+    def __init__(self, fail=None, delay=0):
+        self.sent = []
+        self.times = []
+        self.fail = fail
+        self.delay = delay
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail is not None:
+            self.fail(chat_id, text)
+        self.sent.append((chat_id, text))
+        self.times.append(time.monotonic())
+
+
+def _engine(**kwargs):
+    kwargs.setdefault("rate", 1000)
+    kwargs.setdefault("workers", 4)
+    kwargs.setdefault("chat_interval", 0)
+    kwargs.setdefault("group_interval", 0)
+    return DeliveryEngine(**kwargs)
+
+
+def _method(chat_id=1):
+    return SendMessage(chat_id=chat_id, text="x")
+
+
+def _run(database, body):
+    async def main():
+        await database.init_db()
+        try:
+            return await body()
+        finally:
+            await database.close_db()
+
+    return asyncio.run(main())
+
+
+# === OUTBOX ===
+def test_delivered_messages_are_acked_from_outbox(db_file):
+    bot = FakeBot()
+
+    async def body():
+        engine = _engine()
+        await engine.start(bot)
+        batch = await engine.submit([(1, "a"), (2, "b"), (3, "c")])
+        await batch.wait()
+        await engine.stop()
+        return batch, await db_file.outbox_pending()
+
+    batch, pending = _run(db_file, body)
+    assert (batch.sent, batch.failed) == (3, 0)
+    assert sorted(bot.sent) == [(1, "a"), (2, "b"), (3, "c")]
+    assert pending == []
+
+
+def test_undelivered_messages_resume_on_start(db_file):
+    stuck = FakeBot(delay=3600)
+    bot = FakeBot()
+
+    async def body():
+        engine = _engine(workers=1)
+        await engine.start(stuck)
+        await engine.submit([(1, "перше"), (2, "друге")])
+        await asyncio.sleep(0.05)
+        await engine.stop()
+        left = await db_file.outbox_pending()
+
+        # "Рестарт": новий рушій дочитує outbox при старті
+        engine = _engine()
+        await engine.start(bot)
+        while engine.pending() or len(bot.sent) < 2:
+            await asyncio.sleep(0.01)
+        await engine.stop()
+        return left, await db_file.outbox_pending()
+
+    left, pending = _run(db_file, body)
+    assert [row[2] for row in left] == ["перше", "друге"]
+    assert sorted(bot.sent) == [(1, "перше"), (2, "друге")]
+    assert pending == []
+
+
+def test_stop_during_ack_flush_keeps_acks(db_file, monkeypatch):
+    monkeypatch.setattr(delivery, "_ACK_INTERVAL", 0.01)
+    real_ack = db_file.outbox_ack
+    bot = FakeBot()
+
+    async def body():
+        flushing = asyncio.Event()
+
+        async def slow_ack(ids):
+            flushing.set()
+            await asyncio.sleep(0.1)
+            await real_ack(ids)
+
+        monkeypatch.setattr(db_file, "outbox_ack", slow_ack)
+        engine = _engine()
+        await engine.start(bot)
+        batch = await engine.submit([(1, "a"), (2, "b")])
+        await batch.wait()
+        await flushing.wait()
+        await engine.stop()
+        return await db_file.outbox_pending()
+
+    assert _run(db_file, body) == []
+    assert len(bot.sent) == 2
+
+
+# === РУШІЙ РОЗСИЛКИ ===
+def test_chat_interval_spaces_messages_to_one_chat(db_file):
+    bot = FakeBot()
+
+    async def body():
+        engine = _engine(chat_interval=0.1, group_interval=0.2)
+        await engine.start(bot)
+        private = await engine.submit([(1, "a"), (1, "b"), (1, "c"), (2, "d")])
+        await private.wait()
+        private_times = [t for (cid, _), t in zip(bot.sent, bot.times) if cid == 1]
+        bot.sent.clear()
+        bot.times.clear()
+        groups = await engine.submit([(-5, "e"), (-5, "f")], is_group=True)
+        await groups.wait()
+        await engine.stop()
+        return private_times, list(bot.times)
+
+    private_times, group_times = _run(db_file, body)
+    gaps = [b - a for a, b in zip(private_times, private_times[1:])]
+    assert len(gaps) == 2 and min(gaps) >= 0.09
+    assert group_times[1] - group_times[0] >= 0.19
+
+
+def test_queue_serves_higher_priority_and_earlier_deadline_first(db_file):
+    bot = FakeBot(delay=0.05)
+
+    async def body():
+        engine = _engine(workers=1)
+        await engine.start(bot)
+        # Перше повідомлення займає єдиного відправника, решта чекає в черзі
+        first = await engine.submit([(1, "first")], priority=delivery.BULK)
+        await asyncio.sleep(0.01)
+        now = datetime.now()
+        batches = [
+            await engine.submit([(2, "bulk")], priority=delivery.BULK),
+            await engine.submit([(3, "digest")], priority=delivery.DIGEST),
+            await engine.submit(
+                [(4, "alert-late")],
+                priority=delivery.ALERT,
+                deadline=now + timedelta(hours=1),
+            ),
+            await engine.submit([(5, "change")], priority=delivery.CHANGE),
+            await engine.submit(
+                [(6, "alert-soon")],
+                priority=delivery.ALERT,
+                deadline=now + timedelta(minutes=1),
+            ),
+        ]
+        for batch in [first, *batches]:
+            await batch.wait()
+        await engine.stop()
+
+    _run(db_file, body)
+    assert [text for _, text in bot.sent] == [
+        "first",
+        "alert-soon",
+        "alert-late",
+        "change",
+        "digest",
+        "bulk",
+    ]
+
+
+def test_batch_counts_sent_and_failed(db_file):
+    def fail(chat_id, text):
+        if chat_id == 2:
+            raise TelegramBadRequest(_method(chat_id), "chat not found")
+
+    bot = FakeBot(fail=fail)
+
+    async def body():
+        engine = _engine()
+        await engine.start(bot)
+        batch = await engine.submit([(1, "a"), (2, "b"), (3, "c")])
+        await batch.wait()
+        await engine.stop()
+        return batch, dict(engine.stats)
+
+    batch, stats = _run(db_file, body)
+    assert (batch.total, batch.sent, batch.failed) == (3, 2, 1)
+    assert (stats["sent"], stats["failed"]) == (2, 1)
+
+
+def test_empty_batch_is_done_immediately(db_file):
+    async def body():
+        engine = _engine()
+        await engine.start(FakeBot())
+        batch = await asyncio.wait_for(engine.submit([]), 1)
+        await asyncio.wait_for(batch.wait(), 1)
+        await engine.stop()
+        return batch
+
+    batch = _run(db_file, body)
+    assert (batch.sent, batch.failed) == (0, 0)
+
+
+# === FLOOD CONTROL / ПОВТОРИ ===
+def _retry_after(seconds, chat_id=1):
+    return TelegramRetryAfter(_method(chat_id), "Flood control exceeded", seconds)
+
+
+def test_throttle_halves_rate_once_per_pause_window():
+    engine = _engine(rate=30)
+    engine._bucket = TokenBucket(30)
+    engine._throttle(5)
+    # RetryAfter на запити, що вже були в дорозі, лише подовжують паузу
+    engine._throttle(7)
+    assert engine.current_rate == 15
+    assert engine._bucket.paused_until - time.monotonic() > 6
+    assert engine.stats["throttled"] == 2
+
+    engine._bucket.paused_until = 0  # пауза минула
+    engine._throttle(1)
+    assert engine.current_rate == 7.5
+
+
+def test_throttle_never_goes_below_min_rate():
+    engine = _engine(rate=2)
+    engine._bucket = TokenBucket(2)
+    for _ in range(5):
+        engine._bucket.paused_until = 0
+        engine._throttle(0)
+    assert engine.current_rate == delivery._MIN_RATE
+
+
+def test_retry_after_pauses_all_senders(db_file):
+    calls = []
+
+    def fail(chat_id, text):
+        calls.append(time.monotonic())
+        if len(calls) == 3:
+            raise _retry_after(1, chat_id)
+
+    bot = FakeBot(fail=fail)
+
+    async def body():
+        engine = _engine(workers=8)
+        await engine.start(bot)
+        batch = await engine.submit([(chat_id, "x") for chat_id in range(12)])
+        await batch.wait()
+        await engine.stop()
+        return batch, dict(engine.stats)
+
+    batch, stats = _run(db_file, body)
+    flood_at = calls[2]
+    assert (batch.sent, batch.failed) == (12, 0)
+    assert stats["throttled"] == 1
+    # Жодної відправки під час паузи — навіть від тих, хто вже чекав токен
+    assert all(t <= flood_at or t >= flood_at + 0.95 for t in bot.times)
+
+
+def test_retry_after_requeues_until_delivered(db_file):
+    attempts = []
+
+    def fail(chat_id, text):
+        attempts.append(chat_id)
+        if len(attempts) <= delivery.DELIVERY_MAX_ATTEMPTS + 2:
+            raise _retry_after(0, chat_id)
+
+    bot = FakeBot(fail=fail)
+
+    async def body():
+        engine = _engine(rate=1000)
+        await engine.start(bot)
+        batch = await engine.submit([(1, "важливе")], priority=delivery.ALERT)
+        await batch.wait()
+        await engine.stop()
+        return batch, await db_file.outbox_pending()
+
+    batch, pending = _run(db_file, body)
+    assert (batch.sent, batch.failed) == (1, 0)
+    assert len(attempts) == delivery.DELIVERY_MAX_ATTEMPTS + 3
+    assert bot.sent == [(1, "важливе")]
+    assert pending == []
+
+
+def test_retry_after_drops_alert_once_its_event_passed(db_file):
+    def fail(chat_id, text):
+        raise _retry_after(0, chat_id)
+
+    bot = FakeBot(fail=fail)
+
+    async def body():
+        engine = _engine(rate=1000)
+        await engine.start(bot)
+        batch = await engine.submit(
+            [(1, "через {mins} хв")],
+            priority=delivery.ALERT,
+            event_at=datetime.now() + timedelta(seconds=0.5),
+        )
+        await asyncio.wait_for(batch.wait(), 5)
+        await engine.stop()
+        return batch, dict(engine.stats)
+
+    batch, stats = _run(db_file, body)
+    assert (batch.sent, batch.failed) == (0, 1)
+    assert stats["expired"] == 1
+
+
+def test_network_errors_stop_after_max_attempts(db_file, monkeypatch):
+    monkeypatch.setattr(delivery, "DELIVERY_MAX_ATTEMPTS", 3)
+    attempts = []
+
+    def fail(chat_id, text):
+        attempts.append(chat_id)
+        raise TelegramNetworkError(_method(chat_id), "connection reset")
+
+    bot = FakeBot(fail=fail)
+
+    async def body():
+        engine = _engine()
+        # Без експоненційної затримки між повторами (1, 2, 4... с)
+        monkeypatch.setattr(
+            engine, "_retry", lambda msg, delay=0: DeliveryEngine._retry(engine, msg)
+        )
+        await engine.start(bot)
+        batch = await engine.submit([(1, "x")])
+        await batch.wait()
+        await engine.stop()
+        return batch, dict(engine.stats)
+
+    batch, stats = _run(db_file, body)
+    assert len(attempts) == 3
+    assert (batch.sent, batch.failed) == (0, 1)
+    assert stats["retried"] == 2
+
+
+# === АКТУАЛЬНІСТЬ ПОВІДОМЛЕНЬ ===
+def _message(text="текст", event_at=None, deadline=None, priority=delivery.ALERT):
+    return delivery.OutboundMessage(
+        1, text, False, None, priority, event_at=event_at, deadline=deadline
+    )
+
+
+def test_render_plain_message_is_unchanged():
+    now = datetime(2026, 10, 16, 12, 0)
+    assert _message("без {mins} дедлайну").render(now) == "без {mins} дедлайну"
+
+
+def test_render_substitutes_minutes_left_until_event():
+    now = datetime(2026, 10, 16, 12, 0)
+    msg = _message("через {mins} хв", event_at=now + timedelta(minutes=15))
+    assert msg.render(now) == "через 15 хв"
+    # Затримка в черзі: хвилини рахуються на момент відправки (з округленням угору)
+    assert msg.render(now + timedelta(minutes=3, seconds=30)) == "через 12 хв"
+    assert msg.render(now + timedelta(minutes=14, seconds=59)) == "через 1 хв"
+
+
+def test_render_expires_at_event():
+    now = datetime(2026, 10, 16, 12, 0)
+    msg = _message("через {mins} хв", event_at=now + timedelta(minutes=5))
+    assert msg.render(now + timedelta(minutes=5)) is None
+    assert msg.render(now + timedelta(minutes=6)) is None
+
+
+def test_render_expires_after_deadline():
+    now = datetime(2026, 10, 16, 12, 0)
+    msg = _message("Світло повертається!", deadline=now + timedelta(minutes=15))
+    assert msg.render(now + timedelta(minutes=15)) == "Світло повертається!"
+    assert msg.render(now + timedelta(minutes=15, seconds=1)) is None
+
+
+def test_due_orders_by_event_or_deadline():
+    now = datetime(2026, 10, 16, 12, 0)
+    soon = _message(event_at=now + timedelta(minutes=5))
+    later = _message(deadline=now + timedelta(minutes=30))
+    assert soon.due < later.due < _message().due
@@ -0,0 +1,35 @@
+# tests/test_query_plans.py
+import asyncio
+
+import aiosqlite
+
+import database
+
+
+async def _plan_problems():
+    async with aiosqlite.connect(":memory:") as conn:
+        await database._apply_migrations(conn)
+        return await database._query_plan_problems(conn)
+
+
+def test_hot_queries_use_indexes():
+    assert asyncio.run(_plan_problems()) == []
+
+
+def test_hot_queries_cover_every_recipient_variant():
+    names = {name for name, _, _ in database._hot_queries()}
+    for kind in (database.NOTIFY_CHANGES, database.NOTIFY_OUTAGE, database.NOTIFY_RETURN):
+        assert f"get_queue_recipients[{kind}, None]" in names
+        assert f"get_group_recipients[{kind}, None]" in names
+    assert f"get_queue_recipients[{database.NOTIFY_OUTAGE}, 5]" in names
+
+
+def test_plan_check_detects_table_scan():
+    async def run():
+        async with aiosqlite.connect(":memory:") as conn:
+            await database._apply_migrations(conn)
+            await conn.execute("DROP INDEX idx_users_region_queue")
+            return await database._query_plan_problems(conn)
+
+    problems = asyncio.run(run())
+    assert any(p.startswith("get_users_by_queue: SCAN users") for p in problems)
@@ -0,0 +1,91 @@
+# tests/test_subscribers.py
+from subscribers import NOTIFY_OUTAGE, SubscriberIndex
+
+
+def _index():
+    index = SubscriberIndex()
+    index.load(
+        [
+            {"chat_id": 1, "region": "Київ", "queue": "1.1", "active": 1},
+            {"chat_id": 2, "region": "Київ", "queue": "1.1", "active": 1},
+        ],
+        [{"chat_id": -10, "region": "Київ", "queue": "2.1"}],
+    )
+    return index
+
+
+def test_has_queue_before_load_is_conservative():
+    assert SubscriberIndex().has_queue("Київ", "9.9")
+
+
+def test_has_queue_tracks_users_and_groups():
+    index = _index()
+    assert index.has_queue("Київ", "1.1")
+    assert index.has_queue("Київ", "2.1")
+    assert not index.has_queue("Київ", "3.1")
+
+
+def test_has_queue_follows_moves_and_deactivation():
+    index = _index()
+    index.save_user(1, "Київ", "3.1")
+    assert index.has_queue("Київ", "3.1")
+    assert index.has_queue("Київ", "1.1")
+    index.update_user(2, active=0)
+    assert not index.has_queue("Київ", "1.1")
+    index.remove_group(-10)
+    assert not index.has_queue("Київ", "2.1")
+
+
+def test_has_queue_ignores_subscribers_with_everything_off():
+    index = _index()
+    index.update_user(1, notify_changes=0, notify_outage=0, notify_return=0)
+    index.update_user(2, notify_changes=0, notify_outage=0, notify_return=0)
+    assert not index.has_queue("Київ", "1.1")
+    index.update_user(2, notify_outage=1)
+    assert index.has_queue("Київ", "1.1")
+    assert index.user_recipients("Київ", "1.1", NOTIFY_OUTAGE) == [(2, "blackout")]
+
+
+def test_has_recipients_matches_offset():
+    index = _index()
+    assert index.has_recipients("Київ", "1.1", NOTIFY_OUTAGE, 5)
+    assert not index.has_recipients("Київ", "1.1", NOTIFY_OUTAGE, 60)
+    assert not index.has_recipients("Київ", "3.1", NOTIFY_OUTAGE)
+
+
+def test_queue_listeners_fire_on_first_and_last_subscriber():
+    index = _index()
+    calls = []
+    index.on_queues_change(lambda: calls.append(1))
+    index.save_user(3, "Київ", "1.1")
+    assert calls == []
+    index.save_user(3, "Київ", "4.1")
+    assert len(calls) == 1
+    index.remove_user(3)
+    assert len(calls) == 2
+
+
+def test_queue_listeners_ignore_settings_only_updates():
+    index = SubscriberIndex()
+    index.load([{"chat_id": 1, "region": "Київ", "queue": "5.1", "active": 1}], [])
+    calls = []
+    index.on_queues_change(lambda: calls.append(1))
+    # Єдиний підписник черги змінює налаштування — набір черг той самий
+    index.update_user(1, notify_before=15)
+    index.update_user(1, display_mode="light")
+    index.save_user(1, "Київ", "5.1")
+    assert calls == []
+    # Переїзд у нову чергу: одна зміна набору — один виклик
+    index.save_user(1, "Київ", "6.1")
+    assert len(calls) == 1
+
+
+def test_queue_listeners_skip_queues_still_covered_by_groups():
+    index = _index()
+    index.save_group(-20, "Київ", "1.1")
+    calls = []
+    index.on_queues_change(lambda: calls.append(1))
+    index.remove_user(1)
+    index.remove_user(2)
+    assert calls == []
+    assert index.has_queue("Київ", "1.1")